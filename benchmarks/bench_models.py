@@ -0,0 +1,75 @@
+from contextlib import nullcontext
+from datetime import timedelta
+
+import pytest
+
+from django.utils import timezone
+
+from bgtask.models import BackgroundTask
+from django_app.models import ModelWithBackgroundActions
+from taskdata import create_tasks
+
+
+pytestmark = pytest.mark.django_db
+
+# How many tasks' positions are read at once, as for a page of tasks
+NUM_POSITIONS_READ = 100
+
+
+@pytest.mark.parametrize("buffered", [False, True])
+def bench_record_steps(benchmark, size, buffered):
+    task = BackgroundTask.objects.create(name="A task")
+    task.start()
+    task.set_steps_to_complete(size)
+
+    def record_step(ii):
+        if ii % 100 == 99:
+            task.steps_failed(1, steps_identifier=ii, error=ValueError(f"Item {ii} failed"))
+        else:
+            task.add_successful_steps(1)
+
+    with task.progress_buffer(flush_every_n=100) if buffered else nullcontext():
+        benchmark(record_step, size, buffered=buffered)
+
+    task.refresh_from_db()
+    assert task.steps_completed == size
+
+
+@pytest.mark.parametrize("num_names", [1, 10, 100])
+def bench_add_position_in_queue(benchmark, size, num_names):
+    queued_at = timezone.now() - timedelta(days=1)
+    create_tasks(
+        size,
+        name=lambda ii: f"Task {ii % num_names}",
+        state=BackgroundTask.STATES.queued,
+        queued_at=lambda ii: queued_at + timedelta(milliseconds=ii),
+    )
+    # Spread across the queues, from the front to the back
+    step = max(size // NUM_POSITIONS_READ, 1)
+    task_ids = list(BackgroundTask.objects.values_list("id", flat=True)[::step])
+
+    def read_positions(ii):
+        tasks = BackgroundTask.objects.filter(id__in=task_ids).add_position_in_queue()
+        assert all(task.position_in_queue is not None for task in tasks)
+
+    benchmark(read_positions, 20, num_tasks=size, num_names=num_names)
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+def bench_queue_tasks_for_objects(benchmark, size, bulk):
+    ModelWithBackgroundActions.objects.bulk_create(
+        ModelWithBackgroundActions(name=f"Object {ii}") for ii in range(size)
+    )
+    objs = list(ModelWithBackgroundActions.objects.all())
+
+    def queue_tasks(ii):
+        if bulk:
+            BackgroundTask.objects.bulk_queue(f"Task {ii}", objs)
+            return
+        for obj in objs:
+            task = BackgroundTask.objects.create(name=f"Task {ii}", content_object=obj)
+            task.queue()
+
+    # Each operation queues a task for each object
+    benchmark(queue_tasks, 3, num_objects=size, bulk=bulk)
+    assert BackgroundTask.objects.filter(state=BackgroundTask.STATES.queued).count() == 3 * size
@@ -0,0 +1,20 @@
+"""The test site's settings, but with an SQLite database unless BGTASK_BENCHMARK_DATABASE is
+"postgresql", in which case the test site's Postgres database is used.
+"""
+
+import os
+
+from django_site.settings import *  # noqa: F401,F403
+from django_site.settings import BASE_DIR
+
+
+if os.environ.get("BGTASK_BENCHMARK_DATABASE", "sqlite") != "postgresql":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BASE_DIR / "bgtask-benchmarks.sqlite3",
+        }
+    }
+
+# Logging every query would dominate the timings
+LOGGING = {"version": 1, "disable_existing_loggers": False}
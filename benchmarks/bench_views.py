@@ -0,0 +1,70 @@
+import random
+from datetime import timedelta
+
+import pytest
+
+from django.contrib import admin
+from django.urls import reverse
+from django.utils import timezone
+
+from bgtask.models import BackgroundTask
+from django_app.models import ModelWithBackgroundActions
+from taskdata import create_tasks
+
+
+pytestmark = pytest.mark.django_db
+
+# How many tasks a page polls for at once
+NUM_TASKS_POLLED = 50
+STATES = [
+    BackgroundTask.STATES.running,
+    BackgroundTask.STATES.queued,
+    BackgroundTask.STATES.success,
+]
+
+
+def bench_tasks_view_json(benchmark, client, size):
+    now = timezone.now()
+    create_tasks(
+        size,
+        name=lambda ii: f"Task {ii % 10}",
+        state=lambda ii: STATES[ii % len(STATES)],
+        queued_at=now,
+    )
+    task_ids = [str(task_id) for task_id in BackgroundTask.objects.values_list("id", flat=True)]
+    url = reverse("bgtask:tasks")
+    rng = random.Random(0)
+
+    def poll(ii):
+        polled_ids = rng.sample(task_ids, min(NUM_TASKS_POLLED, len(task_ids)))
+        response = client.get(url, {"tasks": ",".join(polled_ids)}, HTTP_ACCEPT="application/json")
+        assert response.status_code == 200
+
+    benchmark(poll, 50, num_tasks=size)
+
+
+def bench_admin_bg_tasks(benchmark, admin_client, size):
+    model_admin = admin.site._registry[ModelWithBackgroundActions]
+    # Mostly old completed tasks, with a few recent ones of each state
+    now = timezone.now()
+    old = now - timedelta(days=7)
+
+    def is_recent(ii):
+        return ii % 1000 < len(STATES)
+
+    create_tasks(
+        size,
+        namespace=model_admin._bgtask_namespace,
+        name="Queued task",
+        state=lambda ii: STATES[ii % 1000] if is_recent(ii) else BackgroundTask.STATES.success,
+        queued_at=lambda ii: now if is_recent(ii) else old,
+        started_at=lambda ii: now if is_recent(ii) else old,
+        completed_at=lambda ii: now if is_recent(ii) else old,
+    )
+    url = reverse("admin:django_app_modelwithbackgroundactions_changelist")
+
+    def render_changelist(ii):
+        response = admin_client.get(url)
+        assert response.status_code == 200
+
+    benchmark(render_changelist, 20, num_tasks=size)
@@ -0,0 +1,106 @@
+import json
+import platform
+import time
+
+import django
+import pytest
+
+from django.db import connection
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("bgtask benchmarks")
+    group.addoption(
+        "--bench-sizes",
+        default="1000",
+        help="Comma separated numbers of tasks or steps to benchmark with, e.g. "
+        "1000,10000,100000,1000000",
+    )
+    group.addoption(
+        "--bench-json",
+        default="benchmark-results.json",
+        help="The file to write the results to as JSON",
+    )
+
+
+def pytest_generate_tests(metafunc):
+    if "size" in metafunc.fixturenames:
+        sizes = [int(size) for size in metafunc.config.getoption("bench_sizes").split(",")]
+        metafunc.parametrize("size", sizes)
+
+
+def pytest_configure(config):
+    config.bgtask_benchmark_results = []
+
+
+def pytest_sessionfinish(session):
+    results = session.config.bgtask_benchmark_results
+    if not results:
+        return
+    with open(session.config.getoption("bench_json"), "w") as results_file:
+        json.dump(
+            {
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": connection.vendor,
+                "results": results,
+            },
+            results_file,
+            indent=2,
+        )
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    results = config.bgtask_benchmark_results
+    if not results:
+        return
+    terminalreporter.section("bgtask benchmarks")
+    for result in results:
+        terminalreporter.write_line(
+            "{benchmark:<60} {ops_per_s:>10.1f} ops/s  p50 {p50_ms:>8.2f}ms  p99 {p99_ms:>8.2f}ms  "
+            "{queries_per_op:>6.2f} queries/op".format(**result)
+        )
+    terminalreporter.write_line(f"Written to {config.getoption('bench_json')}")
+
+
+@pytest.fixture
+def benchmark(request):
+    """Call benchmark(operation, num_ops, **params) to call operation(ii) for ii in
+    range(num_ops), timing each call and counting the queries made, and record the results.
+    """
+
+    def measure(operation, num_ops, **params):
+        num_queries = 0
+
+        def count_query(execute, sql, params, many, context):
+            nonlocal num_queries
+            num_queries += 1
+            return execute(sql, params, many, context)
+
+        durations = []
+        with connection.execute_wrapper(count_query):
+            start = time.perf_counter()
+            for ii in range(num_ops):
+                op_start = time.perf_counter()
+                operation(ii)
+                durations.append(time.perf_counter() - op_start)
+            total_duration = time.perf_counter() - start
+
+        durations.sort()
+        result = {
+            "benchmark": request.node.name,
+            "params": params,
+            "ops": num_ops,
+            "ops_per_s": num_ops / total_duration,
+            "p50_ms": _percentile(durations, 50) * 1000,
+            "p99_ms": _percentile(durations, 99) * 1000,
+            "queries_per_op": num_queries / num_ops,
+        }
+        request.config.bgtask_benchmark_results.append(result)
+        return result
+
+    return measure
+
+
+def _percentile(sorted_values, percent):
+    return sorted_values[round((len(sorted_values) - 1) * percent / 100)]
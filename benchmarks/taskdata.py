@@ -0,0 +1,20 @@
+from bgtask.models import BackgroundTask
+
+
+CREATE_BATCH_SIZE = 10_000
+
+
+def create_tasks(num_tasks, **fields):
+    """Create num_tasks tasks in batches. Each value in fields can be a function of the task's
+    index to give each task a different value.
+    """
+    for batch_start in range(0, num_tasks, CREATE_BATCH_SIZE):
+        BackgroundTask.objects.bulk_create(
+            BackgroundTask(
+                **{
+                    field: value(ii) if callable(value) else value
+                    for field, value in fields.items()
+                },
+            )
+            for ii in range(batch_start, min(batch_start + CREATE_BATCH_SIZE, num_tasks))
+        )
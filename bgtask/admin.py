@@ -1,32 +1,135 @@
 from django.contrib import admin
 from django.template.loader import render_to_string
 
-from .models import BackgroundTask
+from .models import (
+    BackgroundTask,
+    BackgroundTaskDailyStats,
+    BackgroundTaskError,
+    BackgroundTaskProfile,
+)
+
+
+_NOT_FETCHED = object()
+# How many of the slowest functions to show for profiled tasks
+PROFILE_SUMMARY_FUNCTIONS = 30
 
 
 def background_task_status(obj):
     if isinstance(obj, BackgroundTask):
         bgtask = obj
     else:
-        bgtasks = BackgroundTask.objects.filter(acted_on_object_id=obj.id).order_by("-created")
-
-        # for now just pick the most recent
-        bgtask = bgtasks.first()
+        # for now just pick the most recent, which BGTaskChangeListMixin will have fetched for
+        # the whole page
+        bgtask = getattr(obj, "_latest_bgtask", _NOT_FETCHED)
+        if bgtask is _NOT_FETCHED:
+            bgtask = BackgroundTask.objects.latest_for_objects([obj]).get(str(obj.pk))
+            # So that the bgtask_script template tag doesn't fetch it again
+            obj._latest_bgtask = bgtask
 
-    output = render_to_string(
-        "bgtask/bg_changelist_status_column.html", {"bgtask": bgtask and bgtask.task_dict}
-    )
+    # The widget is brought to life by the bgtask_script template tag
+    output = render_to_string("bgtask/bg_changelist_status_column.html", {"bgtask": bgtask})
     return output
 
 
 background_task_status.__name__ = "Task Status"
 
 
+class BGTaskChangeListMixin:
+    """Mix into a ModelAdmin with background_task_status in its list_display to fetch the latest
+    task for all the objects on a change list page in one query, rather than one per row.
+
+    If the change list template doesn't use the bgtask_script template tag, as
+    bgtask/admin/change_list.html does, its output is added to the end of the page so that the
+    status column's widgets still update.
+    """
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context=extra_context)
+        if hasattr(response, "add_post_render_callback"):
+            response.add_post_render_callback(_add_missing_bgtask_script)
+        return response
+
+    def get_changelist_instance(self, request):
+        changelist = super().get_changelist_instance(request)
+        # This evaluates the page's queryset, and the change list then renders the same objects
+        latest_bgtasks = BackgroundTask.objects.latest_for_objects(changelist.result_list)
+        for obj in changelist.result_list:
+            obj._latest_bgtask = latest_bgtasks.get(str(obj.pk))
+        return changelist
+
+
+def _add_missing_bgtask_script(response):
+    if b'id="bgtask-bootstrap"' in response.content:
+        return
+
+    from .templatetags.bgtask import bgtask_script
+
+    script = bgtask_script(response.context_data).encode(response.charset)
+    response.content = response.content.replace(b"</body>", script + b"</body>", 1)
+
+
+class BackgroundTaskErrorInline(admin.TabularInline):
+    model = BackgroundTaskError
+    fields = [
+        "first_seen",
+        "last_seen",
+        "num_occurrences",
+        "num_failed_steps",
+        "steps_identifiers",
+        "error_type",
+        "error_message",
+        "traceback",
+    ]
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+    show_change_link = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(BackgroundTask)
 class BackgroundTaskAdmin(admin.ModelAdmin):
+    change_list_template = "bgtask/admin/change_list.html"
+    inlines = [BackgroundTaskErrorInline]
     list_filter = ["state", "namespace", "name"]
     list_display = ("created", "namespace_name", background_task_status, "result", "completed_at")
     ordering = ["-created"]
+    readonly_fields = ["profile_summary"]
+    raw_id_fields = ["parent"]
 
     def namespace_name(self, bgtask):
         return ".".join(f for f in [bgtask.namespace, bgtask.name] if f)
+
+    @admin.display(description="Profile")
+    def profile_summary(self, bgtask):
+        try:
+            profile = bgtask.profile_stats
+        except BackgroundTaskProfile.DoesNotExist:
+            return "-"
+        return render_to_string(
+            "bgtask/profile_summary.html",
+            {"profile": profile, "functions": profile.top_functions(PROFILE_SUMMARY_FUNCTIONS)},
+        )
+
+
+@admin.register(BackgroundTaskDailyStats)
+class BackgroundTaskDailyStatsAdmin(admin.ModelAdmin):
+    list_display = (
+        "date",
+        "namespace",
+        "name",
+        "num_tasks",
+        "num_failed",
+        "success_rate",
+        "mean_duration",
+    )
+    list_filter = ["namespace", "name"]
+    date_hierarchy = "date"
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
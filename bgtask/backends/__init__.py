@@ -1,3 +1,18 @@
-from . import thread_pool
+from importlib import import_module
 
-default_backend = thread_pool
+from django.conf import settings
+
+
+DEFAULT_BACKEND = "bgtask.backends.thread_pool"
+
+
+def get_backend():
+    """The backend module named by the BGTASK_BACKEND setting."""
+    return import_module(getattr(settings, "BGTASK_BACKEND", DEFAULT_BACKEND))
+
+
+def __getattr__(name):
+    # default_backend is looked up when used so that it follows the setting
+    if name == "default_backend":
+        return get_backend()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
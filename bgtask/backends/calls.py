@@ -0,0 +1,179 @@
+"""Helpers for backends that run calls somewhere other than the process that dispatched them, so
+need to pass the callable and its arguments in a serialised form.
+
+Arguments may be JSON-compatible values, UUIDs, datetimes, model instances (passed as their
+primary key), querysets (passed as the list of primary keys they match), the snapshots in
+bgtask.snapshots and importable functions or classes. Anything else raises TypeError when the
+call is serialised, so that dispatching fails straight away rather than when the call is run.
+"""
+
+import datetime
+import logging
+import uuid
+
+from django.apps import apps
+from django.db import models
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+
+from ..snapshots import RequestSnapshot, StreamedQueryset
+
+
+log = logging.getLogger(__name__)
+
+TYPE_KEY = "__bgtask_type__"
+
+
+def serialize_call(func, args, kwargs):
+    """Return a JSON-compatible dict describing a call of func(*args, **kwargs)."""
+    return {
+        "func": _callable_path(func),
+        "args": [_serialize_value(arg) for arg in args],
+        "kwargs": {name: _serialize_value(value) for name, value in kwargs.items()},
+    }
+
+
+def deserialize_call(call):
+    """The reverse of serialize_call(), returning (func, args, kwargs)."""
+    return (
+        _import_callable(call["func"]),
+        [_deserialize_value(arg) for arg in call["args"]],
+        {name: _deserialize_value(value) for name, value in call["kwargs"].items()},
+    )
+
+
+def find_task(args, kwargs):
+    """Find the BackgroundTask a call is for, which is the first one in its arguments."""
+    from ..models import BackgroundTask
+
+    for value in [*args, *kwargs.values()]:
+        if isinstance(value, BackgroundTask):
+            return value
+    return None
+
+
+def run_call(func, args, kwargs):
+    """Call func, failing the task that the call is for if it raises."""
+    try:
+        return func(*args, **kwargs)
+    except Exception as exc:
+        task = find_task(args, kwargs)
+        if task is not None:
+            _fail_task_if_unfinished(task, exc)
+        raise
+
+
+# --------------------------------------------------------------------------------------------------
+# Internals
+# --------------------------------------------------------------------------------------------------
+def _fail_task_if_unfinished(task, exc):
+    try:
+        task.fail(exc)
+    except RuntimeError:
+        # The function already finished or failed the task before raising
+        log.info("Not failing %s after exception %r", task, exc)
+
+
+def _callable_path(func):
+    path = f"{func.__module__}.{func.__qualname__}"
+    try:
+        imported = import_string(path)
+    except ImportError:
+        imported = None
+
+    if imported is func:
+        return path
+    if getattr(imported, "__wrapped__", None) is func:
+        # E.g. admin actions decorated with bgtask_admin_action, which replace the function in
+        # its module with the wrapper
+        return {"path": path, "unwrap": True}
+
+    raise TypeError(f"{func!r} cannot be imported as {path} so cannot be called in the background")
+
+
+def _import_callable(path):
+    if isinstance(path, dict):
+        return import_string(path["path"]).__wrapped__
+    return import_string(path)
+
+
+def _serialize_value(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_serialize_value(item) for item in value]
+    if isinstance(value, dict):
+        if TYPE_KEY in value or not all(isinstance(key, str) for key in value):
+            raise TypeError(f"Dicts passed to background tasks must have string keys: {value!r}")
+        return {key: _serialize_value(item) for key, item in value.items()}
+    if isinstance(value, uuid.UUID):
+        return {TYPE_KEY: "uuid", "value": str(value)}
+    if isinstance(value, datetime.datetime):
+        return {TYPE_KEY: "datetime", "value": value.isoformat()}
+    if isinstance(value, models.Model):
+        return {
+            TYPE_KEY: "model",
+            "model": value._meta.label_lower,
+            "pk": _serialize_value(value.pk),
+        }
+    if isinstance(value, models.QuerySet):
+        return {
+            TYPE_KEY: "queryset",
+            "model": value.model._meta.label_lower,
+            "pks": [_serialize_value(pk) for pk in value.values_list("pk", flat=True)],
+        }
+    if isinstance(value, StreamedQueryset):
+        return {
+            TYPE_KEY: "streamed_queryset",
+            "model": value.model._meta.label_lower,
+            "pks": [_serialize_value(pk) for pk in value.pks],
+            "chunk_size": value.chunk_size,
+        }
+    if isinstance(value, RequestSnapshot):
+        return {
+            TYPE_KEY: "request_snapshot",
+            "user_id": _serialize_value(value.user_id),
+            "method": value.method,
+            "path": value.path,
+        }
+    if callable(value) and hasattr(value, "__qualname__"):
+        return {TYPE_KEY: "callable", "path": _callable_path(value)}
+
+    raise TypeError(f"{value!r} cannot be passed to a background task")
+
+
+def _deserialize_value(value):
+    if isinstance(value, list):
+        return [_deserialize_value(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if TYPE_KEY not in value:
+        return {key: _deserialize_value(item) for key, item in value.items()}
+
+    value_type = value[TYPE_KEY]
+    if value_type == "uuid":
+        return uuid.UUID(value["value"])
+    if value_type == "datetime":
+        return parse_datetime(value["value"])
+    if value_type == "model":
+        return apps.get_model(value["model"])._default_manager.get(
+            pk=_deserialize_value(value["pk"])
+        )
+    if value_type == "queryset":
+        return apps.get_model(value["model"])._default_manager.filter(
+            pk__in=[_deserialize_value(pk) for pk in value["pks"]]
+        )
+    if value_type == "streamed_queryset":
+        return StreamedQueryset(
+            apps.get_model(value["model"]),
+            [_deserialize_value(pk) for pk in value["pks"]],
+            value["chunk_size"],
+        )
+    if value_type == "request_snapshot":
+        return RequestSnapshot(
+            user_id=_deserialize_value(value["user_id"]), method=value["method"], path=value["path"]
+        )
+    if value_type == "callable":
+        return _import_callable(value["path"])
+
+    raise ValueError(f"Unknown serialised type {value_type}")
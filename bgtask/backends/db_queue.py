@@ -0,0 +1,164 @@
+"""A backend that stores dispatched calls in the database, to be run by one or more
+`manage.py bgtask_worker` processes, which may be on other hosts.
+
+Calls survive the dispatching process exiting, and workers claim them with
+SELECT ... FOR UPDATE SKIP LOCKED so that any number of workers can share the queue without
+blocking each other. The function and arguments must be serialisable as described in
+bgtask.backends.calls.
+"""
+
+import logging
+import os
+import socket
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .. import metrics
+from ..models import BackgroundTask, BackgroundTaskJob
+from .calls import deserialize_call, find_task, run_call, serialize_call
+
+
+log = logging.getLogger(__name__)
+
+# How many calls dispatch_many() inserts per query
+BULK_BATCH_SIZE = 1000
+
+
+def dispatch(func, *args, **kwargs):
+    """Store a call of func(*args, **kwargs) to be run by a worker.
+
+    If the call is for a BackgroundTask (one is passed as an argument) that hasn't been started,
+    it is queued.
+    """
+    call = serialize_call(func, args, kwargs)
+    task = find_task(args, kwargs)
+    # So that a task is never left queued without a job to run it
+    with transaction.atomic():
+        if task is not None and task.state == task.STATES.not_started:
+            task.queue()
+        job = BackgroundTaskJob.objects.create(task=task, **call)
+    metrics.DISPATCHED.inc(backend="db_queue")
+    return job
+
+
+def dispatch_many(func, args_list, batch_size=BULK_BATCH_SIZE):
+    """Store a call of func(*args) for each of args_list, with one insert per batch_size calls,
+    queueing the tasks of any that are for tasks that haven't been started.
+    """
+    jobs = []
+    for args in args_list:
+        call = serialize_call(func, args, {})
+        jobs.append(BackgroundTaskJob(task=find_task(args, {}), **call))
+
+    with transaction.atomic():
+        BackgroundTask.objects.queue_many(
+            [job.task for job in jobs if job.task is not None], batch_size=batch_size
+        )
+        jobs = BackgroundTaskJob.objects.bulk_create(jobs, batch_size=batch_size)
+    metrics.DISPATCHED.inc(len(jobs), backend="db_queue")
+    return jobs
+
+
+def claim_jobs(worker_id, limit, reclaim_after=None):
+    """Claim up to limit jobs for worker_id, skipping any being claimed by other workers.
+
+    If reclaim_after (a timedelta) is passed, jobs that were claimed longer ago than that are
+    claimed again, in case the worker that claimed them died.
+    """
+    unclaimed_q = Q(claimed_at__isnull=True)
+    if reclaim_after is not None:
+        unclaimed_q |= Q(claimed_at__lt=timezone.now() - reclaim_after)
+
+    with transaction.atomic():
+        jobs = list(
+            BackgroundTaskJob.objects.select_for_update(skip_locked=True)
+            .filter(unclaimed_q)
+            .order_by("id")[:limit]
+        )
+        claimed_at = timezone.now()
+        BackgroundTaskJob.objects.filter(id__in=[job.id for job in jobs]).update(
+            claimed_at=claimed_at, claimed_by=worker_id
+        )
+
+    for job in jobs:
+        job.claimed_at = claimed_at
+        job.claimed_by = worker_id
+    return jobs
+
+
+def run_job(job):
+    """Run a claimed job, deleting it afterwards whether or not it succeeded."""
+    try:
+        func, args, kwargs = deserialize_call(
+            {"func": job.func, "args": job.args, "kwargs": job.kwargs}
+        )
+        run_call(func, args, kwargs)
+    except Exception:
+        log.exception("%s failed", job)
+    finally:
+        job.delete()
+
+
+def run_worker(
+    concurrency=1,
+    batch_size=None,
+    poll_interval=1.0,
+    reclaim_after=None,
+    once=False,
+    stop_event=None,
+):
+    """Claim and run jobs until stop_event is set or, if once is True, until there are none left.
+
+    With a concurrency of 1 jobs are run in the calling thread, otherwise in a pool of that many
+    threads. Jobs are claimed in batches of up to batch_size, which defaults to the concurrency,
+    and only when there is a thread free to run them so that other workers can pick them up in
+    the meantime.
+    """
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    batch_size = batch_size or concurrency
+    reclaim_after = None if reclaim_after is None else timedelta(seconds=reclaim_after)
+    stop_event = stop_event or threading.Event()
+    executor = (
+        ThreadPoolExecutor(concurrency, thread_name_prefix="bgtask-worker")
+        if concurrency > 1
+        else None
+    )
+    running = set()
+
+    log.info("Worker %s starting with concurrency %d", worker_id, concurrency)
+    try:
+        while not stop_event.is_set():
+            running = {future for future in running if not future.done()}
+            num_to_claim = min(concurrency - len(running), batch_size)
+            jobs = claim_jobs(worker_id, num_to_claim, reclaim_after) if num_to_claim > 0 else []
+            for job in jobs:
+                if executor is None:
+                    run_job(job)
+                else:
+                    running.add(executor.submit(_run_job_in_thread, job))
+
+            if jobs:
+                continue
+            if once and not running:
+                break
+            if running:
+                wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            else:
+                stop_event.wait(poll_interval)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+        log.info("Worker %s stopped", worker_id)
+
+
+def _run_job_in_thread(job):
+    close_old_connections()
+    try:
+        run_job(job)
+    finally:
+        close_old_connections()
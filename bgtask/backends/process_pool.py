@@ -0,0 +1,90 @@
+"""A backend that runs calls in a shared pool of worker processes, for CPU-bound work that would
+otherwise hold the GIL in the web process.
+
+Worker processes are started with the "forkserver" method by default (or "spawn"; set
+BGTASK_PROCESS_POOL = {"start_method": ..., "max_workers": ...}) so they never share the parent's
+database connections, and set up Django themselves. The function and arguments must be
+serialisable as described in bgtask.backends.calls, so querysets are passed as their model and
+primary keys rather than pickled.
+"""
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+from .. import metrics
+from .calls import deserialize_call, run_call, serialize_call
+
+
+START_METHODS = ("forkserver", "spawn")
+
+SHARED_PROCESS_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def dispatch(func, *args, **kwargs):
+    """Run func(*args, **kwargs) in a worker process, returning a Future for the result."""
+    call = serialize_call(func, args, kwargs)
+    metrics.DISPATCHED.inc(backend="process_pool")
+    return _get_pool().submit(_run_call_in_child, call)
+
+
+def dispatch_many(func, args_list):
+    """Run func(*args) for each of args_list in worker processes, returning a list of Futures."""
+    return [dispatch(func, *args) for args in args_list]
+
+
+def shutdown(wait=True):
+    global SHARED_PROCESS_POOL
+    with _POOL_LOCK:
+        pool, SHARED_PROCESS_POOL = SHARED_PROCESS_POOL, None
+    if pool is not None:
+        pool.shutdown(wait=wait)
+
+
+# --------------------------------------------------------------------------------------------------
+# Internals
+# --------------------------------------------------------------------------------------------------
+def _get_pool():
+    global SHARED_PROCESS_POOL
+    with _POOL_LOCK:
+        if SHARED_PROCESS_POOL is None:
+            config = getattr(settings, "BGTASK_PROCESS_POOL", {})
+            start_method = config.get("start_method", "forkserver")
+            if start_method not in START_METHODS:
+                raise ValueError(
+                    f"BGTASK_PROCESS_POOL start_method must be one of {START_METHODS}, as forked "
+                    "children would share the parent's database connections"
+                )
+
+            SHARED_PROCESS_POOL = ProcessPoolExecutor(
+                max_workers=config.get("max_workers"),
+                mp_context=multiprocessing.get_context(start_method),
+                initializer=_initialize_child,
+                # The child should use the same databases as this process, which aren't
+                # necessarily the ones in settings, e.g. when running tests.
+                initargs=(
+                    {alias: connections[alias].settings_dict["NAME"] for alias in connections},
+                ),
+            )
+        return SHARED_PROCESS_POOL
+
+
+def _initialize_child(database_names):
+    import django
+
+    django.setup()
+    for alias, name in database_names.items():
+        connections[alias].settings_dict["NAME"] = name
+
+
+def _run_call_in_child(call):
+    close_old_connections()
+    try:
+        func, args, kwargs = deserialize_call(call)
+        return run_call(func, args, kwargs)
+    finally:
+        close_old_connections()
@@ -1,12 +1,198 @@
-from concurrent.futures import ThreadPoolExecutor
+"""A backend that runs calls in a shared pool of threads in the dispatching process.
 
+Configure it with e.g. BGTASK_THREAD_POOL = {"max_workers": 4, "max_queued": 100, "when_full":
+"reject"}. max_queued limits the calls waiting for a thread (by default there is no limit), and
+when it is reached dispatch() either blocks until there is room ("block", the default) or raises
+ThreadPoolFull ("reject").
+
+Calls for tasks with a limit set in bgtask.concurrency are held, without using a thread, until a
+call for a task with the same name completes.
+"""
+
+import atexit
+import collections
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .. import metrics
+from ..concurrency import max_concurrent_for
+from .calls import find_task
+
+
+log = logging.getLogger(__name__)
+
+# Calls for tasks with a limit set in bgtask.concurrency are held in this process
+ENFORCES_CONCURRENCY_LIMITS = True
+
+WHEN_FULL_POLICIES = ("block", "reject")
 
 SHARED_THREAD_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+class ThreadPoolFull(RuntimeError):
+    pass
 
 
 def dispatch(func, *args, **kwargs):
+    """Run func(*args, **kwargs) in a pool thread, returning a Future for the result."""
+    metrics.DISPATCHED.inc(backend="thread_pool")
+    return _get_pool().submit(func, args, kwargs)
+
+
+def dispatch_many(func, args_list):
+    """Run func(*args) for each of args_list in pool threads, returning a list of Futures."""
+    return [dispatch(func, *args) for args in args_list]
+
+
+def queue_depth():
+    """The number of calls waiting to run, including those held back by concurrency limits."""
+    pool = SHARED_THREAD_POOL
+    return 0 if pool is None else pool.num_queued
+
+
+def active_workers():
+    """The number of calls currently running."""
+    pool = SHARED_THREAD_POOL
+    return 0 if pool is None else pool.num_active
+
+
+def shutdown(wait=True, cancel_futures=False):
     global SHARED_THREAD_POOL
-    if SHARED_THREAD_POOL is None:
-        SHARED_THREAD_POOL = ThreadPoolExecutor()
+    with _POOL_LOCK:
+        pool, SHARED_THREAD_POOL = SHARED_THREAD_POOL, None
+    if pool is not None:
+        pool.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+
+# --------------------------------------------------------------------------------------------------
+# Internals
+# --------------------------------------------------------------------------------------------------
+class _BoundedThreadPool:
+    def __init__(self, max_workers=None, max_queued=None, when_full="block"):
+        if when_full not in WHEN_FULL_POLICIES:
+            raise ValueError(f"BGTASK_THREAD_POOL when_full must be one of {WHEN_FULL_POLICIES}")
+
+        if max_workers is None:
+            # ThreadPoolExecutor's default
+            max_workers = min(32, (os.cpu_count() or 1) + 4)
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bgtask")
+        # A slot is taken by each call from when it is dispatched until it completes, whether it
+        # is waiting for a thread or held back by a concurrency limit.
+        self._slots = (
+            None if max_queued is None else threading.BoundedSemaphore(max_workers + max_queued)
+        )
+        self._block_when_full = when_full == "block"
+        self._lock = threading.Lock()
+        self._num_submitted = 0
+        self.num_active = 0
+        # Calls for tasks with a concurrency limit, by the task's (namespace, name)
+        self._num_started_by_nsn = collections.Counter()
+        self._held_by_nsn = collections.defaultdict(collections.deque)
+
+    @property
+    def num_queued(self):
+        with self._lock:
+            return self._num_submitted - self.num_active
+
+    def submit(self, func, args, kwargs):
+        if self._slots is not None and not self._slots.acquire(blocking=self._block_when_full):
+            metrics.REJECTED.inc(backend="thread_pool")
+            raise ThreadPoolFull(f"Too many background calls queued to run {func!r}")
+
+        call = _Call(func, args, kwargs)
+        with self._lock:
+            self._num_submitted += 1
+            if call.nsn is not None:
+                if self._num_started_by_nsn[call.nsn] >= call.max_concurrent:
+                    log.debug("Holding %r until a call for %s completes", func, call.nsn)
+                    self._held_by_nsn[call.nsn].append(call)
+                    return call.future
+                self._num_started_by_nsn[call.nsn] += 1
+
+        try:
+            self._executor.submit(self._run, call)
+        except BaseException:
+            self._call_done(call)
+            raise
+        return call.future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        log.info("Shutting down thread pool with %d calls queued", self.num_queued)
+        with self._lock:
+            held = [call for calls in self._held_by_nsn.values() for call in calls]
+            self._held_by_nsn.clear()
+        # Held calls can't be started once the executor is shut down
+        for call in held:
+            call.future.cancel()
+            self._call_done(call, start_next=False)
+        self._executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+    def _run(self, call):
+        with self._lock:
+            self.num_active += 1
+        try:
+            if call.future.set_running_or_notify_cancel():
+                close_old_connections()
+                try:
+                    call.future.set_result(call.func(*call.args, **call.kwargs))
+                except BaseException as exc:
+                    call.future.set_exception(exc)
+                finally:
+                    close_old_connections()
+        finally:
+            with self._lock:
+                self.num_active -= 1
+            self._call_done(call)
+
+    def _call_done(self, call, start_next=True):
+        next_call = None
+        with self._lock:
+            self._num_submitted -= 1
+            if call.nsn is not None and start_next:
+                held = self._held_by_nsn.get(call.nsn)
+                if held:
+                    # Hand this call's place over to the next one
+                    next_call = held.popleft()
+                else:
+                    self._num_started_by_nsn[call.nsn] -= 1
+                    self._held_by_nsn.pop(call.nsn, None)
+        if self._slots is not None:
+            self._slots.release()
+
+        if next_call is not None:
+            try:
+                self._executor.submit(self._run, next_call)
+            except RuntimeError as exc:
+                # The pool is being shut down
+                next_call.future.set_exception(exc)
+                self._call_done(next_call)
+
+
+class _Call:
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+
+        task = find_task(args, kwargs)
+        self.max_concurrent = None if task is None else max_concurrent_for(task)
+        self.nsn = None if self.max_concurrent is None else (task.namespace, task.name)
+
+
+def _get_pool():
+    global SHARED_THREAD_POOL
+    with _POOL_LOCK:
+        if SHARED_THREAD_POOL is None:
+            SHARED_THREAD_POOL = _BoundedThreadPool(**getattr(settings, "BGTASK_THREAD_POOL", {}))
+        return SHARED_THREAD_POOL
+
 
-    SHARED_THREAD_POOL.submit(func, *args, **kwargs)
+atexit.register(shutdown)
@@ -0,0 +1,43 @@
+"""Limits on how many calls for tasks with the same namespace and name a backend runs at once.
+
+Limits are per process: the thread pool holds calls over the limit, without using a thread, and
+dispatches the next one as soon as a call for a task with the same name completes. Other backends
+don't enforce them, and a warning is logged if a limit is set while one of those is configured.
+"""
+
+import logging
+import threading
+
+from .backends import get_backend
+
+
+log = logging.getLogger(__name__)
+
+_MAX_CONCURRENT = {}
+_LOCK = threading.Lock()
+
+
+def set_max_concurrent(name, max_concurrent, namespace=""):
+    """Limit the calls running at once for tasks named name, or remove the limit if None."""
+    if max_concurrent is not None and max_concurrent < 1:
+        raise ValueError(f"max_concurrent must be at least 1, not {max_concurrent}")
+
+    with _LOCK:
+        if max_concurrent is None:
+            _MAX_CONCURRENT.pop((namespace, name), None)
+        else:
+            _MAX_CONCURRENT[(namespace, name)] = max_concurrent
+
+    backend = get_backend()
+    if max_concurrent is not None and not getattr(backend, "ENFORCES_CONCURRENCY_LIMITS", False):
+        log.warning(
+            "%s doesn't enforce concurrency limits, so tasks named %s may run more than %d at once",
+            backend.__name__,
+            name,
+            max_concurrent,
+        )
+
+
+def max_concurrent_for(task):
+    """The limit for calls for task, or None if it is unlimited."""
+    return _MAX_CONCURRENT.get((task.namespace, task.name))
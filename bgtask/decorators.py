@@ -5,12 +5,23 @@ from django.contrib.messages import INFO
 
 
 from .models import BackgroundTask
+from .snapshots import RequestSnapshot, StreamedQueryset
+from .utils import chunked
 
 
 log = logging.getLogger(__name__)
 
 
-def bgtask_admin_action(func=None):
+def bgtask_admin_action(func=None, chunk_size=None, parallelism=None):
+    """Run an admin action func(bg_task, request, queryset) in the background with a task to
+    track it. func is passed a RequestSnapshot and a StreamedQueryset (see bgtask.snapshots)
+    rather than the live request and queryset.
+
+    With a chunk_size, the selected objects are split into chunks of that many, which are run by
+    up to parallelism calls (by default one per chunk) dispatched to the backend at once. Each
+    chunk is a step of size chunk_size of the task, which succeeds or fails as a whole depending
+    on whether func raises, and the task finishes when the last chunk has.
+    """
     if func is not None:
         return bgtask_admin_action()(func)
 
@@ -27,7 +38,32 @@ def bgtask_admin_action(func=None):
 
             from .backends import default_backend
 
-            default_backend.dispatch(_run_bg_task_func, func, bg_task, request, queryset)
+            # Only what the action needs is kept, not the request or the queryset's results
+            request_snapshot = RequestSnapshot.from_request(request)
+            objects = StreamedQueryset.from_queryset(queryset)
+            if chunk_size is None:
+                default_backend.dispatch(
+                    _run_bg_task_func, func, bg_task, request_snapshot, objects
+                )
+                return
+
+            bg_task.set_steps_to_complete(len(objects))
+            if not objects:
+                bg_task.succeed()
+                return
+
+            chunks = list(chunked(objects.pks, chunk_size))
+            num_lanes = min(parallelism or len(chunks), len(chunks))
+            log.info("Running %d chunks of %s in %d lanes", len(chunks), func.__name__, num_lanes)
+            for lane in range(num_lanes):
+                default_backend.dispatch(
+                    _run_bg_task_chunks,
+                    func,
+                    bg_task.id,
+                    request_snapshot,
+                    objects.model,
+                    chunks[lane::num_lanes],
+                )
 
 
         bgtask_admin_action_wrapper.bgtask_name = task_name
@@ -39,8 +75,25 @@ def bgtask_admin_action(func=None):
 
 def _run_bg_task_func(func, bg_task, request, queryset):
     try:
-        func(bg_task, request, queryset)
+        with bg_task.profiled():
+            func(bg_task, request, queryset)
     except Exception as exc:
         bg_task.fail(exc)
     else:
         bg_task.succeed()
+
+
+def _run_bg_task_chunks(func, bg_task_id, request, model, chunks):
+    # Other lanes may be running chunks of the same task, so each has its own instance of it
+    bg_task = BackgroundTask.objects.get(id=bg_task_id)
+    bg_task.start()
+    for chunk_pks in chunks:
+        try:
+            func(bg_task, request, StreamedQueryset(model, chunk_pks))
+        except Exception as exc:
+            log.exception("Chunk of %s failed", func.__name__)
+            bg_task.steps_failed(
+                len(chunk_pks), steps_identifier=f"{chunk_pks[0]}-{chunk_pks[-1]}", error=exc
+            )
+        else:
+            bg_task.add_successful_steps(len(chunk_pks))
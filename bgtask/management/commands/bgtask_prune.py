@@ -0,0 +1,79 @@
+import gzip
+import time
+
+from django.core.management.base import BaseCommand
+
+from bgtask import retention
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete finished tasks older than the BGTASK_RETENTION_DAYS setting allows, in batches. "
+        "Safe to stop and run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=None,
+            help="Days to keep tasks with no retention policy of their own for, overriding the "
+            "default in BGTASK_RETENTION_DAYS",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=retention.BATCH_SIZE,
+            help="The most tasks to delete in one transaction",
+        )
+        parser.add_argument(
+            "--archive-to",
+            default=None,
+            help="A file to append the tasks to as lines of JSON before deleting them, "
+            "compressed if it ends with .gz",
+        )
+        parser.add_argument(
+            "--rollup",
+            action="store_true",
+            help="Add the tasks to the daily stats per namespace and name before deleting them",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Count the tasks that would be deleted without deleting them",
+        )
+
+    def handle(self, *args, days, batch_size, archive_to, rollup, dry_run, **options):
+        policies = retention.retention_policies()
+        if days is not None:
+            policies = {**policies, None: days}
+        tasks = retention.expired_tasks(policies)
+
+        archive = None
+        if archive_to is not None and not dry_run:
+            open_archive = gzip.open if archive_to.endswith(".gz") else open
+            archive = open_archive(archive_to, "at")
+
+        num_tasks = 0
+        start_time = time.monotonic()
+        try:
+            for num_batch_tasks in retention.prune(
+                tasks, batch_size=batch_size, archive=archive, rollup=rollup, dry_run=dry_run
+            ):
+                num_tasks += num_batch_tasks
+                if options["verbosity"] > 1:
+                    self.stdout.write(f"{num_tasks} tasks so far")
+        finally:
+            if archive is not None:
+                archive.close()
+        duration_s = time.monotonic() - start_time
+
+        self.stdout.write(
+            "%s %s tasks in %.1fs (%.0f tasks/s)"
+            % (
+                "Would delete" if dry_run else "Deleted",
+                num_tasks,
+                duration_s,
+                num_tasks / duration_s if duration_s else 0,
+            )
+        )
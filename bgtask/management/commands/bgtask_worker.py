@@ -0,0 +1,63 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from bgtask.backends import db_queue
+
+
+class Command(BaseCommand):
+    help = "Run jobs dispatched with the bgtask.backends.db_queue backend"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=1,
+            help="How many jobs to run at once (in threads if more than one)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="The most jobs to claim at once, defaulting to the concurrency",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait before looking for more jobs when there are none",
+        )
+        parser.add_argument(
+            "--reclaim-after",
+            type=float,
+            default=None,
+            help=(
+                "Claim jobs again if they were claimed more than this many seconds ago, in case "
+                "the worker that claimed them died. Must be longer than any job takes to run."
+            ),
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit when there are no more jobs rather than waiting for more",
+        )
+
+    def handle(self, *args, concurrency, batch_size, poll_interval, reclaim_after, once, **options):
+        stop_event = threading.Event()
+
+        def stop(signum, frame):
+            self.stdout.write("Stopping after running jobs complete")
+            stop_event.set()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        db_queue.run_worker(
+            concurrency=concurrency,
+            batch_size=batch_size,
+            poll_interval=poll_interval,
+            reclaim_after=reclaim_after,
+            once=once,
+            stop_event=stop_event,
+        )
@@ -0,0 +1,188 @@
+"""Counters and histograms of what tasks and backends do, kept in memory by each process and
+exposed in the Prometheus text format by bgtask.views.metrics_view along with gauges of the
+queued and running tasks read from the database.
+
+Recording a value takes a lock per metric only for the time it takes to update a dict, so it is
+cheap enough to do on every transition and safe from any thread. As with any in-process metrics,
+each process only exposes what happened in it, so the transitions of tasks run by
+`manage.py bgtask_worker` or in the process pool's workers aren't seen by the web processes,
+though they are included in the gauges read from the database.
+"""
+
+import bisect
+import math
+import threading
+
+from django.db.models import Count
+
+
+REGISTRY = []
+
+# Task queue waits and run times vary from milliseconds to hours
+DEFAULT_BUCKETS = (0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600, 4 * 3600, math.inf)
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def _key(self, labels):
+        return tuple(str(labels[labelname]) for labelname in self.labelnames)
+
+
+class Histogram(Counter):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        bucket_index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            bucket_counts, total = self._values.get(key) or ([0] * len(self.buckets), 0)
+            bucket_counts[bucket_index] += 1
+            self._values[key] = bucket_counts, total + value
+
+    def samples(self):
+        with self._lock:
+            values = [(key, (list(counts), total)) for key, (counts, total) in self._values.items()]
+        for key, (bucket_counts, total) in values:
+            labels = dict(zip(self.labelnames, key))
+            count = 0
+            for bucket, bucket_count in zip(self.buckets, bucket_counts):
+                count += bucket_count
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bucket)}, count
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+NSN_LABELS = ("namespace", "name")
+
+TRANSITIONS = Counter(
+    "bgtask_transitions_total", "Tasks that have entered each state", (*NSN_LABELS, "state")
+)
+QUEUE_WAIT = Histogram(
+    "bgtask_queue_wait_seconds", "Time from tasks being queued to being started", NSN_LABELS
+)
+RUN_TIME = Histogram(
+    "bgtask_run_seconds", "Time from tasks being started to finishing", (*NSN_LABELS, "state")
+)
+STEPS = Counter("bgtask_steps_total", "Steps completed by tasks, including failed ones", NSN_LABELS)
+FAILED_STEPS = Counter("bgtask_failed_steps_total", "Steps that have failed", NSN_LABELS)
+DISPATCHED = Counter("bgtask_dispatched_total", "Calls dispatched to each backend", ["backend"])
+REJECTED = Counter(
+    "bgtask_rejected_total", "Calls that a backend refused because it was full", ["backend"]
+)
+
+
+def record_transition(task):
+    """Record a task having just entered its current state."""
+    labels = {"namespace": task.namespace, "name": task.name}
+    TRANSITIONS.inc(state=task.state, **labels)
+    if task.state == task.STATES.running and task.queued_at is not None:
+        QUEUE_WAIT.observe((task.started_at - task.queued_at).total_seconds(), **labels)
+    elif task.state in task.FINISHED_STATES and task.started_at is not None:
+        RUN_TIME.observe(
+            (task.completed_at - task.started_at).total_seconds(), state=task.state, **labels
+        )
+
+
+def record_steps(task, num_steps, num_failed_steps):
+    labels = {"namespace": task.namespace, "name": task.name}
+    if num_steps:
+        STEPS.inc(num_steps, **labels)
+    if num_failed_steps:
+        FAILED_STEPS.inc(num_failed_steps, **labels)
+
+
+def render():
+    """All the metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines += _render_metric(metric.name, metric.documentation, metric.type, metric.samples())
+    lines += _render_metric(
+        "bgtask_tasks", "Tasks currently queued or running", "gauge", _task_count_samples()
+    )
+    lines += _render_metric(
+        "bgtask_thread_pool_calls",
+        "Calls in this process's thread pool",
+        "gauge",
+        _thread_pool_samples(),
+    )
+    return "".join(f"{line}\n" for line in lines)
+
+
+def clear():
+    for metric in REGISTRY:
+        metric.clear()
+
+
+# --------------------------------------------------------------------------------------------------
+# Internals
+# --------------------------------------------------------------------------------------------------
+def _task_count_samples():
+    from .models import BackgroundTask
+
+    active_states = [BackgroundTask.STATES.queued, BackgroundTask.STATES.running]
+    counts = (
+        BackgroundTask.objects.filter(state__in=active_states)
+        .order_by()
+        .values("namespace", "name", "state")
+        .annotate(num_tasks=Count("id"))
+    )
+    for labels in counts:
+        num_tasks = labels.pop("num_tasks")
+        yield "bgtask_tasks", labels, num_tasks
+
+
+def _thread_pool_samples():
+    from .backends import thread_pool
+
+    yield "bgtask_thread_pool_calls", {"status": "queued"}, thread_pool.queue_depth()
+    yield "bgtask_thread_pool_calls", {"status": "running"}, thread_pool.active_workers()
+
+
+def _render_metric(name, documentation, metric_type, samples):
+    yield f"# HELP {name} {documentation}"
+    yield f"# TYPE {name} {metric_type}"
+    for sample_name, labels, value in samples:
+        label_pairs = ",".join(
+            f'{label}="{_escape_label_value(label_value)}"' for label, label_value in labels.items()
+        )
+        if label_pairs:
+            label_pairs = f"{{{label_pairs}}}"
+        yield f"{sample_name}{label_pairs} {_format_value(value)}"
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
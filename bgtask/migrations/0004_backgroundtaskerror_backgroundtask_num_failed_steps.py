@@ -0,0 +1,98 @@
+# Generated by Django 4.2.11 on 2026-10-16 20:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+from django.utils.dateparse import parse_datetime
+
+
+def move_errors_to_error_table(apps, schema_editor):
+    BackgroundTask = apps.get_model("bgtask", "BackgroundTask")
+    BackgroundTaskError = apps.get_model("bgtask", "BackgroundTaskError")
+
+    for task in BackgroundTask.objects.exclude(errors=[]).only("id", "errors").iterator():
+        error_records = [
+            BackgroundTaskError(
+                task=task,
+                datetime=parse_datetime(error["datetime"]),
+                num_failed_steps=error.get("num_failed_steps", 0),
+                steps_identifier=str(error.get("steps_identifier") or ""),
+                error_message=error.get("error_message", ""),
+                traceback=error.get("traceback", ""),
+            )
+            for error in task.errors
+        ]
+        BackgroundTaskError.objects.bulk_create(error_records)
+        BackgroundTask.objects.filter(id=task.id).update(
+            num_failed_steps=sum(error_record.num_failed_steps for error_record in error_records)
+        )
+
+
+def move_errors_to_task(apps, schema_editor):
+    BackgroundTask = apps.get_model("bgtask", "BackgroundTask")
+    BackgroundTaskError = apps.get_model("bgtask", "BackgroundTaskError")
+
+    errors_by_task_id = {}
+    for error_record in BackgroundTaskError.objects.order_by("datetime", "id").iterator():
+        error_dict = {
+            "datetime": error_record.datetime.isoformat(),
+            "num_failed_steps": error_record.num_failed_steps,
+        }
+        if error_record.steps_identifier:
+            error_dict["steps_identifier"] = error_record.steps_identifier
+        if error_record.error_message:
+            error_dict["error_message"] = error_record.error_message
+        if error_record.traceback:
+            error_dict["traceback"] = error_record.traceback
+        errors_by_task_id.setdefault(error_record.task_id, []).append(error_dict)
+
+    for task_id, errors in errors_by_task_id.items():
+        BackgroundTask.objects.filter(id=task_id).update(errors=errors)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bgtask", "0003_backgroundtask_queued_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="backgroundtask",
+            name="num_failed_steps",
+            field=models.PositiveIntegerField(
+                default=0, help_text="The number of steps that have failed so far"
+            ),
+        ),
+        migrations.CreateModel(
+            name="BackgroundTaskError",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("datetime", models.DateTimeField(default=django.utils.timezone.now)),
+                ("num_failed_steps", models.PositiveIntegerField(default=0)),
+                ("steps_identifier", models.TextField(blank=True, default="")),
+                ("error_message", models.TextField(blank=True, default="")),
+                ("traceback", models.TextField(blank=True, default="")),
+                (
+                    "task",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="error_records",
+                        to="bgtask.backgroundtask",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["datetime", "id"],
+                "indexes": [
+                    models.Index(fields=["task", "datetime"], name="bgtask_error_task_dt_idx")
+                ],
+            },
+        ),
+        migrations.RunPython(move_errors_to_error_table, move_errors_to_task),
+    ]
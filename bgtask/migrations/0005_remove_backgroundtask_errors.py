@@ -0,0 +1,17 @@
+# Generated by Django 4.2.11 on 2026-10-16 20:39
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bgtask", "0004_backgroundtaskerror_backgroundtask_num_failed_steps"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="backgroundtask",
+            name="errors",
+        ),
+    ]
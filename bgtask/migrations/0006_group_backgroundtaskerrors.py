@@ -0,0 +1,119 @@
+# Generated by Django 4.2.11 on 2026-10-16 21:05
+
+import hashlib
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+MAX_STEPS_IDENTIFIERS = 10
+
+
+def group_errors_by_fingerprint(apps, schema_editor):
+    BackgroundTaskError = apps.get_model("bgtask", "BackgroundTaskError")
+
+    # The exception type wasn't stored before, so these can only be grouped by where they were
+    # raised (or the message if there's no traceback).
+    grouped_records = {}
+    duplicate_ids = []
+    for error_record in BackgroundTaskError.objects.order_by("task", "first_seen", "id").iterator():
+        error_record.fingerprint = hashlib.sha1(
+            f"\n{error_record.traceback or error_record.error_message}".encode()
+        ).hexdigest()
+        steps_identifiers = (
+            [error_record.steps_identifier] if error_record.steps_identifier else []
+        )
+
+        key = (error_record.task_id, error_record.fingerprint)
+        group = grouped_records.get(key)
+        if group is None:
+            error_record.steps_identifiers = steps_identifiers
+            error_record.last_seen = error_record.first_seen
+            grouped_records[key] = error_record
+            continue
+
+        group.num_occurrences += 1
+        group.num_failed_steps += error_record.num_failed_steps
+        group.steps_identifiers = (group.steps_identifiers + steps_identifiers)[
+            :MAX_STEPS_IDENTIFIERS
+        ]
+        group.last_seen = error_record.first_seen
+        duplicate_ids.append(error_record.id)
+
+    BackgroundTaskError.objects.filter(id__in=duplicate_ids).delete()
+    BackgroundTaskError.objects.bulk_update(
+        grouped_records.values(),
+        ["fingerprint", "num_occurrences", "num_failed_steps", "steps_identifiers", "last_seen"],
+        batch_size=1000,
+    )
+
+
+def ungroup_errors(apps, schema_editor):
+    BackgroundTaskError = apps.get_model("bgtask", "BackgroundTaskError")
+
+    # The individual occurrences can't be recovered, so just keep the sample of identifiers
+    error_records = list(BackgroundTaskError.objects.exclude(steps_identifiers=[]))
+    for error_record in error_records:
+        error_record.steps_identifier = ", ".join(error_record.steps_identifiers)
+    BackgroundTaskError.objects.bulk_update(error_records, ["steps_identifier"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bgtask", "0005_remove_backgroundtask_errors"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="backgroundtaskerror",
+            name="bgtask_error_task_dt_idx",
+        ),
+        migrations.RenameField(
+            model_name="backgroundtaskerror",
+            old_name="datetime",
+            new_name="first_seen",
+        ),
+        migrations.AlterModelOptions(
+            name="backgroundtaskerror",
+            options={"ordering": ["first_seen", "id"]},
+        ),
+        migrations.AddField(
+            model_name="backgroundtaskerror",
+            name="fingerprint",
+            field=models.CharField(default="", max_length=40),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="backgroundtaskerror",
+            name="error_type",
+            field=models.CharField(blank=True, default="", max_length=1000),
+        ),
+        migrations.AddField(
+            model_name="backgroundtaskerror",
+            name="num_occurrences",
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name="backgroundtaskerror",
+            name="steps_identifiers",
+            field=models.JSONField(
+                blank=True, default=list, help_text="A sample of the steps this error occurred for"
+            ),
+        ),
+        migrations.AddField(
+            model_name="backgroundtaskerror",
+            name="last_seen",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name="backgroundtaskerror",
+            name="error_message",
+            field=models.TextField(
+                blank=True,
+                default="",
+                help_text="The message of the first occurrence of this error",
+            ),
+        ),
+        migrations.RunPython(group_errors_by_fingerprint, ungroup_errors),
+    ]
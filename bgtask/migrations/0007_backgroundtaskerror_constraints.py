@@ -0,0 +1,27 @@
+# Generated by Django 4.2.11 on 2026-10-16 21:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bgtask", "0006_group_backgroundtaskerrors"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="backgroundtaskerror",
+            name="steps_identifier",
+        ),
+        migrations.AddIndex(
+            model_name="backgroundtaskerror",
+            index=models.Index(fields=["task", "first_seen"], name="bgtask_error_task_dt_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="backgroundtaskerror",
+            constraint=models.UniqueConstraint(
+                fields=("task", "fingerprint"), name="bgtask_error_unique_fingerprint"
+            ),
+        ),
+    ]
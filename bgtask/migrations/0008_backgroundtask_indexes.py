@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-16 20:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bgtask", "0007_backgroundtaskerror_constraints"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="backgroundtask",
+            index=models.Index(
+                fields=["namespace", "name", "queued_at"], name="bgtask_nsn_queued_at_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="backgroundtask",
+            index=models.Index(
+                fields=["namespace", "name", "completed_at"], name="bgtask_nsn_completed_at_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="backgroundtask",
+            index=models.Index(
+                condition=models.Q(("state__in", ["queued", "running"])),
+                fields=["namespace", "name", "state", "queued_at"],
+                name="bgtask_active_nsn_idx",
+            ),
+        ),
+    ]
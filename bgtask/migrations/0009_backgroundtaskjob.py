@@ -0,0 +1,51 @@
+# Generated by Django 4.2.30 on 2026-10-16 20:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bgtask", "0008_backgroundtask_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BackgroundTaskJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("func", models.JSONField(help_text="The import path of the callable to call")),
+                ("args", models.JSONField(blank=True, default=list)),
+                ("kwargs", models.JSONField(blank=True, default=dict)),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                ("claimed_at", models.DateTimeField(blank=True, null=True)),
+                ("claimed_by", models.CharField(blank=True, default="", max_length=1000)),
+                (
+                    "task",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="jobs",
+                        to="bgtask.backgroundtask",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["id"],
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("claimed_at__isnull", True)),
+                        fields=["id"],
+                        name="bgtask_job_unclaimed_idx",
+                    )
+                ],
+            },
+        ),
+    ]
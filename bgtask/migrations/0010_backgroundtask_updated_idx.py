@@ -0,0 +1,17 @@
+# Generated by Django 4.2.11 on 2026-10-16 20:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bgtask", "0009_backgroundtaskjob"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="backgroundtask",
+            index=models.Index(fields=["updated"], name="bgtask_updated_idx"),
+        ),
+    ]
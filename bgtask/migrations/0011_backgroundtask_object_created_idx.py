@@ -0,0 +1,20 @@
+# Generated by Django 4.2.11 on 2026-10-16 20:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bgtask", "0010_backgroundtask_updated_idx"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="backgroundtask",
+            index=models.Index(
+                fields=["content_type", "acted_on_object_id", "created"],
+                name="bgtask_object_created_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.11 on 2026-10-16 20:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bgtask", "0011_backgroundtask_object_created_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="backgroundtask",
+            name="version",
+            field=models.PositiveBigIntegerField(
+                default=0,
+                help_text="Incremented by every update, so that cached statuses can be kept in order",
+            ),
+        ),
+    ]
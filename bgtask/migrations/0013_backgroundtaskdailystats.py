@@ -0,0 +1,55 @@
+# Generated by Django 4.2.11 on 2026-10-16 21:02
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bgtask", "0012_backgroundtask_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BackgroundTaskDailyStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("namespace", models.CharField(blank=True, default="", max_length=1000)),
+                ("name", models.CharField(max_length=1000)),
+                ("date", models.DateField(help_text="The day the tasks completed")),
+                ("num_tasks", models.PositiveIntegerField(default=0)),
+                ("num_succeeded", models.PositiveIntegerField(default=0)),
+                ("num_partially_succeeded", models.PositiveIntegerField(default=0)),
+                ("num_failed", models.PositiveIntegerField(default=0)),
+                (
+                    "total_duration",
+                    models.DurationField(
+                        default=datetime.timedelta,
+                        help_text="The total time from starting to completing",
+                    ),
+                ),
+                (
+                    "num_timed",
+                    models.PositiveIntegerField(
+                        default=0, help_text="The number of tasks included in total_duration"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "background task daily stats",
+                "ordering": ["-date", "namespace", "name"],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="backgroundtaskdailystats",
+            constraint=models.UniqueConstraint(
+                fields=("namespace", "name", "date"), name="bgtask_daily_stats_unique_nsn_date"
+            ),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.11 on 2026-10-16 21:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bgtask", "0013_backgroundtaskdailystats"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="backgroundtask",
+            name="profile",
+            field=models.BooleanField(
+                default=False,
+                help_text="Whether to profile the task while it runs, storing a BackgroundTaskProfile",
+            ),
+        ),
+        migrations.CreateModel(
+            name="BackgroundTaskProfile",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                (
+                    "duration",
+                    models.DurationField(help_text="The wall clock time that was profiled"),
+                ),
+                ("compressed_stats", models.BinaryField()),
+                (
+                    "task",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="profile_stats",
+                        to="bgtask.backgroundtask",
+                    ),
+                ),
+            ],
+        ),
+    ]
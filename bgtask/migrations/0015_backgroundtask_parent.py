@@ -0,0 +1,26 @@
+# Generated by Django 4.2.11 on 2026-10-16 21:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bgtask", "0014_backgroundtask_profile"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="backgroundtask",
+            name="parent",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="The task this is one part of, whose progress is combined from its children's",
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="children",
+                to="bgtask.backgroundtask",
+            ),
+        ),
+    ]
@@ -7,6 +7,7 @@ from django.contrib.messages import INFO
 from django.db.models import Q
 from django.utils import timezone
 
+from .concurrency import set_max_concurrent
 from .models import BackgroundTask
 
 
@@ -21,6 +22,12 @@ class BGTaskModelAdmin(admin.ModelAdmin):
     # Set this to tell the admin change list page which background tasks to show in the table.
     #
     # bgtask_names = ["task a", "task b"]
+    #
+    # Set this to limit how many calls for tasks with these names the backend runs at once, e.g.
+    # so that queued tasks run one at a time. Limits are per process, and only the thread pool
+    # backend enforces them; with other backends a warning is logged and they are ignored.
+    #
+    # bgtask_max_concurrent = {"task a": 1}
 
     # ----------------------------------------------------------------------------------------------
     # Class API
@@ -55,9 +62,42 @@ class BGTaskModelAdmin(admin.ModelAdmin):
         bgtask.queue()
         return bgtask
 
+    def queue_bgtasks(self, name, objects, func=None, **kwargs):
+        """Queue a task acting on each of objects in bulk (see BackgroundTaskQuerySet.bulk_queue())
+        and, if func is given, dispatch func(obj, bgtask) for each of them to the backend in one
+        call. Returns the tasks.
+
+        func may be a method of this admin, which is called on a new instance of its class if the
+        backend runs calls in another process.
+        """
+        objects = list(objects)
+        bgtasks = BackgroundTask.objects.bulk_queue(
+            name, objects, namespace=self._bgtask_namespace, **kwargs
+        )
+        if func is not None:
+            from .backends import default_backend
+
+            if getattr(func, "__self__", None) is self:
+                # Bound methods can't be serialised, so pass the class and the method's name
+                default_backend.dispatch_many(
+                    _run_model_admin_method,
+                    (
+                        (type(self), func.__name__, obj, bgtask)
+                        for obj, bgtask in zip(objects, bgtasks)
+                    ),
+                )
+            else:
+                default_backend.dispatch_many(func, zip(objects, bgtasks))
+        return bgtasks
+
     # ----------------------------------------------------------------------------------------------
     # Superclass overrides
     # ----------------------------------------------------------------------------------------------
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for name, max_concurrent in getattr(self, "bgtask_max_concurrent", {}).items():
+            set_max_concurrent(name, max_concurrent, namespace=self._bgtask_namespace)
+
     def changelist_view(self, request, extra_context=None):
         extra_context = extra_context or {}
         extra_context["admin_bg_tasks"] = self._admin_bg_tasks(request)
@@ -121,10 +161,15 @@ class BGTaskModelAdmin(admin.ModelAdmin):
                     & Q(completed_at__gt=timezone.now() - timedelta(hours=2))
                 )
             )
+            .with_position_in_queue()
             .order_by("-started_at", "-queued_at")
         )
-        bgts.add_position_in_queue()
         for bgt in bgts:
             bgt.admin_description = task_name_to_desc[bgt.name]
 
         return bgts
+
+
+def _run_model_admin_method(model_admin_class, method_name, obj, bgtask):
+    model_admin = model_admin_class(type(obj), admin.site)
+    getattr(model_admin, method_name)(obj, bgtask)
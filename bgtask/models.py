@@ -1,55 +1,236 @@
+import cProfile
 import collections
+import functools
+import hashlib
 import logging
-import os
+import marshal
+import pstats
+import threading
 import time
 import traceback
 import uuid
+import zlib
 from contextlib import contextmanager
+from datetime import timedelta
 
+from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Exists, F, Func, OuterRef, Q, Subquery, Value, When
+from django.db.models import Count, Sum
+from django.db.models.functions import Coalesce, Greatest, TruncDate
 from django.forms.models import model_to_dict
 from django.utils import timezone
 
 from model_utils import Choices
 
-from .utils import locked, only_if_state, q_or
+from . import metrics, status_cache
+from .progress import ProgressBuffer
+from .utils import chunked, q_or
 
 
 log = logging.getLogger(__name__)
 
+# How many tasks bulk_queue() inserts per query
+BULK_QUEUE_BATCH_SIZE = 1000
+
+# Held while a task is being profiled, as only one profiler can be enabled at a time
+_profiler_lock = threading.Lock()
+
 
 class BackgroundTaskQuerySet(models.QuerySet):
+    def with_position_in_queue(self):
+        """Annotate each task with position_in_queue, which is None unless the task is queued, in
+        which case it's the number of tasks with the same namespace and name that were queued
+        before it and are still queued.
+
+        If a task with the same namespace and name that was queued later has already been
+        dispatched, the position is 0 since the queue is clearly moving.
+        """
+        same_queue = BackgroundTask.objects.filter(
+            namespace=OuterRef("namespace"), name=OuterRef("name")
+        )
+        num_queued_before = Subquery(
+            same_queue.filter(
+                state=BackgroundTask.STATES.queued, queued_at__lt=OuterRef("queued_at")
+            )
+            .order_by()
+            .annotate(count=Func(F("pk"), function="COUNT"))
+            .values("count")
+        )
+        later_task_dispatched = Exists(
+            same_queue.filter(queued_at__gt=OuterRef("queued_at")).exclude(
+                state__in=[BackgroundTask.STATES.not_started, BackgroundTask.STATES.queued]
+            )
+        )
+        return self.annotate(
+            position_in_queue=Case(
+                When(~Q(state=BackgroundTask.STATES.queued), then=Value(None)),
+                When(later_task_dispatched, then=Value(0)),
+                default=num_queued_before,
+                output_field=models.IntegerField(),
+            )
+        )
+
     def add_position_in_queue(self):
         """This evaluates the queryset and adds position_in_queue to each one (which requires
-        more DB queries).
+        another DB query). Prefer with_position_in_queue().
+        """
+        positions = dict(self.with_position_in_queue().values_list("id", "position_in_queue"))
+        for task in self:
+            task.position_in_queue = positions.get(task.id)
+
+        return self
+
+    def latest_for_objects(self, objs):
+        """Return the most recently created task acting on each of objs, which must be instances
+        of the same model, as a dict by the object's pk as a string. This is one query however
+        many objects there are.
+
+        Tasks without a content type are matched on the object id alone.
         """
-        recent_unqueued_task_by_nsn = {(task.namespace, task.name): None for task in self}
-        for ns, name in recent_unqueued_task_by_nsn:
-            recent_unqueued_task_by_nsn[(ns, name)] = BackgroundTask.most_recently_unqueued_task(
-                ns, name
+        if not objs:
+            return {}
+
+        content_type = ContentType.objects.get_for_model(objs[0])
+        for_model = Q(content_type=content_type) | Q(content_type__isnull=True)
+        latest_id = (
+            self.filter(for_model, acted_on_object_id=OuterRef("acted_on_object_id"))
+            .order_by("-created")
+            .values("id")[:1]
+        )
+        tasks = self.filter(
+            for_model,
+            acted_on_object_id__in={str(obj.pk) for obj in objs},
+            id=Subquery(latest_id),
+        )
+        return {task.acted_on_object_id: task for task in tasks}
+
+    def bulk_queue(self, name, objects, namespace="", batch_size=BULK_QUEUE_BATCH_SIZE, **fields):
+        """Create a task acting on each of objects, already queued, with one insert per
+        batch_size tasks rather than a create() and queue() each, and return them in the same
+        order as objects.
+
+        The tasks are queued a microsecond apart so that their positions in the queue follow
+        the order of objects.
+        """
+        queued_at = timezone.now()
+        tasks = [
+            self.model(
+                namespace=namespace,
+                name=name,
+                state=BackgroundTask.STATES.queued,
+                queued_at=queued_at + timedelta(microseconds=ii),
+                content_type=ContentType.objects.get_for_model(obj),
+                acted_on_object_id=str(obj.pk),
+                **fields,
             )
+            for ii, obj in enumerate(objects)
+        ]
+        with transaction.atomic():
+            self.bulk_create(tasks, batch_size=batch_size)
 
-        queued_tasks_by_nsn = BackgroundTask.queued_tasks_in_order_by_nsn_like(self)
+        log.info("Background Tasks queued: %d %s", len(tasks), name)
+        if tasks:
+            metrics.TRANSITIONS.inc(
+                len(tasks), namespace=namespace, name=name, state=BackgroundTask.STATES.queued
+            )
+        return tasks
 
-        for task in self:
-            if task.state != task.STATES.queued:
-                continue
+    def queue_many(self, tasks, batch_size=BULK_QUEUE_BATCH_SIZE):
+        """Queue those of tasks that haven't been started, like queue() on each but with one
+        UPDATE per batch_size tasks, and set their new state on them. Returns the tasks queued.
+        """
+        tasks = [task for task in tasks if task.state == BackgroundTask.STATES.not_started]
+        queued_at = timezone.now()
+        for batch in chunked(tasks, batch_size):
+            self.filter(
+                id__in=[task.id for task in batch], state=BackgroundTask.STATES.not_started
+            ).update(
+                state=BackgroundTask.STATES.queued,
+                queued_at=queued_at,
+                # auto_now isn't applied by update()
+                updated=queued_at,
+                version=F("version") + 1,
+            )
+        status_cache.delete_many([task.id for task in tasks])
 
-            unqueued_task = recent_unqueued_task_by_nsn[(task.namespace, task.name)]
-            if unqueued_task is not None and task.queued_at < unqueued_task.queued_at:
-                # More recently queued task has already been dispatched so we should be going...
-                task.position_in_queue = 0
-                continue
+        num_queued = collections.Counter((task.namespace, task.name) for task in tasks)
+        for task in tasks:
+            task.state = BackgroundTask.STATES.queued
+            task.queued_at = task.updated = queued_at
+        for (namespace, name), count in num_queued.items():
+            log.info("Background Tasks queued: %d %s", count, name)
+            metrics.TRANSITIONS.inc(
+                count, namespace=namespace, name=name, state=BackgroundTask.STATES.queued
+            )
+        return tasks
 
-            task.position_in_queue = 0
-            for queued_task in queued_tasks_by_nsn[(task.namespace, task.name)]:
-                if queued_task.queued_at >= task.queued_at:
-                    break
-                task.position_in_queue += 1
+    def child_rollups(self):
+        """Return the combined progress of the children of each of these tasks that has any, by
+        the task's id, from one aggregate query over the children.
 
-        return self
+        Each is a dict of the number of children, finished, succeeded and failed children, the
+        children's steps summed, and the state the parent has if all its children have finished
+        (see BackgroundTask.rollup_state()), or running if they haven't.
+        """
+        STATES = BackgroundTask.STATES
+        rollups = (
+            BackgroundTask.objects.filter(parent__in=self.order_by().values("id"))
+            .order_by()
+            .values("parent_id")
+            .annotate(
+                num_children=Count("id"),
+                num_finished=Count("id", filter=Q(state__in=BackgroundTask.FINISHED_STATES)),
+                num_succeeded=Count("id", filter=Q(state=STATES.success)),
+                num_failed=Count("id", filter=Q(state=STATES.failed)),
+                steps_to_complete=Sum("steps_to_complete"),
+                steps_completed=Sum("steps_completed"),
+                num_failed_steps=Sum("num_failed_steps"),
+            )
+        )
+        return {
+            str(rollup.pop("parent_id")): {**rollup, "state": BackgroundTask.rollup_state(rollup)}
+            for rollup in rollups
+        }
+
+    def status_dicts(self, include=()):
+        """Return a dict for each task with the fields that progress widgets use, like a slimmed
+        down task_dict, fetched with values() rather than building model instances.
+
+        include may contain "result" and "errors" to add those too, errors being fetched for all
+        the tasks in one more query, and "children" to add the tasks' child_rollups(), which are
+        None for tasks without children.
+        """
+        fields = [*BackgroundTask.STATUS_FIELDS, "position_in_queue"]
+        if "result" in include:
+            fields.append("result")
+
+        status_dicts = [
+            BackgroundTask.values_to_status(values)
+            for values in self.with_position_in_queue().values(*fields)
+        ]
+
+        if "errors" in include:
+            errors_by_task_id = collections.defaultdict(list)
+            for error_values in BackgroundTaskError.objects.filter(
+                task_id__in=[status_dict["id"] for status_dict in status_dicts]
+            ).values("task_id", *BackgroundTaskError.DICT_FIELDS):
+                errors_by_task_id[str(error_values["task_id"])].append(
+                    BackgroundTaskError.values_to_dict(error_values)
+                )
+            for status_dict in status_dicts:
+                status_dict["errors"] = errors_by_task_id[status_dict["id"]]
+
+        if "children" in include:
+            rollups = BackgroundTask.objects.filter(
+                id__in=[status_dict["id"] for status_dict in status_dicts]
+            ).child_rollups()
+            for status_dict in status_dicts:
+                status_dict["children"] = rollups.get(status_dict["id"])
+
+        return status_dicts
 
 
 class BackgroundTask(models.Model):
@@ -72,6 +253,21 @@ class BackgroundTask(models.Model):
     )
 
     STATES = Choices("not_started", "queued", "running", "success", "partial_success", "failed")
+    FINISHED_STATES = (STATES.success, STATES.partial_success, STATES.failed)
+    # The fields in BackgroundTaskQuerySet.status_dicts()
+    STATUS_FIELDS = (
+        "id",
+        "name",
+        "state",
+        "steps_to_complete",
+        "steps_completed",
+        "num_failed_steps",
+        "queued_at",
+        "started_at",
+        "completed_at",
+        "updated",
+        "version",
+    )
     state = models.CharField(max_length=16, default=STATES.not_started, choices=STATES)
     steps_to_complete = models.PositiveIntegerField(
         null=True, blank=True, help_text="The number of steps in the task for it to be completed."
@@ -84,8 +280,17 @@ class BackgroundTask(models.Model):
     started_at = models.DateTimeField(null=True, blank=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     result = models.JSONField(null=True, blank=True, help_text="The result(s) of the task, if any")
-    errors = models.JSONField(
-        default=list, blank=True, help_text="Any errors that occurred during processing"
+    num_failed_steps = models.PositiveIntegerField(
+        default=0, help_text="The number of steps that have failed so far"
+    )
+
+    parent = models.ForeignKey(
+        "self",
+        on_delete=models.CASCADE,
+        related_name="children",
+        blank=True,
+        null=True,
+        help_text="The task this is one part of, whose progress is combined from its children's",
     )
 
     # This follows the pattern described in
@@ -97,16 +302,52 @@ class BackgroundTask(models.Model):
     # Helpful to have these for debugging mostly
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
+    profile = models.BooleanField(
+        default=False,
+        help_text="Whether to profile the task while it runs, storing a BackgroundTaskProfile",
+    )
+    version = models.PositiveBigIntegerField(
+        default=0,
+        help_text="Incremented by every update, so that cached statuses can be kept in order",
+    )
 
     objects = models.Manager.from_queryset(BackgroundTaskQuerySet)()
 
     class Meta:
         ordering = ["created", "id"]
+        indexes = [
+            # Finding the most recently dispatched task in a queue (most_recently_unqueued_task()
+            # and with_position_in_queue())
+            models.Index(
+                fields=["namespace", "name", "queued_at"], name="bgtask_nsn_queued_at_idx"
+            ),
+            # Recently completed tasks shown in the admin
+            models.Index(
+                fields=["namespace", "name", "completed_at"], name="bgtask_nsn_completed_at_idx"
+            ),
+            # Tasks waiting in or running from a queue, which are generally few compared to the
+            # completed ones, so a partial index where the database supports them.
+            models.Index(
+                fields=["namespace", "name", "state", "queued_at"],
+                name="bgtask_active_nsn_idx",
+                condition=Q(state__in=["queued", "running"]),
+            ),
+            # Polling for tasks changed since a cursor
+            models.Index(fields=["updated"], name="bgtask_updated_idx"),
+            # The latest task for each object in a change list (latest_for_objects())
+            models.Index(
+                fields=["content_type", "acted_on_object_id", "created"],
+                name="bgtask_object_created_idx",
+            ),
+        ]
 
     # This needs to be added dynamically to model instances, and is done by
     # BackgroundTaskQuerySet.add_position_in_queue()
     position_in_queue = None
 
+    # Set while inside progress_buffer()
+    _progress_buffer = None
+
     @property
     def task_dict(self):
         task_dict = model_to_dict(self)
@@ -115,11 +356,31 @@ class BackgroundTask(models.Model):
             "updated": self.updated.isoformat(),
             "position_in_queue": self.position_in_queue,
             **task_dict,
+            "errors": self.errors,
         }
 
+    @functools.cached_property
+    def errors(self):
+        """The errors that have occurred during processing as dicts, one per distinct error in the
+        order they were first seen.
+        """
+        return [error.to_dict() for error in self.error_records.all()]
+
     @property
-    def num_failed_steps(self):
-        return sum(error.get("num_failed_steps", 0) for error in self.errors)
+    def should_profile(self):
+        return self.profile or self.name in getattr(settings, "BGTASK_PROFILED_TASKS", ())
+
+    @property
+    def all_steps_completed(self):
+        return self._all_steps_completed(self.steps_completed, self.steps_to_complete)
+
+    @staticmethod
+    def _all_steps_completed(steps_completed, steps_to_complete):
+        return (
+            steps_to_complete is not None
+            and steps_completed is not None
+            and steps_completed >= steps_to_complete
+        )
 
     @property
     def incomplete(self):
@@ -178,140 +439,236 @@ class BackgroundTask(models.Model):
             self.fail(exc)
             raise
 
-    @locked
-    @only_if_state(STATES.not_started)
+    @contextmanager
+    def progress_buffer(self, flush_every_n=None, flush_every_s=5):
+        """Buffer add_successful_steps() and steps_failed() calls in memory while in this context,
+        writing them to the database in a single update per flush rather than one per call.
+
+        The buffer is flushed when flush_every_n steps have accumulated, when flush_every_s seconds
+        have passed since the last flush (checked whenever steps are added), when the task is
+        finished or failed and when the context exits, whether or not with an exception.
+        """
+        if self._progress_buffer is not None:
+            raise RuntimeError("%s is already buffering progress" % self)
+
+        self._progress_buffer = ProgressBuffer(
+            flush_every_n=flush_every_n, flush_every_s=flush_every_s
+        )
+        try:
+            yield self
+        finally:
+            try:
+                self._flush_progress_buffer()
+            finally:
+                self._progress_buffer = None
+
+    def spawn_children(self, names, **fields):
+        """Create a child task of this one for each of names with one query, in this task's
+        namespace and with any other fields given, returning them.
+
+        The children report their own progress, so don't contend with each other for this task's
+        row, and this task is finished by the last of them to finish (see finish_from_children()).
+        """
+        return type(self).objects.bulk_create(
+            type(self)(parent=self, namespace=self.namespace, name=name, **fields) for name in names
+        )
+
+    def finish_from_children(self):
+        """Finish this task if all its children have finished, with the state given by
+        rollup_state(). Returns whether this call finished it.
+        """
+        rollup = type(self).objects.filter(id=self.id).child_rollups().get(str(self.id))
+        if rollup is None or rollup["num_finished"] < rollup["num_children"]:
+            return False
+
+        return self._transition(
+            "finish_from_children",
+            (self.STATES.not_started, self.STATES.queued, self.STATES.running),
+            {"state": rollup["state"], "completed_at": timezone.now()},
+            no_op_states=self.FINISHED_STATES,
+        )
+
+    @contextmanager
+    def profiled(self):
+        """Run the body of this context under cProfile if should_profile, storing the stats as a
+        BackgroundTaskProfile when it exits.
+
+        Only one profiler can be enabled in a process at a time (from Python 3.12 cProfile
+        profiles every thread), so if another task is being profiled, or another profiler is
+        active, the body is run without profiling.
+        """
+        if not self.should_profile:
+            yield
+            return
+
+        if not _profiler_lock.acquire(blocking=False):
+            log.warning("Not profiling %s as another task is being profiled", self)
+            yield
+            return
+
+        try:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError as exc:
+                log.warning("Not profiling %s: %s", self, exc)
+                profiler = None
+
+            if profiler is None:
+                yield
+                return
+
+            started_at = time.perf_counter()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                BackgroundTaskProfile.save_stats(
+                    self, profiler, timedelta(seconds=time.perf_counter() - started_at)
+                )
+        finally:
+            _profiler_lock.release()
+
     def queue(self):
         log.info("Background Task queueing: %s", self.id)
-        self.state = self.STATES.queued
-        self.queued_at = timezone.now()
-        self.save()
+        self._transition(
+            "queue",
+            self.STATES.not_started,
+            {"state": self.STATES.queued, "queued_at": timezone.now()},
+        )
 
-    @locked
-    @only_if_state(
-        (STATES.not_started, STATES.queued),
-        # Allow start() to be called while running so that if a task's subtasks are queued and
-        # asynchronous each can call .start() independently so the first one that is executed will
-        # start the task.
-        no_op_states=(STATES.running,),
-    )
     def start(self):
         log.info("Background Task starting: %s", self.id)
-        self.state = self.STATES.running
-        self.started_at = timezone.now()
-        self.save()
+        self._transition(
+            "start",
+            (self.STATES.not_started, self.STATES.queued),
+            {"state": self.STATES.running, "started_at": timezone.now()},
+            # Allow start() to be called while running so that if a task's subtasks are queued and
+            # asynchronous each can call .start() independently so the first one that is executed
+            # will start the task.
+            no_op_states=(self.STATES.running,),
+        )
 
-    @locked
-    @only_if_state((STATES.queued, STATES.running))
     def fail(self, exc):
         """Call to indicate a complete and final failure of the task"""
         log.info("Background Task failed: %s %s", self.id, exc)
-        self.state = self.STATES.failed
-        self.completed_at = timezone.now()
-        self.errors.append(
-            {"datetime": self.completed_at.isoformat(), **self._error_dict_for_error(exc)},
+        self._flush_progress_buffer(finish_if_completed=False)
+        completed_at = timezone.now()
+        error_record = self._error_record(exc, first_seen=completed_at, last_seen=completed_at)
+        self._transition(
+            "fail",
+            (self.STATES.queued, self.STATES.running),
+            {
+                "state": self.STATES.failed,
+                "completed_at": completed_at,
+                "num_failed_steps": F("num_failed_steps") + error_record.num_failed_steps,
+            },
+            error_records=[error_record],
         )
-        self.save()
 
-    @locked
-    @only_if_state(STATES.running)
     def succeed(self, result=None):
         log.info("%s succeeded.", self)
-        self.state = self.STATES.success
-        self.steps_completed = self.steps_to_complete
-        self.completed_at = timezone.now()
-        self.result = self.serialize_result(result)
-        self.save()
+        self._flush_progress_buffer(finish_if_completed=False)
+        self._transition(
+            "succeed",
+            self.STATES.running,
+            {
+                "state": self.STATES.success,
+                "steps_completed": F("steps_to_complete"),
+                "completed_at": timezone.now(),
+                "result": self.serialize_result(result),
+            },
+        )
 
-    @locked
-    @only_if_state(STATES.running)
     def finish(self):
         """Mark task as finished, automatically deducing the final state."""
-        if not self.errors:
-            log.info("Finishing as success with no errors")
-            self.state = self.STATES.success
-        elif self.steps_to_complete is None:
-            log.info("Finishing as success with no steps to complete configured")
-            self.state = self.STATES.success
-        elif self.num_failed_steps == self.steps_to_complete:
-            log.info("Finishing as failure with all steps failed")
-            self.state = self.STATES.failed
-        else:
-            log.info("Finishing as partial success with some steps failed")
-            self.state = self.STATES.partial_success
-
-        self.completed_at = timezone.now()
-        self.save()
+        self._flush_progress_buffer(finish_if_completed=False)
+        self._finish()
 
-    @locked
     def add_successful_steps(self, num_steps):
-        self.steps_completed += num_steps
-        self._finish_or_save()
-
-    @locked
-    def steps_failed(self, num_steps, steps_identifier=None, error=None):
-        self.steps_completed += num_steps
-        error_dict = {
-            "datetime": timezone.now().isoformat(),
-            "num_failed_steps": num_steps,
-        }
-        if steps_identifier:
-            error_dict["steps_identifier"] = steps_identifier
-
-        error_dict.update(self._error_dict_for_error(error))
+        if self._progress_buffer is not None:
+            if self._progress_buffer.add(num_steps):
+                self._flush_progress_buffer()
+            return
 
-        self.errors.append(error_dict)
-        self._finish_or_save()
+        self._record_steps(num_steps, [])
 
-    def dispatch(self):
-        # double fork to avoid zombies
-        pid = os.fork()
+    def steps_failed(self, num_steps, steps_identifier=None, error=None):
+        error_record = self._error_record(
+            error,
+            num_failed_steps=num_steps,
+            steps_identifiers=[str(steps_identifier)] if steps_identifier else [],
+        )
 
-        if pid != 0:
-            log.info("Waiting for child %d", pid)
-            os.waitpid(pid, 0)
-            log.info("Child exited")
+        if self._progress_buffer is not None:
+            if self._progress_buffer.add(num_steps, error_record):
+                self._flush_progress_buffer()
             return
 
-        # get fresh db connections in all children
-        from django import db
+        self._record_steps(num_steps, [error_record])
 
-        db.connections.close_all()
+    def dispatch(self):
+        """Demonstrate progress being reported by running some fake steps in a worker process."""
+        from .backends import process_pool
 
-        pid2 = os.fork()
-        if pid2 != 0:
-            log.info("Child exiting %d", os.getpid())
-            os._exit(0)
+        return process_pool.dispatch(_demonstrate_progress, self)
 
-        self.start()
+    # ----------------------------------------------------------------------------------------------
+    # For overriding by subclasses
+    # ----------------------------------------------------------------------------------------------
+    def __str__(self):
+        return "%s %s %s" % (type(self).__name__, self.id, self.state)
 
-        time.sleep(5)
-        self.steps_to_complete = 100
-        self.steps_completed = 0
-        self.save()
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self.__dict__.pop("errors", None)
 
-        def raise_an_exception():
-            raise Exception("Some exception")
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            super().save(*args, **kwargs)
+            return
 
-        for ii in range(100):
-            time.sleep(0.2)
+        # Never write back a version that another process has already incremented
+        version = self.version
+        self.version = F("version") + 1
+        if kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = {*kwargs["update_fields"], "version"}
+        try:
+            with status_cache.writing():
+                super().save(*args, **kwargs)
+                # Reads the version back if the status cache is enabled
+                self._after_update([])
+        except BaseException:
+            self.version = version
+            raise
 
-            if ii % 52 == 0:
-                try:
-                    raise_an_exception()
-                except Exception as exc:
-                    self.steps_failed(1, str(ii), error=exc)
-            else:
-                self.add_successful_steps(1)
-            if ii % 10 == 0:
-                log.info("Completed %d items", ii)
+        if status_cache.get_cache() is None:
+            # Defer the version so that it's only read back if it's used
+            del self.version
 
-        os._exit(0)
+    @staticmethod
+    def values_to_status(values):
+        """Format the STATUS_FIELDS of a task fetched with values() as a status dict."""
+        return {
+            **values,
+            "id": str(values["id"]),
+            # In full, as clients send it back as a cursor
+            "updated": values["updated"].isoformat(),
+        }
 
-    # ----------------------------------------------------------------------------------------------
-    # For overriding by subclasses
-    # ----------------------------------------------------------------------------------------------
-    def __str__(self):
-        return "%s %s %s" % (type(self).__name__, self.id, self.state)
+    @staticmethod
+    def rollup_state(rollup):
+        """The state of a parent task given its child_rollups() entry: success if all its children
+        succeeded, failed if they all failed, partial_success otherwise, or running while any
+        haven't finished.
+        """
+        if rollup["num_finished"] < rollup["num_children"]:
+            return BackgroundTask.STATES.running
+        if rollup["num_succeeded"] == rollup["num_children"]:
+            return BackgroundTask.STATES.success
+        if rollup["num_failed"] == rollup["num_children"]:
+            return BackgroundTask.STATES.failed
+        return BackgroundTask.STATES.partial_success
 
     @staticmethod
     def serialize_result(result):
@@ -320,25 +677,473 @@ class BackgroundTask(models.Model):
     # ----------------------------------------------------------------------------------------------
     # Internals
     # ----------------------------------------------------------------------------------------------
-    @staticmethod
-    def _error_dict_for_error(error):
-        if not error:
-            return {}
+    def _error_record(self, error, **kwargs):
+        now = timezone.now()
+        error_record = BackgroundTaskError(
+            task=self, **{"first_seen": now, "last_seen": now, **kwargs}
+        )
+        if isinstance(error, BaseException):
+            error_record.error_type = type(error).__qualname__
+        if error:
+            error_record.error_message = str(error)
+
+        # Errors are grouped by the type and where they were raised, ignoring the message, which
+        # usually differs for every item that fails in the same way.
+        fingerprint = hashlib.sha1(error_record.error_type.encode())
+        if getattr(error, "__traceback__", None) is not None:
+            frames = traceback.extract_tb(error.__traceback__)
+            error_record.traceback = "".join(traceback.format_list(frames))
+            for frame in frames:
+                fingerprint.update(f"\n{frame.filename}:{frame.lineno}:{frame.name}".encode())
+        else:
+            # Without a traceback the message is all there is to tell errors apart
+            fingerprint.update(f"\n{error_record.error_message}".encode())
+        error_record.fingerprint = fingerprint.hexdigest()
+
+        return error_record
 
-        error_dict = {"error_message": str(error)}
+    def _transition(self, action, from_states, updates, no_op_states=(), error_records=()):
+        """Apply updates (a dict of field name to value or expression) with a single UPDATE that
+        only matches if the task is in one of from_states, and set them on this instance. Any
+        error_records are stored in the same transaction as the update if it's made.
 
-        if hasattr(error, "__traceback__"):
-            error_dict["traceback"] = "".join(
-                traceback.format_list(traceback.extract_tb(error.__traceback__))
+        Returns True if the task was updated, or False if it wasn't because it was in one of
+        no_op_states, in which case this instance is refreshed with the current values of the fields
+        instead. Raises RuntimeError if it was in any other state.
+        """
+        from_states = (from_states,) if isinstance(from_states, str) else tuple(from_states)
+        # auto_now isn't applied by update()
+        updates = {**updates, "updated": timezone.now()}
+
+        tasks = type(self).objects.filter(id=self.id)
+        with transaction.atomic() if error_records else status_cache.writing():
+            num_updated = tasks.filter(state__in=from_states).update(
+                **updates, version=F("version") + 1
             )
-        return error_dict
+            if num_updated:
+                if error_records:
+                    BackgroundTaskError.record(error_records)
+                    self.__dict__.pop("errors", None)
+                expression_fields = []
+                for field_name, value in updates.items():
+                    if hasattr(value, "resolve_expression"):
+                        expression_fields.append(field_name)
+                    else:
+                        setattr(self, field_name, value)
+                self._after_update(expression_fields)
+                metrics.record_transition(self)
+
+        if num_updated:
+            if self.parent_id is not None and self.state in self.FINISHED_STATES:
+                self._finish_parent_if_last_child()
+            return True
+
+        current_values = tasks.values("state", *updates).get()
+        if current_values["state"] in no_op_states:
+            for field_name, value in current_values.items():
+                setattr(self, field_name, value)
+            return False
 
-    def _finish_or_save(self):
-        if (
-            self.steps_to_complete is not None
-            and self.steps_completed is not None
-            and self.steps_completed >= self.steps_to_complete
+        self.state = current_values["state"]
+        raise RuntimeError(
+            "%s cannot execute %s as in state %s not one of %s"
+            % (self, action, self.state, from_states)
+        )
+
+    def _after_update(self, fields_to_read):
+        """Read back fields of this task that were just updated with expressions, and write its
+        status to the status cache if that's enabled. Must be called while the row is still
+        locked by the update.
+
+        Returns the values read back, which unlike this instance's attributes can't be changed by
+        other threads updating the same instance.
+        """
+        use_cache = status_cache.get_cache() is not None
+        if use_cache:
+            fields_to_read = {*fields_to_read, *self.STATUS_FIELDS}
+        values = {}
+        if fields_to_read:
+            values = type(self).objects.filter(id=self.id).values(*fields_to_read).get()
+            for field_name, value in values.items():
+                setattr(self, field_name, value)
+        if use_cache:
+            status_cache.write(
+                self.values_to_status({field: values[field] for field in self.STATUS_FIELDS})
+            )
+        return values
+
+    def _finish(self, no_op_states=()):
+        has_errors = Exists(BackgroundTaskError.objects.filter(task=OuterRef("pk")))
+        if self._transition(
+            "finish",
+            self.STATES.running,
+            {
+                "state": Case(
+                    When(~has_errors, then=Value(self.STATES.success)),
+                    When(steps_to_complete__isnull=True, then=Value(self.STATES.success)),
+                    When(num_failed_steps=F("steps_to_complete"), then=Value(self.STATES.failed)),
+                    default=Value(self.STATES.partial_success),
+                ),
+                "completed_at": timezone.now(),
+            },
+            no_op_states=no_op_states,
         ):
-            self.finish()
+            log.info("%s finished", self)
+
+    def _record_steps(self, num_steps, error_records, finish_if_completed=True):
+        """Add to the step counters and store any error records with plain INSERTs and UPDATEs
+        rather than locking the task, so that parallel workers on the same task do not queue up on
+        the row lock.
+        """
+        tasks = type(self).objects.filter(id=self.id)
+        num_failed_steps = sum(error_record.num_failed_steps for error_record in error_records)
+        with transaction.atomic() if error_records else status_cache.writing():
+            if error_records:
+                BackgroundTaskError.record(error_records)
+                self.__dict__.pop("errors", None)
+            tasks.update(
+                steps_completed=Coalesce(F("steps_completed"), 0) + num_steps,
+                num_failed_steps=F("num_failed_steps") + num_failed_steps,
+                # auto_now isn't applied by update()
+                updated=timezone.now(),
+                version=F("version") + 1,
+            )
+            values = self._after_update(
+                ["steps_completed", "steps_to_complete", "num_failed_steps", "state", "updated"]
+            )
+
+        metrics.record_steps(self, num_steps, num_failed_steps)
+
+        # Decided from the values read back rather than this instance, which other threads may be
+        # recording steps with too, so that whichever update completes the steps finishes the task.
+        if finish_if_completed and self._all_steps_completed(
+            values["steps_completed"], values["steps_to_complete"]
+        ):
+            self._finish_unless_finished()
+
+    def _flush_progress_buffer(self, finish_if_completed=True):
+        if self._progress_buffer is None:
+            return
+
+        num_steps, error_records = self._progress_buffer.drain()
+        if num_steps or error_records:
+            self._record_steps(num_steps, error_records, finish_if_completed=finish_if_completed)
+
+    def _finish_parent_if_last_child(self):
+        # Checked after this task's update has been committed, so that of children finishing at
+        # the same time at least the last to commit sees that they all have.
+        siblings = type(self).objects.filter(parent_id=self.parent_id)
+        if not siblings.exclude(state__in=self.FINISHED_STATES).exists():
+            type(self).objects.get(id=self.parent_id).finish_from_children()
+
+    def _finish_unless_finished(self):
+        # Several workers may see the last steps complete at the same time, but only one of them
+        # should finish the task.
+        self._finish(no_op_states=self.FINISHED_STATES)
+
+
+def _demonstrate_progress(task):
+    task.start()
+
+    time.sleep(5)
+    task.set_steps_to_complete(100)
+
+    def raise_an_exception():
+        raise Exception("Some exception")
+
+    for ii in range(100):
+        time.sleep(0.2)
+
+        if ii % 52 == 0:
+            try:
+                raise_an_exception()
+            except Exception as exc:
+                task.steps_failed(1, str(ii), error=exc)
         else:
-            self.save()
+            task.add_successful_steps(1)
+        if ii % 10 == 0:
+            log.info("Completed %d items", ii)
+
+
+class BackgroundTaskError(models.Model):
+    """A distinct error that occurred while processing a BackgroundTask, with a count of how many
+    times it occurred.
+
+    Errors are grouped by fingerprint (see BackgroundTask._error_record()) so that a task failing
+    the same way for many items stores the traceback once rather than once per item. They are kept
+    in their own table rather than on the task so that reading the task doesn't mean reading all
+    of its errors.
+    """
+
+    # How many steps_identifiers to keep as a sample of the steps an error occurred for
+    MAX_STEPS_IDENTIFIERS = 10
+    # The fields used by to_dict()
+    DICT_FIELDS = (
+        "fingerprint",
+        "first_seen",
+        "last_seen",
+        "num_occurrences",
+        "num_failed_steps",
+        "steps_identifiers",
+        "error_type",
+        "error_message",
+        "traceback",
+    )
+
+    task = models.ForeignKey(BackgroundTask, on_delete=models.CASCADE, related_name="error_records")
+    fingerprint = models.CharField(max_length=40)
+    error_type = models.CharField(max_length=1000, blank=True, default="")
+    error_message = models.TextField(
+        blank=True, default="", help_text="The message of the first occurrence of this error"
+    )
+    traceback = models.TextField(blank=True, default="")
+    num_occurrences = models.PositiveIntegerField(default=1)
+    num_failed_steps = models.PositiveIntegerField(default=0)
+    steps_identifiers = models.JSONField(
+        default=list, blank=True, help_text="A sample of the steps this error occurred for"
+    )
+    first_seen = models.DateTimeField(default=timezone.now)
+    last_seen = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ["first_seen", "id"]
+        indexes = [models.Index(fields=["task", "first_seen"], name="bgtask_error_task_dt_idx")]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["task", "fingerprint"], name="bgtask_error_unique_fingerprint"
+            )
+        ]
+
+    @classmethod
+    def record(cls, error_records):
+        """Store unsaved error records, adding them to the counts of any already stored for the
+        same task with the same fingerprint. Must be called in a transaction.
+        """
+        merged_records = {}
+        for error_record in error_records:
+            key = (error_record.task_id, error_record.fingerprint)
+            if key in merged_records:
+                merged_records[key].merge(error_record)
+            else:
+                merged_records[key] = error_record
+
+        for error_record in merged_records.values():
+            cls._record_occurrences(error_record)
+
+    def __str__(self):
+        return "%s %s %s" % (type(self).__name__, self.task_id, self.error_message)
+
+    def merge(self, other):
+        """Add the occurrences of another, unsaved, error record to this one."""
+        self.num_occurrences += other.num_occurrences
+        self.num_failed_steps += other.num_failed_steps
+        self.steps_identifiers = (self.steps_identifiers + other.steps_identifiers)[
+            : self.MAX_STEPS_IDENTIFIERS
+        ]
+        self.first_seen = min(self.first_seen, other.first_seen)
+        self.last_seen = max(self.last_seen, other.last_seen)
+
+    def to_dict(self):
+        return self.values_to_dict({field: getattr(self, field) for field in self.DICT_FIELDS})
+
+    @staticmethod
+    def values_to_dict(values):
+        """Like to_dict(), but from the DICT_FIELDS of a row fetched with values()."""
+        return {
+            "fingerprint": values["fingerprint"],
+            # For compatibility with errors recorded before they were grouped
+            "datetime": values["first_seen"].isoformat(),
+            "first_seen": values["first_seen"].isoformat(),
+            "last_seen": values["last_seen"].isoformat(),
+            "num_occurrences": values["num_occurrences"],
+            "num_failed_steps": values["num_failed_steps"],
+            "steps_identifiers": values["steps_identifiers"],
+            "error_type": values["error_type"],
+            "error_message": values["error_message"],
+            "traceback": values["traceback"],
+        }
+
+    @classmethod
+    def _record_occurrences(cls, error_record):
+        existing_records = (
+            cls.objects.select_for_update()
+            .filter(task_id=error_record.task_id, fingerprint=error_record.fingerprint)
+            .only("id", "steps_identifiers")
+        )
+        existing_record = existing_records.first()
+        if existing_record is None:
+            try:
+                with transaction.atomic():
+                    error_record.save(force_insert=True)
+                return
+            except IntegrityError:
+                # Another worker recorded the first occurrence at the same time
+                existing_record = existing_records.get()
+
+        updates = {
+            "num_occurrences": F("num_occurrences") + error_record.num_occurrences,
+            "num_failed_steps": F("num_failed_steps") + error_record.num_failed_steps,
+            "last_seen": Greatest(F("last_seen"), Value(error_record.last_seen)),
+        }
+        sample_space = cls.MAX_STEPS_IDENTIFIERS - len(existing_record.steps_identifiers)
+        if sample_space > 0 and error_record.steps_identifiers:
+            updates["steps_identifiers"] = (
+                existing_record.steps_identifiers + error_record.steps_identifiers[:sample_space]
+            )
+        cls.objects.filter(id=existing_record.id).update(**updates)
+
+
+class BackgroundTaskProfile(models.Model):
+    """The cProfile stats of a run of a task, for tasks with should_profile set.
+
+    The stats are stored compressed, in the format written by pstats.Stats.dump_stats().
+    """
+
+    task = models.OneToOneField(
+        BackgroundTask, on_delete=models.CASCADE, related_name="profile_stats"
+    )
+    created = models.DateTimeField(auto_now_add=True)
+    duration = models.DurationField(help_text="The wall clock time that was profiled")
+    compressed_stats = models.BinaryField()
+
+    def __str__(self):
+        return "%s %s" % (type(self).__name__, self.task_id)
+
+    @classmethod
+    def save_stats(cls, task, profiler, duration):
+        profiler.create_stats()
+        compressed_stats = zlib.compress(marshal.dumps(profiler.stats))
+        cls.objects.update_or_create(
+            task=task, defaults={"duration": duration, "compressed_stats": compressed_stats}
+        )
+
+    @property
+    def pstats_data(self):
+        """The stats as the contents of a .pstats file, which pstats.Stats() can load."""
+        return zlib.decompress(self.compressed_stats)
+
+    def top_functions(self, num_functions=20):
+        """The num_functions functions with the most cumulative time, as dicts."""
+        stats = marshal.loads(self.pstats_data)
+        functions = [
+            {
+                "function": pstats.func_std_string(func),
+                "num_calls": num_calls,
+                "total_time": total_time,
+                "cumulative_time": cumulative_time,
+            }
+            for func, (_, num_calls, total_time, cumulative_time, _) in stats.items()
+        ]
+        functions.sort(key=lambda function: function["cumulative_time"], reverse=True)
+        return functions[:num_functions]
+
+
+class BackgroundTaskJob(models.Model):
+    """A call waiting to be run, or being run, by a worker of the db_queue backend.
+
+    See bgtask.backends.db_queue.
+    """
+
+    task = models.ForeignKey(
+        BackgroundTask, on_delete=models.CASCADE, related_name="jobs", null=True, blank=True
+    )
+    func = models.JSONField(help_text="The import path of the callable to call")
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    claimed_by = models.CharField(max_length=1000, blank=True, default="")
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [
+            models.Index(
+                fields=["id"],
+                name="bgtask_job_unclaimed_idx",
+                condition=Q(claimed_at__isnull=True),
+            )
+        ]
+
+    def __str__(self):
+        return "%s %s %s" % (type(self).__name__, self.id, self.func)
+
+
+class BackgroundTaskDailyStats(models.Model):
+    """A summary of the tasks with a namespace and name that finished on a day, written by
+    `manage.py bgtask_prune --rollup` before it deletes them.
+    """
+
+    namespace = models.CharField(max_length=1000, default="", blank=True)
+    name = models.CharField(max_length=1000)
+    date = models.DateField(help_text="The day the tasks completed")
+    num_tasks = models.PositiveIntegerField(default=0)
+    num_succeeded = models.PositiveIntegerField(default=0)
+    num_partially_succeeded = models.PositiveIntegerField(default=0)
+    num_failed = models.PositiveIntegerField(default=0)
+    total_duration = models.DurationField(
+        default=timedelta, help_text="The total time from starting to completing"
+    )
+    num_timed = models.PositiveIntegerField(
+        default=0, help_text="The number of tasks included in total_duration"
+    )
+
+    class Meta:
+        ordering = ["-date", "namespace", "name"]
+        verbose_name_plural = "background task daily stats"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["namespace", "name", "date"], name="bgtask_daily_stats_unique_nsn_date"
+            )
+        ]
+
+    def __str__(self):
+        return "%s %s.%s %s" % (type(self).__name__, self.namespace, self.name, self.date)
+
+    @property
+    def success_rate(self):
+        return None if not self.num_tasks else self.num_succeeded / self.num_tasks
+
+    @property
+    def mean_duration(self):
+        return None if not self.num_timed else self.total_duration / self.num_timed
+
+    @classmethod
+    def add(cls, tasks):
+        """Add the finished tasks in a queryset to the stats. Must be called in a transaction."""
+        STATES = BackgroundTask.STATES
+        groups = (
+            tasks.order_by()
+            .values("namespace", "name", date=TruncDate("completed_at"))
+            .annotate(
+                num_tasks=Count("id"),
+                num_succeeded=Count("id", filter=Q(state=STATES.success)),
+                num_partially_succeeded=Count("id", filter=Q(state=STATES.partial_success)),
+                num_failed=Count("id", filter=Q(state=STATES.failed)),
+                total_duration=Sum(
+                    F("completed_at") - F("started_at"), output_field=models.DurationField()
+                ),
+                num_timed=Count("started_at"),
+            )
+        )
+        for group in groups:
+            counts = {
+                field: group[field]
+                for field in [
+                    "num_tasks",
+                    "num_succeeded",
+                    "num_partially_succeeded",
+                    "num_failed",
+                    "num_timed",
+                ]
+            }
+            counts["total_duration"] = group["total_duration"] or timedelta()
+            stats, created = cls.objects.select_for_update().get_or_create(
+                namespace=group["namespace"],
+                name=group["name"],
+                date=group["date"],
+                defaults=counts,
+            )
+            if not created:
+                cls.objects.filter(id=stats.id).update(
+                    **{field: F(field) + value for field, value in counts.items()}
+                )
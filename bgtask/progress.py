@@ -0,0 +1,45 @@
+import threading
+import time
+
+
+class ProgressBuffer:
+    """Collects step updates for a task in memory so that they can be written in one go.
+
+    Created by BackgroundTask.progress_buffer(), which is what you should use rather than
+    instantiating this directly.
+    """
+
+    def __init__(self, flush_every_n=None, flush_every_s=None):
+        self.flush_every_n = flush_every_n
+        self.flush_every_s = flush_every_s
+        # Steps may be reported from several threads working on the same task
+        self._lock = threading.Lock()
+        self._reset()
+
+    def add(self, num_steps, error_record=None):
+        """Record some steps, returning True if the buffer is now due to be flushed."""
+        with self._lock:
+            self._num_steps += num_steps
+            if error_record is not None:
+                self._error_records.append(error_record)
+
+            if self.flush_every_n is not None and self._num_steps >= self.flush_every_n:
+                return True
+            if (
+                self.flush_every_s is not None
+                and time.monotonic() - self._last_drained >= self.flush_every_s
+            ):
+                return True
+            return False
+
+    def drain(self):
+        """Empty the buffer, returning the (num_steps, error_records) that were in it."""
+        with self._lock:
+            drained = self._num_steps, self._error_records
+            self._reset()
+            return drained
+
+    def _reset(self):
+        self._num_steps = 0
+        self._error_records = []
+        self._last_drained = time.monotonic()
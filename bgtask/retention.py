@@ -0,0 +1,105 @@
+"""Deleting old finished tasks, optionally archiving them and summarising them in
+BackgroundTaskDailyStats first. See `manage.py bgtask_prune`.
+
+How long to keep finished tasks for is set with the BGTASK_RETENTION_DAYS setting, a dict of days
+keyed by `(namespace, name)` for tasks with that namespace and name, `(namespace, None)` for the
+other tasks in a namespace, and `None` for all other tasks. A value of None keeps the tasks it
+applies to forever, as are tasks that no key applies to.
+"""
+
+import json
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import BackgroundTask, BackgroundTaskDailyStats
+from .utils import q_or
+
+
+log = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+
+def retention_policies():
+    return getattr(settings, "BGTASK_RETENTION_DAYS", {})
+
+
+def expired_tasks(policies=None, now=None):
+    """The finished tasks that have been kept for longer than the policies say to keep them."""
+    policies = retention_policies() if policies is None else policies
+    now = timezone.now() if now is None else now
+
+    def completed_before(days):
+        return Q(completed_at__lt=now - timedelta(days=days))
+
+    by_name = {}
+    by_namespace = {}
+    for key, days in policies.items():
+        if key is None:
+            continue
+        namespace, name = key
+        if name is None:
+            by_namespace[namespace] = days
+        else:
+            by_name[key] = days
+    has_name_policy = q_or(Q(namespace=namespace, name=name) for namespace, name in by_name)
+
+    q_objects = [
+        Q(namespace=namespace, name=name) & completed_before(days)
+        for (namespace, name), days in by_name.items()
+        if days is not None
+    ]
+    q_objects += [
+        Q(namespace=namespace) & ~has_name_policy & completed_before(days)
+        for namespace, days in by_namespace.items()
+        if days is not None
+    ]
+    if policies.get(None) is not None:
+        q_objects.append(
+            ~Q(namespace__in=by_namespace) & ~has_name_policy & completed_before(policies[None])
+        )
+
+    return BackgroundTask.objects.filter(
+        Q(state__in=BackgroundTask.FINISHED_STATES) & q_or(q_objects)
+    )
+
+
+def prune(tasks, batch_size=BATCH_SIZE, archive=None, rollup=False, dry_run=False):
+    """Delete tasks in batches of batch_size in primary key order, yielding the number deleted in
+    each batch.
+
+    Each batch is deleted in its own short transaction, along with adding it to the daily stats
+    if rollup, so that pruning can be stopped and run again at any point without counting any
+    task twice. If archive is a text file, each task is written to it as a line of JSON before
+    it is deleted. If dry_run, nothing is written or deleted.
+    """
+    tasks = tasks.order_by("pk")
+    last_pk = None
+    while True:
+        batch_tasks = tasks if last_pk is None else tasks.filter(pk__gt=last_pk)
+        pks = list(batch_tasks.values_list("pk", flat=True)[:batch_size])
+        if not pks:
+            return
+        last_pk = pks[-1]
+
+        if dry_run:
+            yield len(pks)
+            continue
+
+        with transaction.atomic():
+            batch_tasks = tasks.filter(pk__in=pks)
+            if archive is not None:
+                for task in batch_tasks.prefetch_related("error_records"):
+                    archive.write(json.dumps(task.task_dict, cls=DjangoJSONEncoder) + "\n")
+            if rollup:
+                BackgroundTaskDailyStats.add(batch_tasks)
+            num_deleted = batch_tasks.delete()[1].get(BackgroundTask._meta.label, 0)
+
+        log.debug("Pruned %s tasks up to %s", num_deleted, last_pk)
+        yield num_deleted
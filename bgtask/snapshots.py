@@ -0,0 +1,107 @@
+"""Lightweight stand-ins for the request and queryset of an admin action, which bgtask_admin_action
+passes to the action's function instead of the live objects.
+
+They hold only primary keys and ids, so a long-running action doesn't keep the request alive or
+fill a queryset's result cache, and they can be serialised for backends that run the action in
+another process (see bgtask.backends.calls).
+"""
+
+import logging
+
+from django.contrib.auth import get_user_model
+from django.contrib.messages import DEFAULT_LEVELS
+from django.utils.functional import cached_property
+
+from .utils import chunked
+
+
+log = logging.getLogger(__name__)
+
+# How many objects are fetched at once when iterating over a StreamedQueryset
+CHUNK_SIZE = 2000
+
+_LEVEL_NAMES = {level: name for name, level in DEFAULT_LEVELS.items()}
+
+
+class StreamedQueryset:
+    """The objects of a model with some primary keys, which are fetched chunk_size at a time
+    when iterated over rather than all at once, and aren't kept once they've been iterated over.
+
+    Other queryset methods, e.g. update(), are those of a queryset filtered by the primary keys.
+    """
+
+    def __init__(self, model, pks, chunk_size=CHUNK_SIZE):
+        self.model = model
+        self.pks = pks
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def from_queryset(cls, queryset, chunk_size=CHUNK_SIZE):
+        return cls(queryset.model, list(queryset.values_list("pk", flat=True)), chunk_size)
+
+    @property
+    def queryset(self):
+        return self.model._default_manager.filter(pk__in=self.pks)
+
+    def __iter__(self):
+        manager = self.model._default_manager
+        for chunk_pks in chunked(self.pks, self.chunk_size):
+            yield from manager.filter(pk__in=chunk_pks).order_by("pk").iterator(self.chunk_size)
+
+    def __len__(self):
+        return len(self.pks)
+
+    def __bool__(self):
+        return bool(self.pks)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.queryset, name)
+
+    def __repr__(self):
+        return "<%s %s (%d objects)>" % (type(self).__name__, self.model._meta.label, len(self))
+
+
+class RequestSnapshot:
+    """What a background action needs of the request that started it: who made it, to where,
+    and somewhere to send messages.
+
+    Messages added with django.contrib.messages, e.g. messages.info(request, ...), are logged and
+    kept in messages, as the user has had their response by the time the action runs.
+    """
+
+    def __init__(self, user_id=None, method="", path=""):
+        self.user_id = user_id
+        self.method = method
+        self.path = path
+        self._messages = _MessageSink()
+
+    @classmethod
+    def from_request(cls, request):
+        user = getattr(request, "user", None)
+        user_id = user.pk if user is not None and user.is_authenticated else None
+        return cls(user_id=user_id, method=request.method, path=request.path)
+
+    @cached_property
+    def user(self):
+        if self.user_id is None:
+            return None
+        return get_user_model()._default_manager.get(pk=self.user_id)
+
+    @property
+    def messages(self):
+        return self._messages.messages
+
+    def __repr__(self):
+        return "<%s %s %s user %s>" % (type(self).__name__, self.method, self.path, self.user_id)
+
+
+class _MessageSink:
+    # Enough of django.contrib.messages' storage API for messages.add_message()
+    def __init__(self):
+        self.messages = []
+
+    def add(self, level, message, extra_tags=""):
+        log.info("Message (%s): %s", _LEVEL_NAMES.get(level, level), message)
+        self.messages.append((level, str(message)))
@@ -154,10 +154,11 @@ class TaskProgressDiv {
     this.div = div;
     this.stateEle = this.div.getElementsByClassName("bgtask-state")[0];
 
+    const steps = TaskProgressDiv.stepsOf(task);
     this.pgstate = new ProgressState(
       // need to initialize values here and not rely on updateFromTask to get instant progress
       // bar values
-      this.div, {value: task.steps_completed, max: task.steps_to_complete}
+      this.div, {value: steps.steps_completed, max: steps.steps_to_complete}
     );
 
     this.updateFromTask(task);
@@ -167,6 +168,11 @@ class TaskProgressDiv {
     poller.monitorTask(this.taskId, task => this.updateFromTask(task));
   }
 
+  static stepsOf(task) {
+    // The progress of a task with children is theirs combined, if the poller asked for it
+    return task.children || task;
+  }
+
   updateFromTask(task) {
     this.div.title = "";
 
@@ -180,7 +186,8 @@ class TaskProgressDiv {
         this._hideProgress();
         this._showState();
         let title = "Task failed";
-        for (const error of task.errors) {
+        // Errors are only sent if some widget asked the poller for them
+        for (const error of (task.errors || [])) {
           if (error.traceback) {
             title = `${title}\n${error.traceback}\n\n${error.error_message}`;
             break;
@@ -219,7 +226,10 @@ class TaskProgressDiv {
 
     this._setStateEmoji(task);
 
-    this.pgstate.update({ max: task.steps_to_complete, value: task.steps_completed, isOutOfDate });
+    const steps = TaskProgressDiv.stepsOf(task);
+    this.pgstate.update({
+      max: steps.steps_to_complete, value: steps.steps_completed, isOutOfDate,
+    });
   }
 
   _setStateEmoji(task) {
@@ -283,7 +293,8 @@ class BGTaskDetailViewDiv {
     this.progressDiv = new TaskProgressDiv(
       div.getElementsByClassName("bgtask-status-div")[0], task, poller
     );
-    this.errorRows = [];
+    // Error rows by error fingerprint
+    this.errorRows = {};
 
     div.setAttribute('id', task.id);
 
@@ -309,13 +320,20 @@ class BGTaskDetailViewDiv {
   }
 
   attachToPoller(poller) {
+    poller.includeInUpdates("errors");
+    poller.includeInUpdates("children");
     poller.monitorTask(this.taskId, task => this.updateFromTask(task));
   }
 
   updateFromTask(task) {
     // console.log(`BGTaskDetailViewDiv.updateFromTask`, task);
     setText(this.div, "bgtask-name", `${task.name}`);
-    setText(this.div, "bgtask-text-status", `State: ${task.state}, started at ${task.started_at}`);
+    let textStatus = `State: ${task.state}, started at ${task.started_at}`;
+    const children = task.children;
+    if (children) {
+      textStatus += `, ${children.num_finished} of ${children.num_children} subtasks finished`;
+    }
+    setText(this.div, "bgtask-text-status", textStatus);
 
     switch (task.state) {
       case "partial_success":
@@ -332,21 +350,30 @@ class BGTaskDetailViewDiv {
   }
 
   _updateErrorRowsFromTask(task) {
-    // Just add new errors, assuming that the order of the errors stays consistent and errors are
-    // only added to the end.
+    // Errors are grouped, so a group that we already have a row for may have more occurrences
+    // since the last update.
     const errorsTable = this.div.getElementsByClassName("bgtask-errors-table")[0];
-    for (const newError of task.errors.slice(this.errorRows.length)) {
-      const newRow = cloneTemplateInto("bgtask-error-row", errorsTable);
-      const errorDateTime = new Date(newError.datetime);
-
-      this.errorRows.push(newRow);
-      setText(newRow, 'bgtask-error-row-group', newError.steps_identifier);
-      setText(newRow, 'bgtask-error-row-num', newError.num_failed_steps);
-      setText(newRow, 'bgtask-error-row-error', newError.error_message);
-      // only want the HH:MM:SS bit of the time string
-      setText(newRow, 'bgtask-error-row-time', errorDateTime.toTimeString().slice(0, 8));
+    for (const error of (task.errors || [])) {
+      let row = this.errorRows[error.fingerprint];
+      if (row === undefined) {
+        row = cloneTemplateInto("bgtask-error-row", errorsTable);
+        this.errorRows[error.fingerprint] = row;
+        setText(row, 'bgtask-error-row-error', error.error_message);
+        setText(
+          row, 'bgtask-error-row-traceback', BGTaskDetailViewDiv.fixTraceback(error.traceback)
+        );
+      }
+
+      // only want the HH:MM:SS bit of the time strings
+      const firstSeen = new Date(error.first_seen).toTimeString().slice(0, 8);
+      const lastSeen = new Date(error.last_seen).toTimeString().slice(0, 8);
+      setText(row, 'bgtask-error-row-occurrences', error.num_occurrences);
+      setText(row, 'bgtask-error-row-num', error.num_failed_steps);
+      setText(row, 'bgtask-error-row-group', error.steps_identifiers.join(", "));
       setText(
-        newRow, 'bgtask-error-row-traceback', BGTaskDetailViewDiv.fixTraceback(newError.traceback)
+        row,
+        'bgtask-error-row-time',
+        error.num_occurrences > 1 ? `${firstSeen} – ${lastSeen}` : firstSeen,
       );
     }
   }
@@ -361,6 +388,16 @@ class BGTaskPoller {
     this.taskCallbacks = {};
     this.intvl = null;
     this.mostRecentUpdate = null;
+    // The updated value of the most recently updated task as the server sent it, so that polls
+    // only return tasks updated after it.
+    this.sinceCursor = null;
+    // Fields that are only sent if asked for, e.g. "errors"
+    this.include = new Set();
+    // Server-sent events are used in preference to polling if enableStreaming() is called,
+    // unless the stream fails before sending anything, e.g. because the server doesn't support
+    // streaming responses.
+    this.eventSource = null;
+    this.canStream = false;
   }
 
   static instances = {};
@@ -384,18 +421,59 @@ class BGTaskPoller {
     return BGTaskPoller.instances[baseURL];
   }
 
+  enableStreaming() {
+    this.canStream = window.EventSource !== undefined;
+  }
+
   get numCallbacks() {
     return Object.values(this.taskCallbacks).map(cbks => cbks.length).reduce((a, b) => a + b, 0);
   }
 
+  get monitoredTaskIds() {
+    return Object.keys(this.taskCallbacks).filter(taskId => this.taskCallbacks[taskId].length);
+  }
+
+  includeInUpdates(field) {
+    if (this.include.has(field)) {
+      return;
+    }
+    this.include.add(field);
+    this.sinceCursor = null;
+    if (this.eventSource !== null) {
+      this._closeStream();
+      this._openStream();
+    }
+  }
+
+  get queryString() {
+    let queryString = `tasks=${this.monitoredTaskIds.join(",")}`;
+    if (this.include.size) {
+      queryString = `${queryString}&include=${[...this.include].join(",")}`;
+    }
+    return queryString;
+  }
+
   monitorTask(taskId, cbk) {
     let cbkList = this.taskCallbacks[taskId];
     if (cbkList === undefined) {
       cbkList = [];
       this.taskCallbacks[taskId] = cbkList;
     }
+    const isNewTask = cbkList.length === 0;
     cbkList.push(cbk);
 
+    if (isNewTask) {
+      // The new task may not have been updated since the cursor, so get everything next time
+      this.sinceCursor = null;
+    }
+
+    if (isNewTask && this.eventSource !== null) {
+      // The stream is for a fixed set of tasks so restart it to include this one
+      this._closeStream();
+      this._openStream();
+      return;
+    }
+
     this._maybeScheduleNextPoll();
   }
 
@@ -417,7 +495,7 @@ class BGTaskPoller {
   }
 
   _maybeScheduleNextPoll() {
-    if (this.intvl !== null || this.numCallbacks === 0) {
+    if (this.intvl !== null || this.eventSource !== null || this.numCallbacks === 0) {
       // Not scheduling another poll because either one is in progress or no one is listening.
       return;
     }
@@ -430,12 +508,19 @@ class BGTaskPoller {
   }
   _sendPoll() {
     this.intvl = null;
+    if (this.canStream) {
+      this._openStream();
+      return;
+    }
+
     const req = new XMLHttpRequest();
     const self = this;
     req.addEventListener("load", function () { self._receivePoll(this); });
-    const taskIds = Object.keys(this.taskCallbacks).join(",");
-    const url = `${this.baseURL}?tasks=${taskIds}`;
-    console.log(`Poll for tasks ${taskIds}`);
+    let url = `${this.baseURL}?${this.queryString}`;
+    if (this.sinceCursor !== null) {
+      url = `${url}&since=${encodeURIComponent(this.sinceCursor)}`;
+    }
+    console.log(`Poll for tasks ${this.monitoredTaskIds}`);
     req.open("GET", url);
     req.setRequestHeader('Accept', 'application/json');
     req.send();
@@ -450,11 +535,17 @@ class BGTaskPoller {
       return;
     }
 
+    this._receiveTasks(tasks);
+    this._maybeScheduleNextPoll();
+  }
+  _receiveTasks(tasks) {
     for (const [taskId, task] of Object.entries(tasks)) {
+      const updatedString = task.updated;
       BGTaskPoller.normalizeTask(task);
 
       if (this.mostRecentUpdate === null || task.updated > this.mostRecentUpdate) {
         this.mostRecentUpdate = task.updated;
+        this.sinceCursor = updatedString;
       }
 
       for (const cbk of (this.taskCallbacks[task.id] || [])) {
@@ -464,12 +555,46 @@ class BGTaskPoller {
         this.stopMonitoringTask(task.id);
       }
     }
-
-    this._maybeScheduleNextPoll();
+  }
+  _openStream() {
+    if (!this.monitoredTaskIds.length) {
+      return;
+    }
+    console.log(`Stream tasks ${this.monitoredTaskIds}`);
+    const eventSource = new EventSource(`${this.baseURL}/stream?${this.queryString}`);
+    let receivedEvent = false;
+
+    eventSource.addEventListener("message", (event) => {
+      receivedEvent = true;
+      this._receiveTasks(JSON.parse(event.data));
+    });
+    eventSource.addEventListener("end", () => {
+      // All the tasks have finished
+      this._closeStream();
+      this._maybeScheduleNextPoll();
+    });
+    eventSource.addEventListener("error", () => {
+      // Either the server ended the stream, in which case we'll reconnect on the next poll, or
+      // streaming doesn't work here.
+      if (!receivedEvent) {
+        console.info("Could not stream tasks, falling back to polling");
+        this.canStream = false;
+      }
+      this._closeStream();
+      this._maybeScheduleNextPoll();
+    });
+    this.eventSource = eventSource;
+  }
+  _closeStream() {
+    if (this.eventSource !== null) {
+      this.eventSource.close();
+      this.eventSource = null;
+    }
   }
   stopPolling() {
     clearInterval(this.intvl);
     this.intvl = null;
+    this._closeStream();
   }
 }
 
@@ -494,3 +619,42 @@ function cloneTemplateInto(templateId, contentIdOrEle) {
   contentMain.appendChild(clonedNode);
   return clonedNode;
 }
+
+// -------------------------------------------------------------------------------------------------
+// Bring to life the widgets on pages using the bgtask_script template tag, which puts the tasks
+// for all of them in one JSON island. Widgets are elements with a data-bgtask-id attribute, and
+// show a single field of the task if they have data-bgtask-field, otherwise its progress.
+// -------------------------------------------------------------------------------------------------
+function hydrateBGTaskWidgets() {
+  const bootstrapElement = document.getElementById("bgtask-bootstrap");
+  if (bootstrapElement === null) {
+    return;
+  }
+  const { tasksURL, stream, tasks } = JSON.parse(bootstrapElement.textContent);
+  const poller = BGTaskPoller.sharedInstance(tasksURL);
+  if (stream) {
+    poller.enableStreaming();
+  }
+  for (const task of Object.values(tasks)) {
+    BGTaskPoller.normalizeTask(task);
+  }
+
+  for (const element of document.querySelectorAll("[data-bgtask-id]")) {
+    const task = tasks[element.dataset.bgtaskId];
+    if (task === undefined) {
+      continue;
+    }
+    const widget = (
+      element.dataset.bgtaskField === undefined
+      ? new TaskProgressDiv(element, task)
+      : new TaskFieldElement(element, element.dataset.bgtaskField, task)
+    );
+    widget.attachToPoller(poller);
+  }
+}
+
+if (document.readyState === "loading") {
+  document.addEventListener("DOMContentLoaded", hydrateBGTaskWidgets);
+} else {
+  hydrateBGTaskWidgets();
+}
@@ -0,0 +1,90 @@
+"""An optional write-through cache of task statuses (see BackgroundTaskQuerySet.status_dicts()),
+so that polling for progress doesn't have to read the database.
+
+Enable it by naming one of the CACHES in the BGTASK_STATUS_CACHE setting. Statuses are written
+whenever a task is updated, while the task's row is still locked by the update, and carry the
+task's version so that a status can never be replaced by an older one. Updates made in a
+transaction of the caller's have their statuses written once it commits instead, as until then it
+may be rolled back, and the version reused by the next update.
+"""
+
+from contextlib import nullcontext
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+
+KEY_PREFIX = "bgtask:status:"
+TIMEOUT_S = 300
+
+
+def get_cache():
+    """The cache named by BGTASK_STATUS_CACHE, or None if the status cache isn't enabled."""
+    alias = getattr(settings, "BGTASK_STATUS_CACHE", None)
+    return None if alias is None else caches[alias]
+
+
+def writing():
+    """A context for updating a task and then writing its status, in which the task's row stays
+    locked until the status has been written, so statuses are written in the order of updates.
+    """
+    return transaction.atomic() if get_cache() is not None else nullcontext()
+
+
+def write(status):
+    """Store a status unless the cache already has the same or a later version of it, deferring
+    that until the caller's transaction commits if there is one.
+    """
+    cache = get_cache()
+    if cache is None:
+        return
+
+    # The outermost atomic block is the one the update was made in if there is only one
+    if len(transaction.get_connection().atomic_blocks) > 1:
+        transaction.on_commit(partial(_write, cache, status))
+    else:
+        _write(cache, status)
+
+
+def _write(cache, status):
+    key = _key(status["id"])
+    cached_status = cache.get(key)
+    if cached_status is not None and cached_status["version"] >= status["version"]:
+        return
+    cache.set(key, status, _timeout())
+
+
+def delete_many(task_ids):
+    """Remove the statuses of tasks updated without writing them, once the caller's transaction
+    commits if there is one, so that they're read from the database again.
+    """
+    cache = get_cache()
+    if cache is None:
+        return
+
+    transaction.on_commit(partial(cache.delete_many, [_key(task_id) for task_id in task_ids]))
+
+
+def fill(statuses):
+    """Store statuses read from the database for tasks that weren't in the cache, without
+    replacing any that have been written since.
+    """
+    cache = get_cache()
+    for status in statuses:
+        cache.add(_key(status["id"]), status, _timeout())
+
+
+def get_many(task_ids):
+    """The cached statuses of those of task_ids that are in the cache, by task id."""
+    cached_statuses = get_cache().get_many([_key(task_id) for task_id in task_ids])
+    return {status["id"]: status for status in cached_statuses.values()}
+
+
+def _key(task_id):
+    return f"{KEY_PREFIX}{task_id}"
+
+
+def _timeout():
+    return getattr(settings, "BGTASK_STATUS_CACHE_TIMEOUT_S", TIMEOUT_S)
@@ -1,13 +1,57 @@
-from urllib.parse import parse_qsl, unquote, urlparse, urlunparse
-
 from django import template
-from django.contrib.admin.utils import quote
-from django.urls import Resolver404, get_script_prefix, resolve
-from django.utils.http import urlencode
+from django.templatetags.static import static
+from django.urls import reverse
+from django.utils.html import format_html, json_script
+
+from ..models import BackgroundTask
+from ..views import stream_enabled
+
 
 register = template.Library()
 
 
 @register.simple_tag(takes_context=True)
-def bgtask_script(context, popup=False, to_field=None):
-    return "hello bgtask_script world"
+def bgtask_script(context):
+    """Emit the statuses of all the tasks shown on a page as one JSON island, and the script that
+    brings their widgets to life once the page has loaded. Use it once, at the end of the page.
+
+    The tasks are those in admin_bg_tasks, and the latest task for each object in the change
+    list if it shows background_task_status.
+    """
+    task_ids = {task.id for task in _page_tasks(context)}
+    statuses = BackgroundTask.objects.filter(id__in=task_ids).status_dicts() if task_ids else []
+
+    return format_html(
+        '{}<script src="{}" defer></script>',
+        json_script(
+            {
+                "tasksURL": reverse("bgtask:tasks"),
+                "stream": stream_enabled(),
+                "tasks": {status["id"]: status for status in statuses},
+            },
+            "bgtask-bootstrap",
+        ),
+        static("bgtask/js/bgtask.js"),
+    )
+
+
+def _page_tasks(context):
+    from ..admin import background_task_status
+
+    tasks = list(context.get("admin_bg_tasks") or [])
+
+    changelist = context.get("cl")
+    if changelist is None or background_task_status not in changelist.list_display:
+        return tasks
+
+    unfetched_objs = []
+    for obj in changelist.result_list:
+        if isinstance(obj, BackgroundTask):
+            tasks.append(obj)
+        elif hasattr(obj, "_latest_bgtask"):
+            tasks.append(obj._latest_bgtask)
+        else:
+            unfetched_objs.append(obj)
+    tasks += BackgroundTask.objects.latest_for_objects(unfetched_objs).values()
+
+    return [task for task in tasks if task is not None]
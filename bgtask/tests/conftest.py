@@ -0,0 +1,8 @@
+import pytest
+
+from bgtask.models import BackgroundTask
+
+
+@pytest.fixture
+def a_task():
+    return BackgroundTask.objects.create(name="A task")
@@ -0,0 +1,176 @@
+import json
+import re
+
+import pytest
+
+from django.contrib import admin
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from bgtask.backends import db_queue
+from bgtask.model_admin import BGTaskModelAdmin
+from bgtask.models import BackgroundTask, BackgroundTaskJob
+from django_app.models import ModelWithBackgroundActions
+
+
+pytestmark = pytest.mark.django_db
+
+
+def _create_objects_with_tasks(num_objects):
+    tasks = []
+    for ii in range(num_objects):
+        obj = ModelWithBackgroundActions.objects.create(name=f"Object {ii}")
+        for name in ["Older task", "Newer task"]:
+            tasks.append(BackgroundTask.objects.create(name=name, acted_on_object_id=str(obj.id)))
+    return tasks
+
+
+def _changelist_queries(admin_client):
+    with CaptureQueriesContext(connection) as queries:
+        response = admin_client.get(
+            reverse("admin:django_app_modelwithbackgroundactions_changelist")
+        )
+    assert response.status_code == 200
+    return response, len(queries)
+
+
+def test_latest_for_objects():
+    older_task, newer_task = _create_objects_with_tasks(1)
+    obj = ModelWithBackgroundActions.objects.get()
+    other_model_task = BackgroundTask.objects.create(
+        name="Task for another model",
+        acted_on_object_id=str(obj.id),
+        content_type=ContentType.objects.get_for_model(BackgroundTask),
+    )
+
+    assert BackgroundTask.objects.latest_for_objects([obj]) == {str(obj.id): newer_task}
+
+    other_model_task.delete()
+    newer_task.content_type = ContentType.objects.get_for_model(obj)
+    newer_task.save()
+    assert BackgroundTask.objects.latest_for_objects([obj]) == {str(obj.id): newer_task}
+
+
+def test_changelist_status_column_queries_dont_depend_on_rows(admin_client):
+    tasks = _create_objects_with_tasks(2)
+    response, num_queries = _changelist_queries(admin_client)
+    for older_task, newer_task in zip(tasks[::2], tasks[1::2]):
+        assert str(newer_task.id) in response.content.decode()
+        assert str(older_task.id) not in response.content.decode()
+
+    _create_objects_with_tasks(8)
+    assert _changelist_queries(admin_client)[1] == num_queries
+
+
+def _bootstrap(content):
+    island = re.search(
+        r'<script id="bgtask-bootstrap" type="application/json">(.*?)</script>', content
+    )
+    return json.loads(island.group(1))
+
+
+def _bootstrap_tasks(content):
+    return _bootstrap(content)["tasks"]
+
+
+@pytest.mark.parametrize(
+    "changelist",
+    ["django_app_modelwithbackgroundactions_changelist", "bgtask_backgroundtask_changelist"],
+)
+def test_changelist_has_one_bootstrap_script(admin_client, changelist):
+    url = reverse(f"admin:{changelist}")
+    _create_objects_with_tasks(1)
+    num_scripts = admin_client.get(url).content.decode().count("<script")
+    tasks = _create_objects_with_tasks(3)
+
+    content = admin_client.get(url).content.decode()
+
+    assert content.count("<script") == num_scripts
+    assert content.count("bgtask/js/bgtask.js") == 1
+    shown_tasks = tasks[1::2] if changelist.startswith("django_app") else tasks
+    assert {str(task.id) for task in shown_tasks} <= set(_bootstrap_tasks(content))
+    for task in shown_tasks:
+        assert f'data-bgtask-id="{task.id}"' in content
+
+
+def test_changelist_adds_missing_bootstrap_script(admin_client, monkeypatch):
+    model_admin = admin.site._registry[ModelWithBackgroundActions]
+    monkeypatch.setattr(model_admin, "change_list_template", "admin/change_list.html")
+    tasks = _create_objects_with_tasks(2)
+
+    content = admin_client.get(
+        reverse("admin:django_app_modelwithbackgroundactions_changelist")
+    ).content.decode()
+
+    assert content.count("bgtask/js/bgtask.js") == 1
+    assert set(_bootstrap_tasks(content)) == {str(task.id) for task in tasks[1::2]}
+
+
+def test_changelist_streams_only_if_enabled(admin_client, settings):
+    url = reverse("admin:django_app_modelwithbackgroundactions_changelist")
+    _create_objects_with_tasks(1)
+
+    assert _bootstrap(admin_client.get(url).content.decode())["stream"] is False
+
+    settings.BGTASK_STREAM = True
+    assert _bootstrap(admin_client.get(url).content.decode())["stream"] is True
+
+
+def test_bulk_queue(django_assert_num_queries):
+    objs = [ModelWithBackgroundActions.objects.create(name=f"Object {ii}") for ii in range(5)]
+    content_type = ContentType.objects.get_for_model(ModelWithBackgroundActions)
+
+    with django_assert_num_queries(5):
+        tasks = BackgroundTask.objects.bulk_queue("A task", objs, namespace="ns", batch_size=2)
+
+    assert [task.acted_on_object_id for task in tasks] == [str(obj.pk) for obj in objs]
+    queued_tasks = BackgroundTask.objects.filter(namespace="ns", name="A task")
+    assert {(task.state, task.content_type) for task in queued_tasks} == {
+        (BackgroundTask.STATES.queued, content_type)
+    }
+    positions = dict(queued_tasks.with_position_in_queue().values_list("id", "position_in_queue"))
+    assert [positions[task.id] for task in tasks] == list(range(5))
+
+
+def test_queue_bgtasks_dispatches_in_one_call(settings, django_assert_num_queries):
+    settings.BGTASK_BACKEND = "bgtask.backends.db_queue"
+    objs = [ModelWithBackgroundActions.objects.create(name=f"Object {ii}") for ii in range(5)]
+    model_admin = BGTaskModelAdmin(ModelWithBackgroundActions, None)
+    ContentType.objects.get_for_model(ModelWithBackgroundActions)
+
+    # Fetching the objects, then creating the tasks and the jobs with a query each in a savepoint
+    with django_assert_num_queries(7):
+        tasks = model_admin.queue_bgtasks(
+            "Queued task", ModelWithBackgroundActions.objects.all(), _succeed_task
+        )
+
+    assert [job.task for job in BackgroundTaskJob.objects.order_by("id")] == tasks
+    db_queue.run_worker(once=True)
+    assert set(BackgroundTask.objects.values_list("namespace", "state")) == {
+        (model_admin._bgtask_namespace, BackgroundTask.STATES.success)
+    }
+    assert {task.result for task in BackgroundTask.objects.all()} == {obj.name for obj in objs}
+
+
+def test_queue_bgtasks_dispatches_admin_methods(admin_client, settings, mocker):
+    settings.BGTASK_BACKEND = "bgtask.backends.db_queue"
+    mocker.patch("django_app.admin.time.sleep")
+    objs = [ModelWithBackgroundActions.objects.create(name=f"Object {ii}") for ii in range(2)]
+
+    admin_client.post(
+        reverse("admin:django_app_modelwithbackgroundactions_changelist"),
+        {"action": "queueing_action", "_selected_action": [obj.pk for obj in objs]},
+    )
+    assert BackgroundTaskJob.objects.count() == 2
+    db_queue.run_worker(once=True)
+
+    assert set(BackgroundTask.objects.values_list("name", "state")) == {
+        ("Queued task", BackgroundTask.STATES.success)
+    }
+
+
+def _succeed_task(obj, task):
+    task.start()
+    task.succeed(obj.name)
@@ -1,17 +1,13 @@
 import pytest
 
+from django.db import IntegrityError
 from django.utils import timezone
 
-from bgtask.models import BackgroundTask
+from bgtask.models import BackgroundTask, BackgroundTaskError
 
 pytestmark = pytest.mark.django_db
 
 
-@pytest.fixture
-def a_task():
-    return BackgroundTask.objects.create(name="A task")
-
-
 def test_bgtask_immediate_failure(a_task):
     assert a_task.state == BackgroundTask.STATES.not_started
 
@@ -39,6 +35,27 @@ def test_bgtask_immediate_failure(a_task):
     assert "test_bgtask_immediate_failure" in a_task.errors[0]["traceback"]
 
 
+def test_fail_leaves_step_counts(a_task):
+    a_task.start()
+
+    a_task.fail(ValueError("Oops"))
+
+    task = _db_task(a_task)
+    assert task.state == BackgroundTask.STATES.failed
+    assert (task.steps_completed, task.num_failed_steps) == (None, 0)
+    assert [error["error_message"] for error in task.errors] == ["Oops"]
+
+
+def test_fail_records_error_with_transition(a_task, mocker):
+    a_task.start()
+    mocker.patch.object(BackgroundTaskError, "record", side_effect=IntegrityError("Oops"))
+
+    with pytest.raises(IntegrityError):
+        a_task.fail(ValueError("Oops"))
+
+    assert _db_task(a_task).state == BackgroundTask.STATES.running
+
+
 def test_bgtask_start_again(a_task):
     a_task.start()
     import time
@@ -68,3 +85,250 @@ def test_set_steps(a_task):
     a_task.refresh_from_db()
     assert a_task.steps_to_complete == 20
     assert a_task.steps_completed == 0
+
+
+def _db_task(task):
+    return BackgroundTask.objects.get(id=task.id)
+
+
+def test_progress_buffer_flushes_every_n(a_task):
+    a_task.start()
+    a_task.set_steps_to_complete(100)
+
+    with a_task.progress_buffer(flush_every_n=10, flush_every_s=None):
+        for _ in range(9):
+            a_task.add_successful_steps(1)
+        assert _db_task(a_task).steps_completed == 0
+
+        a_task.add_successful_steps(1)
+        assert _db_task(a_task).steps_completed == 10
+
+        for _ in range(5):
+            a_task.add_successful_steps(1)
+        assert _db_task(a_task).steps_completed == 10
+
+    assert _db_task(a_task).steps_completed == 15
+
+
+def test_progress_buffer_flushes_on_exception(a_task):
+    a_task.start()
+    a_task.set_steps_to_complete(100)
+
+    with pytest.raises(Exception, match="boom"):
+        with a_task.progress_buffer(flush_every_s=None):
+            a_task.add_successful_steps(2)
+            try:
+                raise Exception("step failed")
+            except Exception as exc:
+                a_task.steps_failed(1, steps_identifier="item 3", error=exc)
+            raise Exception("boom")
+
+    db_task = _db_task(a_task)
+    assert db_task.steps_completed == 3
+    assert db_task.num_failed_steps == 1
+    assert db_task.errors[0]["steps_identifiers"] == ["item 3"]
+    assert db_task.state == BackgroundTask.STATES.running
+
+
+def test_progress_buffer_flushes_on_finish(a_task):
+    a_task.start()
+    a_task.set_steps_to_complete(3)
+
+    with a_task.progress_buffer(flush_every_s=None):
+        a_task.add_successful_steps(1)
+        a_task.steps_failed(1, error="bad item")
+        a_task.finish()
+
+        db_task = _db_task(a_task)
+        assert db_task.state == BackgroundTask.STATES.partial_success
+        assert db_task.steps_completed == 2
+        assert db_task.num_failed_steps == 1
+
+
+def test_progress_buffer_finishes_when_all_steps_flushed(a_task):
+    a_task.start()
+    a_task.set_steps_to_complete(4)
+
+    with a_task.progress_buffer(flush_every_n=2, flush_every_s=None):
+        for _ in range(4):
+            a_task.add_successful_steps(1)
+
+    assert _db_task(a_task).state == BackgroundTask.STATES.success
+
+
+def test_add_successful_steps_does_not_lock(a_task, django_assert_num_queries):
+    a_task.start()
+    a_task.set_steps_to_complete(3)
+
+    # Just the UPDATE and the read back of the counters
+    with django_assert_num_queries(2):
+        a_task.add_successful_steps(1)
+
+    assert a_task.steps_completed == 1
+
+    # Another instance of the same task stepping concurrently isn't overwritten
+    BackgroundTask.objects.get(id=a_task.id).add_successful_steps(1)
+    a_task.add_successful_steps(1)
+    assert a_task.steps_completed == 3
+    assert _db_task(a_task).state == BackgroundTask.STATES.success
+
+
+def test_add_successful_steps_finishes_only_once(a_task):
+    a_task.start()
+    a_task.set_steps_to_complete(1)
+    other_instance = BackgroundTask.objects.get(id=a_task.id)
+
+    a_task.add_successful_steps(1)
+    assert a_task.state == BackgroundTask.STATES.success
+    completed_at = _db_task(a_task).completed_at
+
+    # A late step from another worker doesn't try to finish the task again
+    other_instance.add_successful_steps(1)
+    assert _db_task(a_task).completed_at == completed_at
+
+
+def test_add_successful_steps_finishes_from_values_it_read_back(a_task, mocker):
+    a_task.start()
+    a_task.set_steps_to_complete(2)
+    after_update = BackgroundTask._after_update
+
+    def after_update_then_overwritten(self, fields_to_read):
+        values = after_update(self, fields_to_read)
+        # As if another thread recording steps with this instance read back an earlier count
+        self.steps_completed = 1
+        return values
+
+    mocker.patch.object(BackgroundTask, "_after_update", after_update_then_overwritten)
+    a_task.add_successful_steps(1)
+    a_task.add_successful_steps(1)
+
+    assert _db_task(a_task).state == BackgroundTask.STATES.success
+
+
+def test_transitions_are_single_conditional_updates(a_task, django_assert_num_queries):
+    with django_assert_num_queries(1):
+        a_task.queue()
+    with django_assert_num_queries(1):
+        a_task.start()
+    assert a_task.state == BackgroundTask.STATES.running
+    assert _db_task(a_task).started_at == a_task.started_at
+
+
+def test_start_from_stale_instance_is_no_op(a_task):
+    stale_instance = BackgroundTask.objects.get(id=a_task.id)
+    a_task.start()
+
+    stale_instance.start()
+    assert stale_instance.state == BackgroundTask.STATES.running
+    assert stale_instance.started_at == a_task.started_at
+
+
+def test_transition_from_stale_instance_raises(a_task):
+    stale_instance = BackgroundTask.objects.get(id=a_task.id)
+    a_task.start()
+    a_task.succeed()
+
+    with pytest.raises(RuntimeError, match=r"cannot execute start as in state success"):
+        stale_instance.start()
+    assert stale_instance.state == BackgroundTask.STATES.success
+
+
+def test_save_defers_version(a_task, django_assert_num_queries):
+    a_task.start()
+    stale_instance = _db_task(a_task)
+    a_task.add_successful_steps(1)
+
+    stale_instance.name = "Renamed"
+    with django_assert_num_queries(1):
+        stale_instance.save()
+    assert stale_instance.version == 3
+    assert stale_instance.task_dict["name"] == "Renamed"
+
+
+def test_failed_save_restores_version(a_task, mocker):
+    a_task.start()
+    version = a_task.version
+    mocker.patch("django.db.models.Model.save", side_effect=IntegrityError("Oops"))
+
+    with pytest.raises(IntegrityError):
+        a_task.save()
+
+    assert a_task.version == version
+    assert a_task.task_dict["version"] == version
+
+
+def test_succeed_completes_steps(a_task):
+    a_task.start()
+    a_task.set_steps_to_complete(10)
+    a_task.succeed({"some": "result"})
+
+    db_task = _db_task(a_task)
+    assert db_task.steps_completed == a_task.steps_completed == 10
+    assert db_task.result == {"some": "result"}
+
+
+def test_steps_failed_inserts_error_records(a_task):
+    a_task.start()
+    a_task.set_steps_to_complete(3)
+
+    a_task.steps_failed(1, steps_identifier="item 1", error="bad item")
+    a_task.steps_failed(2, steps_identifier="items 2-3", error="bad items")
+
+    assert a_task.error_records.count() == 2
+    db_task = _db_task(a_task)
+    assert db_task.num_failed_steps == 3
+    assert [error["steps_identifiers"] for error in db_task.errors] == [["item 1"], ["items 2-3"]]
+    assert db_task.state == BackgroundTask.STATES.failed
+
+
+def test_progress_buffer_groups_errors_before_writing(a_task, django_assert_num_queries):
+    a_task.start()
+    a_task.set_steps_to_complete(10)
+
+    with a_task.progress_buffer(flush_every_s=None):
+        for ii in range(5):
+            a_task.steps_failed(1, steps_identifier=str(ii), error="bad item")
+
+        # Looking for the existing error, INSERTing the new one in a savepoint, the UPDATE of the
+        # counters and reading them back, all in a savepoint as we're in a test transaction
+        with django_assert_num_queries(8):
+            a_task._flush_progress_buffer()
+
+    assert _db_task(a_task).num_failed_steps == 5
+    assert len(a_task.errors) == 1
+    assert a_task.errors[0]["num_occurrences"] == 5
+
+
+def _fail_step(task, ii):
+    try:
+        raise ValueError(f"Item {ii} is bad")
+    except ValueError as exc:
+        task.steps_failed(1, steps_identifier=f"item {ii}", error=exc)
+
+
+def test_errors_grouped_by_fingerprint(a_task):
+    a_task.start()
+    num_failures = BackgroundTaskError.MAX_STEPS_IDENTIFIERS + 5
+    a_task.set_steps_to_complete(num_failures + 2)
+
+    for ii in range(num_failures):
+        _fail_step(a_task, ii)
+    try:
+        raise KeyError("other")
+    except KeyError as exc:
+        a_task.steps_failed(1, steps_identifier="other item", error=exc)
+
+    errors = _db_task(a_task).errors
+    assert len(errors) == 2
+
+    assert errors[0]["error_type"] == "ValueError"
+    assert errors[0]["error_message"] == "Item 0 is bad"
+    assert errors[0]["num_occurrences"] == errors[0]["num_failed_steps"] == num_failures
+    assert errors[0]["steps_identifiers"] == [
+        f"item {ii}" for ii in range(BackgroundTaskError.MAX_STEPS_IDENTIFIERS)
+    ]
+    assert errors[0]["first_seen"] < errors[0]["last_seen"]
+    assert "_fail_step" in errors[0]["traceback"]
+
+    assert errors[1]["error_type"] == "KeyError"
+    assert errors[1]["num_occurrences"] == 1
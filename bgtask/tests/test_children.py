@@ -0,0 +1,130 @@
+import json
+from datetime import timedelta
+
+import pytest
+
+from django.urls import reverse
+from django.utils import timezone
+
+from bgtask.models import BackgroundTask
+from bgtask.views import _stream_task_events
+
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def a_parent():
+    parent = BackgroundTask.objects.create(namespace="ns", name="A parent")
+    parent.start()
+    return parent
+
+
+def _run_child(child, num_steps, num_failed_steps=0):
+    child.start()
+    child.set_steps_to_complete(num_steps)
+    if num_failed_steps:
+        child.steps_failed(num_failed_steps, error=ValueError("Oops"))
+    if num_steps > num_failed_steps:
+        child.add_successful_steps(num_steps - num_failed_steps)
+
+
+def test_spawn_children(a_parent, django_assert_num_queries):
+    with django_assert_num_queries(1):
+        children = a_parent.spawn_children(["Download", "Parse"], steps_to_complete=10)
+
+    assert [(child.namespace, child.name) for child in a_parent.children.order_by("name")] == [
+        ("ns", "Download"),
+        ("ns", "Parse"),
+    ]
+    assert {child.steps_to_complete for child in children} == {10}
+
+
+def test_parent_finishes_with_last_child(a_parent):
+    first_child, second_child = a_parent.spawn_children(["A child"] * 2)
+
+    _run_child(first_child, 3)
+    rollup = BackgroundTask.objects.filter(id=a_parent.id).child_rollups()[str(a_parent.id)]
+    assert rollup == {
+        "num_children": 2,
+        "num_finished": 1,
+        "num_succeeded": 1,
+        "num_failed": 0,
+        "steps_to_complete": 3,
+        "steps_completed": 3,
+        "num_failed_steps": 0,
+        "state": BackgroundTask.STATES.running,
+    }
+    a_parent.refresh_from_db()
+    assert a_parent.state == BackgroundTask.STATES.running
+
+    _run_child(second_child, 2, num_failed_steps=1)
+    a_parent.refresh_from_db()
+    assert a_parent.state == BackgroundTask.STATES.partial_success
+    version = a_parent.version
+
+    # Only finished once
+    assert not a_parent.finish_from_children()
+    a_parent.refresh_from_db()
+    assert a_parent.version == version
+
+
+@pytest.mark.parametrize(
+    "failed_steps, state",
+    [((0, 0), BackgroundTask.STATES.success), ((1, 1), BackgroundTask.STATES.failed)],
+)
+def test_parent_state_from_children(a_parent, failed_steps, state):
+    for child, num_failed_steps in zip(a_parent.spawn_children(["A child"] * 2), failed_steps):
+        _run_child(child, 1, num_failed_steps=num_failed_steps)
+
+    a_parent.refresh_from_db()
+    assert a_parent.state == state
+
+
+def _get_tasks(client, params, **headers):
+    return client.get(reverse("bgtask:tasks"), params, HTTP_ACCEPT="application/json", **headers)
+
+
+def test_tasks_view_includes_rollups(client, a_parent, django_assert_max_num_queries):
+    children = a_parent.spawn_children(["A child"] * 5)
+    other_task = BackgroundTask.objects.create(name="Another task")
+    # Old enough that it's not sent again within the since cursor's overlap
+    BackgroundTask.objects.filter(id=other_task.id).update(
+        updated=timezone.now() - timedelta(minutes=1)
+    )
+    params = {"tasks": f"{a_parent.id},{other_task.id}", "include": "children"}
+    _run_child(children[0], 4, num_failed_steps=1)
+
+    with django_assert_max_num_queries(2):
+        response = _get_tasks(client, params)
+    tasks = response.json()
+    assert tasks[str(other_task.id)]["children"] is None
+    rollup = tasks[str(a_parent.id)]["children"]
+    assert (rollup["num_finished"], rollup["num_children"]) == (1, 5)
+    assert (rollup["steps_completed"], rollup["num_failed_steps"]) == (4, 1)
+
+    # Children progressing changes the ETag, and the parent is sent even though it hasn't changed
+    since = max(task["updated"] for task in tasks.values())
+    _run_child(children[1], 2)
+    response = _get_tasks(client, {**params, "since": since}, HTTP_IF_NONE_MATCH=response["ETag"])
+    assert response.status_code == 200
+    assert list(response.json()) == [str(a_parent.id)]
+    assert response.json()[str(a_parent.id)]["children"]["steps_completed"] == 6
+
+
+def test_stream_sends_rollups(settings, a_parent):
+    settings.BGTASK_STREAM_POLL_INTERVAL_S = 0
+    first_child, second_child = a_parent.spawn_children(["A child"] * 2)
+
+    events = _stream_task_events({str(a_parent.id)}, include={"children"})
+    next(events)
+    next(events)
+
+    _run_child(first_child, 1)
+    status = json.loads(next(events).removeprefix("data: "))[str(a_parent.id)]
+    assert status["children"]["num_finished"] == 1
+
+    _run_child(second_child, 1)
+    status = json.loads(next(events).removeprefix("data: "))[str(a_parent.id)]
+    assert status["state"] == BackgroundTask.STATES.success
+    assert next(events) == "event: end\ndata: {}\n\n"
@@ -0,0 +1,118 @@
+import uuid
+from datetime import timedelta
+
+import pytest
+
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+
+from bgtask.backends import db_queue
+from bgtask.models import BackgroundTask, BackgroundTaskJob
+
+
+def succeed_task(task, result, steps=None):
+    task.start()
+    if steps is not None:
+        task.set_steps_to_complete(len(steps))
+    task.succeed(result)
+
+
+def raise_an_exception(task):
+    task.start()
+    raise Exception("Something went wrong")
+
+
+@pytest.mark.django_db
+def test_dispatch_stores_job_and_queues_task(a_task):
+    job = db_queue.dispatch(succeed_task, a_task, {"some": "result"}, steps=[1, uuid.uuid4()])
+
+    a_task.refresh_from_db()
+    assert a_task.state == BackgroundTask.STATES.queued
+    assert job.task == a_task
+    assert job.func == f"{__name__}.succeed_task"
+    assert job.kwargs["steps"][1]["__bgtask_type__"] == "uuid"
+
+
+@pytest.mark.django_db
+def test_dispatch_leaves_task_unqueued_if_job_not_stored(a_task, mocker):
+    mocker.patch.object(BackgroundTaskJob.objects, "create", side_effect=IntegrityError("Oops"))
+
+    with pytest.raises(IntegrityError):
+        db_queue.dispatch(succeed_task, a_task, None)
+
+    a_task.refresh_from_db()
+    assert a_task.state == BackgroundTask.STATES.not_started
+
+
+@pytest.mark.django_db
+def test_dispatch_many_queues_tasks_in_one_update(django_assert_num_queries):
+    tasks = [BackgroundTask.objects.create(name="A task") for _ in range(5)]
+    tasks[0].queue()
+
+    # The update and insert, in a savepoint
+    with django_assert_num_queries(4):
+        jobs = db_queue.dispatch_many(succeed_task, [(task, None) for task in tasks])
+
+    assert [job.task for job in jobs] == tasks
+    assert {task.state for task in tasks} == {BackgroundTask.STATES.queued}
+    assert set(BackgroundTask.objects.values_list("state", flat=True)) == {
+        BackgroundTask.STATES.queued
+    }
+
+
+@pytest.mark.django_db
+def test_dispatch_rejects_unserialisable_calls(a_task):
+    with pytest.raises(TypeError, match="cannot be imported"):
+        db_queue.dispatch(lambda task: None, a_task)
+
+    with pytest.raises(TypeError, match="cannot be passed to a background task"):
+        db_queue.dispatch(succeed_task, a_task, object())
+
+    assert not BackgroundTaskJob.objects.exists()
+
+
+@pytest.mark.django_db
+def test_worker_runs_jobs(a_task):
+    failing_task = BackgroundTask.objects.create(name="A failing task")
+    db_queue.dispatch(succeed_task, a_task, "result", steps=BackgroundTask.objects.all())
+    db_queue.dispatch(raise_an_exception, failing_task)
+
+    call_command("bgtask_worker", "--once")
+
+    a_task.refresh_from_db()
+    assert a_task.state == BackgroundTask.STATES.success
+    assert a_task.result == "result"
+    assert a_task.steps_to_complete == 2
+
+    failing_task.refresh_from_db()
+    assert failing_task.state == BackgroundTask.STATES.failed
+    assert failing_task.errors[0]["error_message"] == "Something went wrong"
+
+    assert not BackgroundTaskJob.objects.exists()
+
+
+@pytest.mark.django_db
+def test_claimed_jobs_are_not_claimed_again(a_task):
+    db_queue.dispatch(succeed_task, a_task, None)
+
+    assert len(db_queue.claim_jobs("worker 1", 10)) == 1
+    assert db_queue.claim_jobs("worker 2", 10) == []
+    assert len(db_queue.claim_jobs("worker 2", 10, reclaim_after=timedelta(0))) == 1
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.skipif(
+    connection.vendor == "sqlite",
+    reason="SQLite locks tables rather than rows, so concurrent workers fail to claim jobs",
+)
+def test_concurrent_workers_run_each_job_once():
+    tasks = [BackgroundTask.objects.create(name="A task") for _ in range(10)]
+    for task in tasks:
+        db_queue.dispatch(succeed_task, task, None)
+
+    db_queue.run_worker(concurrency=4, batch_size=2, poll_interval=0.01, once=True)
+
+    assert set(BackgroundTask.objects.values_list("state", flat=True)) == {
+        BackgroundTask.STATES.success
+    }
+    assert not BackgroundTaskJob.objects.exists()
@@ -0,0 +1,161 @@
+import threading
+import time
+
+import pytest
+
+from django.contrib import messages
+from django.core.management import call_command
+from django.db import connection
+from django.urls import reverse
+
+from bgtask.backends import thread_pool
+from bgtask.backends.calls import deserialize_call, serialize_call
+from bgtask.decorators import _run_bg_task_chunks
+from bgtask.models import BackgroundTask
+from bgtask.snapshots import RequestSnapshot, StreamedQueryset
+from bgtask.utils import chunked
+from django_app.models import ModelWithBackgroundActions
+
+
+needs_concurrent_writes = pytest.mark.skipif(
+    connection.vendor == "sqlite",
+    reason="SQLite locks whole tables, so lanes updating the task at once fail",
+)
+
+
+@pytest.mark.django_db(transaction=True)
+@needs_concurrent_writes
+def test_chunked_action_fans_out(admin_client):
+    objs = [ModelWithBackgroundActions.objects.create(name=f"Object {ii}") for ii in range(25)]
+
+    response = admin_client.post(
+        reverse("admin:django_app_modelwithbackgroundactions_changelist"),
+        {"action": "append_to_text_in_chunks", "_selected_action": [obj.pk for obj in objs]},
+    )
+    assert response.status_code == 302
+    thread_pool.shutdown(wait=True)
+
+    task = BackgroundTask.objects.get(name="AdminTask-append_to_text_in_chunks")
+    assert task.state == BackgroundTask.STATES.success
+    assert (task.steps_to_complete, task.steps_completed) == (25, 25)
+    assert set(ModelWithBackgroundActions.objects.values_list("text", flat=True)) == {"."}
+
+
+@pytest.mark.django_db
+def test_failed_chunks_fail_their_steps():
+    objs = [ModelWithBackgroundActions.objects.create(name=f"Object {ii}") for ii in range(5)]
+    task = BackgroundTask.objects.create(name="A task")
+    task.start()
+    task.set_steps_to_complete(5)
+
+    def fail_for_first_object(bg_task, request, queryset):
+        if objs[0] in queryset:
+            raise ValueError("Oops")
+
+    # Two lanes running 3 chunks
+    pks = [obj.pk for obj in objs]
+    _run_bg_task_chunks(
+        fail_for_first_object, task.id, None, ModelWithBackgroundActions, [pks[:2], pks[4:]]
+    )
+    task.refresh_from_db()
+    assert task.state == BackgroundTask.STATES.running
+    _run_bg_task_chunks(
+        fail_for_first_object, task.id, None, ModelWithBackgroundActions, [pks[2:4]]
+    )
+
+    task.refresh_from_db()
+    assert task.state == BackgroundTask.STATES.partial_success
+    assert (task.steps_completed, task.num_failed_steps) == (5, 2)
+    assert task.errors[0]["steps_identifiers"] == [f"{pks[0]}-{pks[1]}"]
+
+
+@pytest.mark.django_db(transaction=True)
+@needs_concurrent_writes
+def test_lanes_in_threads_finish_task_once():
+    objs = [ModelWithBackgroundActions.objects.create(name=f"Object {ii}") for ii in range(12)]
+    task = BackgroundTask.objects.create(name="A task")
+    task.start()
+    task.set_steps_to_complete(12)
+
+    def slow_action(bg_task, request, queryset):
+        time.sleep(0.01)
+
+    pks = [obj.pk for obj in objs]
+    chunks = list(chunked(pks, 2))
+    lanes = [
+        threading.Thread(
+            target=_run_bg_task_chunks,
+            args=(slow_action, task.id, None, ModelWithBackgroundActions, chunks[lane::3]),
+        )
+        for lane in range(3)
+    ]
+    for lane in lanes:
+        lane.start()
+    for lane in lanes:
+        lane.join()
+
+    task.refresh_from_db()
+    assert task.state == BackgroundTask.STATES.success
+    assert (task.steps_completed, task.num_failed_steps) == (12, 0)
+
+
+@pytest.mark.django_db
+def test_streamed_queryset_fetches_in_chunks(django_assert_num_queries):
+    objs = [ModelWithBackgroundActions.objects.create(name=f"Object {ii}") for ii in range(25)]
+    objects = StreamedQueryset.from_queryset(
+        ModelWithBackgroundActions.objects.order_by("-pk"), chunk_size=10
+    )
+
+    with django_assert_num_queries(3):
+        assert {obj.pk for obj in objects} == {obj.pk for obj in objs}
+    assert len(objects) == 25
+    assert objects.filter(name="Object 3").get() == objs[3]
+
+
+@pytest.mark.django_db
+def test_snapshots_are_serialisable(admin_user, rf):
+    request = rf.post("/admin/")
+    request.user = admin_user
+    objs = [ModelWithBackgroundActions.objects.create(name=f"Object {ii}") for ii in range(3)]
+
+    call = serialize_call(
+        print,
+        [
+            RequestSnapshot.from_request(request),
+            StreamedQueryset.from_queryset(ModelWithBackgroundActions.objects.all(), chunk_size=2),
+        ],
+        {},
+    )
+    _, (request_snapshot, objects), _ = deserialize_call(call)
+
+    assert (request_snapshot.method, request_snapshot.path) == ("POST", "/admin/")
+    assert request_snapshot.user == admin_user
+    assert (objects.model, objects.chunk_size) == (ModelWithBackgroundActions, 2)
+    assert set(objects) == set(objs)
+
+
+def test_request_snapshot_collects_messages():
+    request_snapshot = RequestSnapshot()
+
+    messages.warning(request_snapshot, "Careful")
+
+    assert request_snapshot.user is None
+    assert request_snapshot.messages == [(messages.WARNING, "Careful")]
+
+
+@pytest.mark.django_db
+def test_chunked_action_runs_in_worker(admin_client, settings):
+    settings.BGTASK_BACKEND = "bgtask.backends.db_queue"
+    objs = [ModelWithBackgroundActions.objects.create(name=f"Object {ii}") for ii in range(25)]
+
+    admin_client.post(
+        reverse("admin:django_app_modelwithbackgroundactions_changelist"),
+        {"action": "append_to_text_in_chunks", "_selected_action": [obj.pk for obj in objs]},
+    )
+    assert not ModelWithBackgroundActions.objects.filter(text=".").exists()
+
+    call_command("bgtask_worker", "--once")
+
+    task = BackgroundTask.objects.get(name="AdminTask-append_to_text_in_chunks")
+    assert task.state == BackgroundTask.STATES.success
+    assert set(ModelWithBackgroundActions.objects.values_list("text", flat=True)) == {"."}
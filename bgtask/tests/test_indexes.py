@@ -0,0 +1,58 @@
+import pytest
+
+from django.contrib import admin
+from django.db import connection
+
+from bgtask.models import BackgroundTask
+from django_app.models import ModelWithBackgroundActions
+
+pytestmark = [
+    pytest.mark.django_db,
+    pytest.mark.skipif(
+        connection.vendor != "postgresql", reason="Query plans are checked on PostgreSQL"
+    ),
+]
+
+
+@pytest.fixture(autouse=True)
+def prefer_indexes():
+    # The test tables are far too small for the planner to choose an index otherwise
+    with connection.cursor() as cursor:
+        cursor.execute("SET LOCAL enable_seqscan = off")
+
+
+def test_admin_bg_tasks_uses_indexes(rf, admin_user):
+    request = rf.get("/")
+    request.user = admin_user
+    model_admin = admin.site._registry[ModelWithBackgroundActions]
+
+    plan = model_admin._admin_bg_tasks(request).explain()
+
+    assert "bgtask_active_nsn_idx" in plan
+    assert "bgtask_nsn_completed_at_idx" in plan
+
+
+def test_queue_lookups_use_indexes():
+    task = BackgroundTask.objects.create(name="A task")
+
+    plan = BackgroundTask.objects.filter(id=task.id).with_position_in_queue().explain()
+    assert "Seq Scan" not in plan
+    assert "bgtask_active_nsn_idx" in plan
+
+    plan = (
+        BackgroundTask.objects.filter(queued_at__isnull=False, state=BackgroundTask.STATES.queued)
+        .filter(namespace="", name="A task")
+        .order_by("queued_at")
+        .explain()
+    )
+    assert "bgtask_active_nsn_idx" in plan
+
+
+def test_most_recently_unqueued_task_uses_index():
+    plan = (
+        BackgroundTask.objects.filter(queued_at__isnull=False, namespace="", name="A task")
+        .exclude(state__in=[BackgroundTask.STATES.not_started, BackgroundTask.STATES.queued])
+        .order_by("-queued_at")[:1]
+        .explain()
+    )
+    assert "Index Scan Backward using bgtask_nsn_queued_at_idx" in plan
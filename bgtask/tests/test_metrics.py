@@ -0,0 +1,79 @@
+import re
+import threading
+
+import pytest
+
+from django.urls import reverse
+
+from bgtask import metrics
+from bgtask.backends import thread_pool
+from bgtask.models import BackgroundTask
+
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def clear_metrics():
+    metrics.clear()
+    yield
+    metrics.clear()
+
+
+def _sample(text, sample):
+    match = re.search(rf"^{re.escape(sample)} (\S+)$", text, re.MULTILINE)
+    return None if match is None else float(match.group(1))
+
+
+def test_transitions_and_steps_are_recorded():
+    task = BackgroundTask.objects.create(namespace="ns", name="A task")
+    task.queue()
+    task.start()
+    task.set_steps_to_complete(3)
+    task.steps_failed(1, error=ValueError("Oops"))
+    task.add_successful_steps(2)
+
+    text = metrics.render()
+    labels = 'namespace="ns",name="A task"'
+    for state in ["queued", "running", "partial_success"]:
+        assert _sample(text, f'bgtask_transitions_total{{{labels},state="{state}"}}') == 1
+    assert _sample(text, f"bgtask_queue_wait_seconds_count{{{labels}}}") == 1
+    assert (
+        _sample(text, f'bgtask_run_seconds_bucket{{{labels},state="partial_success",le="+Inf"}}')
+        == 1
+    )
+    assert _sample(text, f"bgtask_steps_total{{{labels}}}") == 3
+    assert _sample(text, f"bgtask_failed_steps_total{{{labels}}}") == 1
+
+
+def test_counters_are_thread_safe():
+    def increment():
+        for _ in range(1000):
+            metrics.STEPS.inc(namespace="", name="A task")
+
+    threads = [threading.Thread(target=increment) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert list(metrics.STEPS.samples()) == [
+        ("bgtask_steps_total", {"namespace": "", "name": "A task"}, 8000)
+    ]
+
+
+def test_metrics_view(client, django_assert_num_queries):
+    for name, state in [("A task", "queued"), ("A task", "queued"), ('A "quoted" task', "running")]:
+        BackgroundTask.objects.create(name=name, state=state)
+    thread_pool.dispatch(lambda: None).result()
+
+    with django_assert_num_queries(1):
+        response = client.get(reverse("bgtask:metrics"))
+
+    assert response["Content-Type"].startswith("text/plain; version=0.0.4")
+    text = response.content.decode()
+    assert _sample(text, 'bgtask_tasks{namespace="",name="A task",state="queued"}') == 2
+    quoted_sample = r'bgtask_tasks{namespace="",name="A \"quoted\" task",state="running"}'
+    assert _sample(text, quoted_sample) == 1
+    assert _sample(text, 'bgtask_dispatched_total{backend="thread_pool"}') == 1
+    assert "# TYPE bgtask_queue_wait_seconds histogram" in text
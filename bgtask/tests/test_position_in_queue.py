@@ -0,0 +1,114 @@
+import random
+from datetime import timedelta
+
+import pytest
+
+from django.utils import timezone
+
+from bgtask.models import BackgroundTask
+
+pytestmark = pytest.mark.django_db
+
+
+def _reference_positions(tasks):
+    """How positions in the queue were calculated in python before with_position_in_queue()."""
+    recent_unqueued_task_by_nsn = {
+        (task.namespace, task.name): BackgroundTask.most_recently_unqueued_task(
+            task.namespace, task.name
+        )
+        for task in tasks
+    }
+    queued_tasks_by_nsn = BackgroundTask.queued_tasks_in_order_by_nsn_like(tasks)
+
+    positions = {}
+    for task in tasks:
+        if task.state != task.STATES.queued:
+            positions[task.id] = None
+            continue
+
+        unqueued_task = recent_unqueued_task_by_nsn[(task.namespace, task.name)]
+        if unqueued_task is not None and task.queued_at < unqueued_task.queued_at:
+            positions[task.id] = 0
+            continue
+
+        positions[task.id] = 0
+        for queued_task in queued_tasks_by_nsn[(task.namespace, task.name)]:
+            if queued_task.queued_at >= task.queued_at:
+                break
+            positions[task.id] += 1
+
+    return positions
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_position_in_queue_matches_reference(seed):
+    rand = random.Random(seed)
+    start = timezone.now()
+    STATES = BackgroundTask.STATES
+
+    def queued_at(state):
+        if state == STATES.not_started:
+            return None
+        # Only a few distinct times so that some tasks are queued at the same time, and mostly
+        # dispatched before the tasks still in the queue, as they would be.
+        earliest = 5 if state == STATES.queued else 0
+        return start + timedelta(seconds=rand.randrange(earliest, earliest + 15))
+
+    BackgroundTask.objects.bulk_create(
+        BackgroundTask(
+            namespace=rand.choice(["", "ns"]),
+            name=rand.choice(["a", "b", "c"]),
+            state=state,
+            queued_at=queued_at(state),
+        )
+        for state in rand.choices(
+            [
+                STATES.not_started,
+                STATES.queued,
+                STATES.running,
+                STATES.success,
+                STATES.partial_success,
+                STATES.failed,
+            ],
+            weights=[1, 12, 1, 1, 1, 1],
+            k=80,
+        )
+    )
+
+    tasks = list(BackgroundTask.objects.all())
+    expected_positions = _reference_positions(tasks)
+    assert any(expected_positions.values())
+
+    positions = dict(
+        BackgroundTask.objects.with_position_in_queue().values_list("id", "position_in_queue")
+    )
+    assert positions == expected_positions
+
+    # And when only some of the tasks are selected
+    some_ids = rand.sample(sorted(positions), 10)
+    assert {
+        task.id: task.position_in_queue
+        for task in BackgroundTask.objects.filter(id__in=some_ids).with_position_in_queue()
+    } == {task_id: expected_positions[task_id] for task_id in some_ids}
+
+
+def test_with_position_in_queue_is_one_query(django_assert_num_queries):
+    for _ in range(3):
+        BackgroundTask.objects.create(name="A task").queue()
+
+    with django_assert_num_queries(1):
+        assert [
+            task.position_in_queue
+            for task in BackgroundTask.objects.with_position_in_queue().order_by("queued_at")
+        ] == [0, 1, 2]
+
+
+def test_add_position_in_queue():
+    tasks = [BackgroundTask.objects.create(name="A task") for _ in range(2)]
+    for task in tasks:
+        task.queue()
+
+    assert [
+        task.position_in_queue
+        for task in BackgroundTask.objects.order_by("queued_at").add_position_in_queue()
+    ] == [0, 1]
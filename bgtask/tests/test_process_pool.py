@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+from django.db import connection
+
+from bgtask.backends import process_pool
+from bgtask.models import BackgroundTask
+
+
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+def succeed_task(task, queryset):
+    task.start()
+    task.set_steps_to_complete(queryset.count())
+    task.add_successful_steps(queryset.count())
+    return os.getpid()
+
+
+def raise_an_exception(task):
+    task.start()
+    raise ValueError("Something went wrong")
+
+
+@pytest.fixture(autouse=True)
+def fresh_process_pool(settings):
+    settings.BGTASK_PROCESS_POOL = {"start_method": "spawn", "max_workers": 1}
+    yield
+    process_pool.shutdown()
+
+
+needs_shared_database = pytest.mark.skipif(
+    connection.vendor == "sqlite" and connection.is_in_memory_db(),
+    reason="Child processes can't see an in-memory SQLite test database",
+)
+
+
+@needs_shared_database
+def test_runs_call_in_another_process(a_task):
+    BackgroundTask.objects.create(name="Another task")
+
+    child_pid = process_pool.dispatch(succeed_task, a_task, BackgroundTask.objects.all()).result()
+
+    assert child_pid != os.getpid()
+    a_task.refresh_from_db()
+    assert a_task.state == BackgroundTask.STATES.success
+    assert a_task.steps_completed == 2
+
+
+@needs_shared_database
+def test_failure_in_child_fails_task(a_task):
+    future = process_pool.dispatch(raise_an_exception, a_task)
+
+    with pytest.raises(ValueError, match="Something went wrong"):
+        future.result()
+
+    a_task.refresh_from_db()
+    assert a_task.state == BackgroundTask.STATES.failed
+    assert a_task.errors[0]["error_message"] == "Something went wrong"
+
+
+def test_fork_is_not_allowed(settings):
+    settings.BGTASK_PROCESS_POOL = {"start_method": "fork"}
+
+    with pytest.raises(ValueError, match="start_method"):
+        process_pool.dispatch(raise_an_exception, None)
@@ -0,0 +1,122 @@
+import pstats
+import sys
+import threading
+
+import pytest
+
+from django.urls import reverse
+
+from bgtask.decorators import _run_bg_task_func
+from bgtask.models import BackgroundTask, BackgroundTaskProfile
+
+
+pytestmark = pytest.mark.django_db
+
+
+def _square(value):
+    return value * value
+
+
+def slow_admin_action(bg_task, request, queryset):
+    assert sys.getprofile() is not None
+    sum(_square(ii) for ii in range(1000))
+
+
+def unprofiled_admin_action(bg_task, request, queryset):
+    assert sys.getprofile() is None
+
+
+def _run_task(func, **task_kwargs):
+    task = BackgroundTask.objects.create(name="A task", **task_kwargs)
+    task.start()
+    _run_bg_task_func(func, task, None, None)
+    task.refresh_from_db()
+    assert task.state == BackgroundTask.STATES.success
+    return task
+
+
+def test_profiling_is_off_by_default():
+    _run_task(unprofiled_admin_action)
+
+    assert not BackgroundTaskProfile.objects.exists()
+
+
+def test_profiled_task_stores_stats(client, tmp_path):
+    task = _run_task(slow_admin_action, profile=True)
+
+    top_functions = task.profile_stats.top_functions(5)
+    assert "slow_admin_action" in top_functions[0]["function"]
+    assert top_functions[0]["num_calls"] == 1
+
+    response = client.get(reverse("bgtask:task_profile", args=[task.id]))
+    assert response["Content-Disposition"] == f'attachment; filename="{task.id}.pstats"'
+    pstats_path = tmp_path / "task.pstats"
+    pstats_path.write_bytes(response.content)
+    assert pstats.Stats(str(pstats_path)).total_calls > 1000
+
+
+def test_profiled_task_names_setting(settings):
+    settings.BGTASK_PROFILED_TASKS = ["A task"]
+
+    task = _run_task(slow_admin_action)
+
+    assert BackgroundTaskProfile.objects.filter(task=task).exists()
+
+
+def test_task_admin_shows_profile(admin_client):
+    task = _run_task(slow_admin_action, profile=True)
+
+    content = admin_client.get(
+        reverse("admin:bgtask_backgroundtask_change", args=[task.id])
+    ).content.decode()
+
+    assert reverse("bgtask:task_profile", args=[task.id]) in content
+    assert "slow_admin_action" in content
+
+
+def test_unprofiled_task_has_no_profile(client):
+    task = _run_task(unprofiled_admin_action)
+
+    response = client.get(reverse("bgtask:task_profile", args=[task.id]))
+
+    assert response.status_code == 404
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_profiled_tasks_run_without_profiling():
+    first_running = threading.Event()
+    second_finished = threading.Event()
+
+    def first_action(bg_task, request, queryset):
+        first_running.set()
+        assert second_finished.wait(5)
+
+    first_task, second_task = (
+        BackgroundTask.objects.create(name=name, profile=True) for name in ["First", "Second"]
+    )
+    first_task.start()
+    second_task.start()
+    first_thread = threading.Thread(
+        target=_run_bg_task_func, args=(first_action, first_task, None, None)
+    )
+    first_thread.start()
+    assert first_running.wait(5)
+    _run_bg_task_func(unprofiled_admin_action, second_task, None, None)
+    second_finished.set()
+    first_thread.join()
+
+    for task in [first_task, second_task]:
+        task.refresh_from_db()
+        assert task.state == BackgroundTask.STATES.success
+    assert list(BackgroundTaskProfile.objects.values_list("task", flat=True)) == [first_task.id]
+
+
+def test_task_runs_if_profiler_cannot_be_enabled(mocker):
+    profiler_class = mocker.patch("bgtask.models.cProfile.Profile")
+    profiler_class.return_value.enable.side_effect = ValueError(
+        "Another profiling tool is already active"
+    )
+
+    _run_task(unprofiled_admin_action, profile=True)
+
+    assert not BackgroundTaskProfile.objects.exists()
@@ -0,0 +1,91 @@
+import gzip
+import json
+from datetime import timedelta
+from io import StringIO
+
+import pytest
+
+from django.core.management import call_command
+from django.utils import timezone
+
+from bgtask.models import BackgroundTask, BackgroundTaskDailyStats, BackgroundTaskError
+from bgtask.retention import expired_tasks, prune
+
+
+pytestmark = pytest.mark.django_db
+
+
+def _finished_task(name, days_ago, namespace="", state=BackgroundTask.STATES.success):
+    completed_at = timezone.now() - timedelta(days=days_ago)
+    task = BackgroundTask.objects.create(namespace=namespace, name=name)
+    BackgroundTask.objects.filter(id=task.id).update(
+        state=state, started_at=completed_at - timedelta(seconds=10), completed_at=completed_at
+    )
+    return task
+
+
+def _prune(*args):
+    stdout = StringIO()
+    call_command("bgtask_prune", *args, stdout=stdout)
+    return stdout.getvalue()
+
+
+def test_expired_tasks_follow_most_specific_policy():
+    tasks = {
+        "default": _finished_task("A task", 10),
+        "recent_default": _finished_task("A task", 1),
+        "by_namespace": _finished_task("Another task", 3, namespace="ns"),
+        "by_name": _finished_task("Kept task", 3, namespace="ns"),
+        "other_by_name": _finished_task("Short task", 2),
+    }
+    unfinished_task = BackgroundTask.objects.create(name="A task")
+    unfinished_task.start()
+    policies = {None: 5, ("ns", None): 2, ("ns", "Kept task"): None, ("", "Short task"): 1}
+
+    assert set(expired_tasks(policies)) == {
+        tasks["default"],
+        tasks["by_namespace"],
+        tasks["other_by_name"],
+    }
+    assert not expired_tasks({}).exists()
+
+
+def test_prune_in_batches_with_rollup():
+    for days_ago in [3, 3, 4]:
+        _finished_task("A task", days_ago)
+    failed_task = _finished_task("A task", 3, state=BackgroundTask.STATES.failed)
+    BackgroundTaskError.objects.create(task=failed_task, fingerprint="abc")
+
+    assert list(prune(BackgroundTask.objects.all(), batch_size=3, dry_run=True)) == [3, 1]
+    assert BackgroundTask.objects.count() == 4
+
+    assert list(prune(BackgroundTask.objects.all(), batch_size=3, rollup=True)) == [3, 1]
+    assert not BackgroundTask.objects.exists()
+    assert not BackgroundTaskError.objects.exists()
+
+    stats = BackgroundTaskDailyStats.objects.get(date=timezone.now().date() - timedelta(days=3))
+    assert (stats.num_tasks, stats.num_succeeded, stats.num_failed) == (3, 2, 1)
+    assert stats.success_rate == 2 / 3
+    assert stats.mean_duration == timedelta(seconds=10)
+
+    # Pruning more tasks later adds them to the same day's stats
+    _finished_task("A task", 3)
+    list(prune(BackgroundTask.objects.all(), rollup=True))
+    stats.refresh_from_db()
+    assert stats.num_tasks == 4
+
+
+def test_prune_command(tmp_path, settings):
+    settings.BGTASK_RETENTION_DAYS = {None: 30}
+    old_task = _finished_task("A task", 40)
+    recent_task = _finished_task("A task", 20)
+    archive_path = tmp_path / "tasks.jsonl.gz"
+
+    assert _prune("--dry-run").startswith("Would delete 1 tasks")
+    assert _prune("--archive-to", str(archive_path)).startswith("Deleted 1 tasks")
+    assert list(BackgroundTask.objects.all()) == [recent_task]
+    with gzip.open(archive_path, "rt") as archive:
+        assert [json.loads(line)["id"] for line in archive] == [str(old_task.id)]
+
+    assert _prune().startswith("Deleted 0 tasks")
+    assert _prune("--days", "10").startswith("Deleted 1 tasks")
@@ -0,0 +1,146 @@
+from datetime import timedelta
+
+import pytest
+
+from django.core.cache import caches
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from bgtask import status_cache
+from bgtask.models import BackgroundTask
+
+
+# Not in a test transaction, so that statuses are written as soon as tasks are updated
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+@pytest.fixture(autouse=True)
+def a_status_cache(settings):
+    settings.CACHES = {
+        **settings.CACHES,
+        "bgtask": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    }
+    settings.BGTASK_STATUS_CACHE = "bgtask"
+    yield caches["bgtask"]
+    caches["bgtask"].clear()
+
+
+def _cached_status(task):
+    return status_cache.get_many([str(task.id)]).get(str(task.id))
+
+
+def test_updates_write_through(a_task):
+    assert _cached_status(a_task) is None
+
+    a_task.start()
+    assert _cached_status(a_task)["state"] == BackgroundTask.STATES.running
+    assert _cached_status(a_task)["version"] == a_task.version == 1
+
+    a_task.set_steps_to_complete(10)
+    assert _cached_status(a_task)["steps_to_complete"] == 10
+    assert _cached_status(a_task)["version"] == a_task.version == 2
+
+    a_task.steps_failed(2, error=ValueError("Oops"))
+    a_task.add_successful_steps(8)
+    status = _cached_status(a_task)
+    assert status["state"] == BackgroundTask.STATES.partial_success
+    assert status["steps_completed"] == 10
+    assert status["num_failed_steps"] == 2
+    assert {**status, "position_in_queue": None} == (
+        BackgroundTask.objects.filter(id=a_task.id).status_dicts()[0]
+    )
+
+
+def test_older_versions_are_not_written(a_task):
+    a_task.start()
+    stale_status = {**_cached_status(a_task), "state": BackgroundTask.STATES.queued}
+    a_task.succeed("result")
+
+    status_cache.write(stale_status)
+    status_cache.fill([stale_status])
+
+    assert _cached_status(a_task)["state"] == BackgroundTask.STATES.success
+
+
+def test_rolled_back_updates_are_not_written(a_task):
+    a_task.start()
+
+    with pytest.raises(ValueError):
+        with transaction.atomic():
+            a_task.add_successful_steps(1)
+            assert _cached_status(a_task)["steps_completed"] is None
+            raise ValueError("Oops")
+
+    assert _cached_status(a_task)["version"] == 1
+
+    # The next update reuses the rolled back update's version
+    BackgroundTask.objects.get(id=a_task.id).set_steps_to_complete(10)
+    assert {**_cached_status(a_task), "position_in_queue": None} == (
+        BackgroundTask.objects.filter(id=a_task.id).status_dicts()[0]
+    )
+
+
+def test_updates_in_transactions_are_written_on_commit(a_task):
+    with transaction.atomic():
+        a_task.start()
+        assert _cached_status(a_task) is None
+
+    assert _cached_status(a_task)["state"] == BackgroundTask.STATES.running
+
+
+def test_queue_many_removes_statuses(a_task):
+    status_cache.fill(BackgroundTask.objects.filter(id=a_task.id).status_dicts())
+
+    BackgroundTask.objects.queue_many([a_task])
+
+    assert _cached_status(a_task) is None
+
+
+def test_stale_instance_save_still_increments_version(a_task):
+    a_task.start()
+    stale_instance = BackgroundTask.objects.get(id=a_task.id)
+    a_task.add_successful_steps(1)
+
+    stale_instance.name = "Renamed"
+    stale_instance.save()
+
+    assert stale_instance.version == 3
+    assert _cached_status(a_task)["name"] == "Renamed"
+
+
+def test_tasks_view_serves_from_cache(client, a_task, django_assert_num_queries):
+    queued_task = BackgroundTask.objects.create(name="A queued task")
+    queued_task.queue()
+    a_task.start()
+    url = reverse("bgtask:tasks")
+
+    with django_assert_num_queries(0):
+        tasks = client.get(url, {"tasks": str(a_task.id)}, HTTP_ACCEPT="application/json").json()
+    assert tasks[str(a_task.id)]["state"] == BackgroundTask.STATES.running
+
+    # Queued tasks' positions aren't cached
+    with django_assert_num_queries(1):
+        tasks = client.get(
+            url, {"tasks": f"{a_task.id},{queued_task.id}"}, HTTP_ACCEPT="application/json"
+        ).json()
+    assert tasks[str(queued_task.id)]["position_in_queue"] == 0
+
+    # Misses are filled from the database
+    caches["bgtask"].clear()
+    client.get(url, {"tasks": str(a_task.id)}, HTTP_ACCEPT="application/json")
+    assert _cached_status(a_task)["state"] == BackgroundTask.STATES.running
+
+
+def test_tasks_view_filters_cached_statuses_since_cursor(client, a_task, django_assert_num_queries):
+    queued_task = BackgroundTask.objects.create(name="A queued task")
+    queued_task.queue()
+    a_task.start()
+    params = {
+        "tasks": f"{a_task.id},{queued_task.id}",
+        "since": (timezone.now() + timedelta(minutes=1)).isoformat(),
+    }
+
+    with django_assert_num_queries(1):
+        tasks = client.get(reverse("bgtask:tasks"), params, HTTP_ACCEPT="application/json").json()
+    assert list(tasks) == [str(queued_task.id)]
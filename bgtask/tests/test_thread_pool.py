@@ -0,0 +1,137 @@
+import threading
+import time
+
+import pytest
+
+from bgtask.backends import thread_pool
+from bgtask.concurrency import set_max_concurrent
+from bgtask.models import BackgroundTask
+
+
+@pytest.fixture(autouse=True)
+def fresh_thread_pool(settings):
+    settings.BGTASK_THREAD_POOL = {"max_workers": 1, "max_queued": 1, "when_full": "reject"}
+    yield
+    thread_pool.shutdown()
+
+
+@pytest.fixture
+def release():
+    release = threading.Event()
+    yield release
+    release.set()
+
+
+def test_dispatch_returns_future_and_closes_connections(mocker):
+    close_old_connections = mocker.patch.object(thread_pool, "close_old_connections")
+
+    assert thread_pool.dispatch(lambda a, b=0: a + b, 1, b=2).result() == 3
+    assert close_old_connections.call_count == 2
+
+
+def test_counts_and_rejects_when_full(release):
+    started = threading.Event()
+
+    def wait_for_release():
+        started.set()
+        release.wait()
+
+    running = thread_pool.dispatch(wait_for_release)
+    started.wait()
+    queued = thread_pool.dispatch(release.wait)
+
+    assert thread_pool.active_workers() == 1
+    assert thread_pool.queue_depth() == 1
+
+    with pytest.raises(thread_pool.ThreadPoolFull):
+        thread_pool.dispatch(release.wait)
+
+    release.set()
+    running.result()
+    queued.result()
+    assert thread_pool.active_workers() == 0
+    assert thread_pool.queue_depth() == 0
+
+    # There is room again
+    thread_pool.dispatch(release.wait).result()
+
+
+def test_blocks_when_full(settings, release):
+    settings.BGTASK_THREAD_POOL = {"max_workers": 1, "max_queued": 0, "when_full": "block"}
+    thread_pool.dispatch(release.wait)
+
+    dispatched = threading.Event()
+
+    def dispatch_another():
+        thread_pool.dispatch(release.wait)
+        dispatched.set()
+
+    threading.Thread(target=dispatch_another).start()
+    assert not dispatched.wait(0.1)
+
+    release.set()
+    assert dispatched.wait(1)
+
+
+def test_holds_calls_over_concurrency_limit(settings, release):
+    settings.BGTASK_THREAD_POOL = {"max_workers": 4}
+    set_max_concurrent("Limited", 1)
+    limited_task = BackgroundTask(name="Limited")
+    other_task = BackgroundTask(name="Other")
+    started = []
+
+    def record_and_wait(task, ii):
+        started.append(ii)
+        release.wait()
+
+    try:
+        futures = [thread_pool.dispatch(record_and_wait, limited_task, ii) for ii in range(3)]
+        thread_pool.dispatch(record_and_wait, other_task, "other")
+        futures[2].cancel()
+
+        wait_for(lambda: len(started) == 2)
+        assert sorted(started, key=str) == [0, "other"]
+        assert thread_pool.active_workers() == 2
+        assert thread_pool.queue_depth() == 2
+
+        release.set()
+        futures[1].result(timeout=1)
+        assert started[2:] == [1]
+        assert futures[2].cancelled()
+        wait_for(lambda: thread_pool.queue_depth() == thread_pool.active_workers() == 0)
+    finally:
+        set_max_concurrent("Limited", None)
+
+
+def test_admin_declares_concurrency_limits():
+    from bgtask.concurrency import max_concurrent_for
+
+    # The test site's admin is registered when Django is set up
+    namespace = "django_app.admin.ModelWithBackgroundActionsAdmin"
+    assert max_concurrent_for(BackgroundTask(name="Queued task", namespace=namespace)) == 1
+
+
+def test_warns_if_backend_does_not_enforce_limits(settings, caplog):
+    settings.BGTASK_BACKEND = "bgtask.backends.db_queue"
+    try:
+        set_max_concurrent("Limited", 1)
+    finally:
+        set_max_concurrent("Limited", None)
+
+    assert "bgtask.backends.db_queue doesn't enforce concurrency limits" in caplog.text
+
+    caplog.clear()
+    settings.BGTASK_BACKEND = "bgtask.backends.thread_pool"
+    try:
+        set_max_concurrent("Limited", 1)
+    finally:
+        set_max_concurrent("Limited", None)
+
+    assert not caplog.records
+
+
+def wait_for(condition, timeout=1):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out"
+        time.sleep(0.01)
@@ -0,0 +1,226 @@
+import json
+import time
+from datetime import timedelta
+
+import pytest
+
+from asgiref.sync import async_to_sync
+from django.db import connection
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from bgtask.models import BackgroundTask
+from bgtask.views import _stream_task_events
+
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def fast_stream(settings):
+    settings.BGTASK_STREAM = True
+    settings.BGTASK_STREAM_POLL_INTERVAL_S = 0
+
+
+def _event_data(event):
+    assert event.startswith("data: ")
+    return json.loads(event.removeprefix("data: "))
+
+
+def test_stream_sends_only_changed_tasks(a_task):
+    other_task = BackgroundTask.objects.create(name="Another task")
+    other_task.start()
+    a_task.start()
+
+    events = _stream_task_events({str(a_task.id), str(other_task.id)})
+    assert next(events) == "retry: 0\n\n"
+    assert set(_event_data(next(events))) == {str(a_task.id), str(other_task.id)}
+
+    a_task.set_steps_to_complete(2)
+    a_task.add_successful_steps(1)
+    tasks = _event_data(next(events))
+    assert list(tasks) == [str(a_task.id)]
+    assert tasks[str(a_task.id)]["steps_completed"] == 1
+
+    a_task.succeed()
+    other_task.succeed()
+    assert {task["state"] for task in _event_data(next(events)).values()} == {"success"}
+    assert next(events) == "event: end\ndata: {}\n\n"
+    assert list(events) == []
+
+
+def test_stream_view(client, a_task, settings):
+    settings.BGTASK_STREAM_MAX_AGE_S = 0
+    a_task.start()
+
+    response = client.get(reverse("bgtask:tasks_stream"), {"tasks": str(a_task.id)})
+
+    assert response["Content-Type"] == "text/event-stream"
+    events = [chunk.decode() for chunk in response.streaming_content]
+    assert len(events) == 2
+    assert _event_data(events[1])[str(a_task.id)]["state"] == "running"
+
+
+def test_stream_view_asgi_sends_events_as_they_happen(async_client, a_task, settings):
+    settings.BGTASK_STREAM_POLL_INTERVAL_S = 0.05
+    settings.BGTASK_STREAM_MAX_AGE_S = 1
+    a_task.start()
+    events = []
+
+    @async_to_sync
+    async def read_stream():
+        response = await async_client.get(reverse("bgtask:tasks_stream"), {"tasks": str(a_task.id)})
+        started = time.monotonic()
+        async for chunk in response:
+            events.append((time.monotonic() - started, chunk.decode()))
+        return time.monotonic() - started
+
+    stream_s = read_stream()
+
+    # The task never finishes so the stream lasts until it expires, but its first event has to
+    # be sent straight away rather than when the stream ends.
+    first_data_s = next(elapsed_s for elapsed_s, event in events if event.startswith("data: "))
+    assert first_data_s < 0.5
+    assert stream_s >= 1
+
+
+@pytest.mark.parametrize("tasks", ["", "not-a-uuid", "2b1aa0c7-5a7e-4c9e-9ed0-2d6a4f9d6a3e"])
+def test_stream_view_bad_tasks(client, tasks):
+    response = client.get(reverse("bgtask:tasks_stream"), {"tasks": tasks})
+
+    assert response.status_code == 400
+
+
+def test_stream_view_not_enabled(client, a_task, settings):
+    settings.BGTASK_STREAM = False
+
+    response = client.get(reverse("bgtask:tasks_stream"), {"tasks": str(a_task.id)})
+
+    assert response.status_code == 404
+
+
+def _get_tasks(client, params, **headers):
+    return client.get(reverse("bgtask:tasks"), params, HTTP_ACCEPT="application/json", **headers)
+
+
+def test_tasks_view_since_cursor(client, a_task):
+    queued_task = BackgroundTask.objects.create(name="A queued task")
+    queued_task.queue()
+    a_task.start()
+    # Old enough that it's not sent again within the overlap
+    BackgroundTask.objects.filter(id=a_task.id).update(
+        updated=timezone.now() - timedelta(minutes=1)
+    )
+    task_ids = f"{a_task.id},{queued_task.id}"
+
+    tasks = _get_tasks(client, {"tasks": task_ids}).json()
+    assert set(tasks) == {str(a_task.id), str(queued_task.id)}
+
+    # Queued tasks are always included as their position in the queue may have changed
+    since = max(task["updated"] for task in tasks.values())
+    assert set(_get_tasks(client, {"tasks": task_ids, "since": since}).json()) == {
+        str(queued_task.id)
+    }
+
+    a_task.set_steps_to_complete(10)
+    tasks = _get_tasks(client, {"tasks": task_ids, "since": since}).json()
+    assert set(tasks) == {str(a_task.id), str(queued_task.id)}
+    assert tasks[str(a_task.id)]["steps_to_complete"] == 10
+
+    response = _get_tasks(client, {"tasks": task_ids, "since": "yesterday"})
+    assert response.status_code == 400
+
+
+def test_tasks_view_since_cursor_filters_in_database(client, a_task):
+    a_task.start()
+    since = (timezone.now() + timedelta(minutes=1)).isoformat()
+
+    with CaptureQueriesContext(connection) as queries:
+        response = _get_tasks(client, {"tasks": str(a_task.id), "since": since})
+
+    # Nothing has changed, which isn't an error
+    assert response.status_code == 200
+    assert response.json() == {}
+    assert len(queries) == 1
+    assert '"updated" >=' in queries[0]["sql"]
+
+
+def test_tasks_view_since_cursor_overlaps(client, a_task):
+    other_task = BackgroundTask.objects.create(name="Another task")
+    a_task.start()
+    other_task.start()
+    task_ids = f"{a_task.id},{other_task.id}"
+    since = max(task["updated"] for task in _get_tasks(client, {"tasks": task_ids}).json().values())
+
+    # An update timestamped before the cursor but committed after it was returned
+    BackgroundTask.objects.filter(id=a_task.id).update(
+        steps_to_complete=10,
+        updated=parse_datetime(since) - timedelta(seconds=1),
+        version=F("version") + 1,
+    )
+
+    tasks = _get_tasks(client, {"tasks": task_ids, "since": since}).json()
+    assert tasks[str(a_task.id)]["steps_to_complete"] == 10
+
+
+def test_tasks_view_not_modified(client, a_task):
+    a_task.start()
+    params = {"tasks": str(a_task.id)}
+
+    response = _get_tasks(client, params)
+    assert response.status_code == 200
+    etag = response["ETag"]
+
+    response = _get_tasks(client, params, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    assert response.content == b""
+
+    a_task.add_successful_steps(1)
+    response = _get_tasks(client, params, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response["ETag"] != etag
+
+
+def test_tasks_view_returns_statuses(client, a_task, django_assert_max_num_queries):
+    other_task = BackgroundTask.objects.create(name="Another task")
+    for task in [a_task, other_task]:
+        task.start()
+        task.set_steps_to_complete(3)
+        for ii in range(3):
+            task.steps_failed(1, steps_identifier=ii, error=ValueError(f"Error {ii}"))
+    task_ids = f"{a_task.id},{other_task.id}"
+
+    status = _get_tasks(client, {"tasks": task_ids}).json()[str(a_task.id)]
+    assert set(status) == {*BackgroundTask.STATUS_FIELDS, "position_in_queue"}
+    assert status["num_failed_steps"] == 3
+
+    # The errors for all the tasks are fetched together
+    with django_assert_max_num_queries(3):
+        tasks = _get_tasks(client, {"tasks": task_ids, "include": "errors,result"}).json()
+    assert [error["error_message"] for error in tasks[str(other_task.id)]["errors"]] == [
+        "Error 0",
+        "Error 1",
+        "Error 2",
+    ]
+    assert tasks[str(other_task.id)]["result"] is None
+
+    assert _get_tasks(client, {"tasks": task_ids, "include": "everything"}).status_code == 400
+
+
+def test_task_errors_view(client, a_task, settings):
+    settings.BGTASK_ERRORS_PAGE_SIZE = 2
+    a_task.start()
+    for ii in range(3):
+        a_task.steps_failed(1, error=ValueError(f"Error {ii}"))
+
+    url = reverse("bgtask:task_errors", args=[a_task.id])
+    page = client.get(url).json()
+    assert page["count"] == 3
+    assert page["num_pages"] == 2
+    assert [error["error_message"] for error in page["errors"]] == ["Error 0", "Error 1"]
+
+    page = client.get(url, {"page": 2}).json()
+    assert [error["error_message"] for error in page["errors"]] == ["Error 2"]
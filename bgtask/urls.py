@@ -1,4 +1,4 @@
-from django.urls import re_path
+from django.urls import path, re_path
 
 from . import views
 
@@ -7,4 +7,8 @@ app_name = "bgtask"
 
 urlpatterns = [
     re_path(r"tasks$", views.background_tasks_view, name="tasks"),
+    re_path(r"tasks/stream$", views.background_tasks_stream_view, name="tasks_stream"),
+    path("tasks/<uuid:task_id>/errors", views.background_task_errors_view, name="task_errors"),
+    path("tasks/<uuid:task_id>/profile", views.background_task_profile_view, name="task_profile"),
+    path("metrics", views.metrics_view, name="metrics"),
 ]
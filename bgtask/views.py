@@ -1,29 +1,173 @@
+import asyncio
+import hashlib
+import json
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db.models import Q
-from django.http import Http404, HttpResponseBadRequest, JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Exists, OuterRef, Q
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import render
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date
 
-from .models import BackgroundTask
+from . import metrics, status_cache
+from .models import BackgroundTask, BackgroundTaskError, BackgroundTaskProfile
 
 
 Q_NONE = Q(pk__in=[])
 
+# Whether the admin pages follow task progress through the stream rather than polling. Under WSGI
+# each open stream holds a worker, so it's off unless enabled with BGTASK_STREAM.
+STREAM = False
+# How often the stream checks for changes, how long a stream lasts before the browser has to
+# reconnect, and how often a comment is sent while nothing changes so that disconnected clients
+# are noticed.
+STREAM_POLL_INTERVAL_S = 1
+STREAM_MAX_AGE_S = 300
+STREAM_KEEPALIVE_S = 15
+STREAM_END_EVENT = "event: end\ndata: {}\n\n"
+
+# Tasks' updated times are set before their updates are committed, so an update can be committed
+# after a later one. Polls and streams look back this far before the latest updated time they've
+# seen so as not to miss those.
+UPDATED_OVERLAP = timedelta(seconds=5)
+
+# Fields that can be added to task statuses with the include query parameter
+INCLUDABLE_FIELDS = {"children", "errors", "result"}
+ERRORS_PAGE_SIZE = 100
+
 
 def _tasks_dict(tasks):
-    td = {str(task.id): task.task_dict for task in tasks}
+    rollups = tasks.child_rollups()
+    td = {str(task.id): {**task.task_dict, "children": rollups.get(str(task.id))} for task in tasks}
     return td
 
 
+def stream_enabled():
+    return getattr(settings, "BGTASK_STREAM", STREAM)
+
+
 def background_tasks_view_html(request, task):
     return render(
         request,
         "bgtask/bgtask_view.html",
-        {"tasks": _tasks_dict(task), "title": "Background tasks"},
+        {"tasks": _tasks_dict(task), "title": "Background tasks", "stream": stream_enabled()},
+    )
+
+
+def _include_param(request):
+    include = {field for field in request.GET.get("include", "").split(",") if field}
+    unknown = include - INCLUDABLE_FIELDS
+    if unknown:
+        raise ValidationError(f"Cannot include {', '.join(sorted(unknown))}")
+    return include
+
+
+def _since_param(request):
+    since = request.GET.get("since")
+    if not since:
+        return None
+    since_dt = parse_datetime(since)
+    if since_dt is None:
+        raise ValidationError(f"Bad since {since}")
+    return since_dt
+
+
+def background_tasks_view_json(request, tasks, task_ids=None):
+    try:
+        include = _include_param(request)
+        since = _since_param(request)
+    except ValidationError as exc:
+        return HttpResponseBadRequest(exc.message)
+
+    # Parents' children can progress without them being updated, so they're always sent with
+    # their rollups, which are part of the ETag as well as the tasks' versions.
+    rollups = tasks.child_rollups() if "children" in include else {}
+    updated_since = None
+    if since is not None:
+        # Queued tasks can change position without being updated, so are always sent. Tasks that
+        # haven't changed are resent within the overlap, but if none have changed the ETag still
+        # matches.
+        updated_since = since - UPDATED_OVERLAP
+        tasks = tasks.filter(
+            Q(updated__gte=updated_since)
+            | Q(state=BackgroundTask.STATES.queued)
+            | Q(id__in=list(rollups))
+        )
+
+    statuses = _task_statuses(tasks, task_ids, updated_since=updated_since, always_ids=rollups)
+    if not statuses and since is None:
+        raise ValidationError("Unfound tasks")
+
+    versions = sorted(
+        (status["id"], status["version"], status["position_in_queue"], rollups.get(status["id"]))
+        for status in statuses
+    )
+    etag = '"%s"' % hashlib.sha1(repr(versions).encode()).hexdigest()
+    last_modified = max((parse_datetime(status["updated"]) for status in statuses), default=since)
+
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified.timestamp())
     )
+    if response is None:
+        if include - {"children"} and statuses:
+            statuses = tasks.filter(id__in=[status["id"] for status in statuses]).status_dicts(
+                include=include - {"children"}
+            )
+        if "children" in include:
+            statuses = [{**status, "children": rollups.get(status["id"])} for status in statuses]
+        response = JsonResponse({status["id"]: status for status in statuses})
+
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified.timestamp())
+    # Let browsers cache the response but check it's still valid every time
+    response["Cache-Control"] = "private, no-cache"
+    return response
 
 
-def background_tasks_view_json(tasks):
-    return JsonResponse(_tasks_dict(tasks))
+def _task_statuses(tasks, task_ids=None, updated_since=None, always_ids=()):
+    """The status dicts of tasks, from the status cache where possible if it's enabled and the
+    tasks are those with task_ids. tasks should already be filtered to those updated since
+    updated_since, if it's set, which cached statuses are filtered to as well unless they're in
+    always_ids.
+    """
+    if task_ids is None or status_cache.get_cache() is None:
+        return tasks.status_dicts()
+
+    # Positions in queues depend on other tasks so queued tasks' statuses are always fetched
+    cached_statuses = {
+        task_id: status
+        for task_id, status in status_cache.get_many(task_ids).items()
+        if status["state"] != BackgroundTask.STATES.queued
+    }
+    uncached_ids = [task_id for task_id in task_ids if task_id not in cached_statuses]
+    statuses = {
+        task_id: {**status, "position_in_queue": None}
+        for task_id, status in cached_statuses.items()
+        if updated_since is None
+        or task_id in always_ids
+        or parse_datetime(status["updated"]) >= updated_since
+    }
+    if uncached_ids:
+        fetched_statuses = tasks.filter(id__in=uncached_ids).status_dicts()
+        status_cache.fill(
+            status for status in fetched_statuses if status["state"] != BackgroundTask.STATES.queued
+        )
+        statuses.update((status["id"], status) for status in fetched_statuses)
+    return list(statuses.values())
 
 
 def background_tasks_view(request):
@@ -35,19 +179,194 @@ def background_tasks_view(request):
     task_ids_q = Q(id__in=task_ids) if tasks else Q_NONE
     object_id_q = Q(acted_on_object_id=object_id) if object_id is not None else Q_NONE
     tasks = BackgroundTask.objects.filter(task_ids_q | object_id_q).order_by("-created")
+
+    accepts = request.headers.get("Accept", "").split(",")
     try:
-        if len(tasks) == 0:
+        if "application/json" in accepts:
+            return background_tasks_view_json(
+                request, tasks, task_ids if object_id is None else None
+            )
+
+        if not tasks.exists():
             raise ValidationError("Unfound tasks")
     except ValidationError:
         return HttpResponseBadRequest(f"Bad task id(s) {task_ids}")
     except BackgroundTask.DoesNotExist:
         raise Http404(f"Unknown task {task_ids}")
 
-    accepts = request.headers.get("Accept", "").split(",")
+    return background_tasks_view_html(request, tasks.with_position_in_queue())
+
+
+def background_task_errors_view(request, task_id):
+    """The errors of a task as JSON, a page at a time, for tasks with too many to poll."""
+    errors = BackgroundTaskError.objects.filter(task_id=task_id).values(
+        *BackgroundTaskError.DICT_FIELDS
+    )
+    paginator = Paginator(errors, getattr(settings, "BGTASK_ERRORS_PAGE_SIZE", ERRORS_PAGE_SIZE))
+    page = paginator.get_page(request.GET.get("page"))
+    return JsonResponse(
+        {
+            "errors": [BackgroundTaskError.values_to_dict(error) for error in page],
+            "page": page.number,
+            "num_pages": paginator.num_pages,
+            "count": paginator.count,
+        }
+    )
+
+
+async def background_tasks_stream_view(request):
+    """Stream the tasks listed in the 'tasks' query parameter as server-sent events.
+
+    Each "message" event's data is a JSON object of task dicts by id, like the JSON response of
+    background_tasks_view. The first event has all the tasks and later ones only those that have
+    changed. Finished tasks stop being watched, and an "end" event is sent once all have finished.
+
+    Under ASGI the events are sent from an async generator so that open streams don't hold a
+    thread, and under WSGI from a sync one so that they aren't buffered until the stream ends.
+    Unless BGTASK_STREAM is enabled there is no stream.
+    """
+    if not stream_enabled():
+        raise Http404("Streaming is not enabled")
+
+    tasks = request.GET.get("tasks", "")
+    if not tasks:
+        return HttpResponseBadRequest("Must pass 'tasks' as a query parameter")
+    try:
+        include = _include_param(request)
+    except ValidationError as exc:
+        return HttpResponseBadRequest(exc.message)
+
+    requested_ids = tasks.split(",")
+    try:
+        task_ids = await sync_to_async(_existing_task_ids)(requested_ids)
+    except ValidationError:
+        task_ids = None
+    if not task_ids:
+        return HttpResponseBadRequest(f"Bad task id(s) {requested_ids}")
+
+    stream_task_events = (
+        _astream_task_events if isinstance(request, ASGIRequest) else _stream_task_events
+    )
+    response = StreamingHttpResponse(
+        stream_task_events(task_ids, include), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    # Stop nginx from buffering the events
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def _existing_task_ids(task_ids):
+    return {
+        str(task_id)
+        for task_id in BackgroundTask.objects.filter(id__in=task_ids).values_list("id", flat=True)
+    }
+
+
+class _TaskEventStream:
+    """The state of a stream of task events, shared by the sync and async generators."""
+
+    def __init__(self, task_ids, include=()):
+        self.task_ids = task_ids
+        self.include = include
+        self.poll_interval_s = getattr(
+            settings, "BGTASK_STREAM_POLL_INTERVAL_S", STREAM_POLL_INTERVAL_S
+        )
+        self.max_age_s = getattr(settings, "BGTASK_STREAM_MAX_AGE_S", STREAM_MAX_AGE_S)
+        self.keepalive_s = getattr(settings, "BGTASK_STREAM_KEEPALIVE_S", STREAM_KEEPALIVE_S)
+
+        self.sent = {}
+        self.updated_since = None
+        self.started = self.last_sent = time.monotonic()
+
+    @property
+    def retry_event(self):
+        return f"retry: {int(self.poll_interval_s * 1000)}\n\n"
+
+    @property
+    def expired(self):
+        return time.monotonic() - self.started >= self.max_age_s
+
+    def poll(self):
+        """Check the tasks for changes, returning the event to send, if any."""
+        tasks = BackgroundTask.objects.filter(id__in=self.task_ids)
+        if self.updated_since is not None:
+            # Queued tasks can move up the queue without being updated. Tasks that haven't changed
+            # aren't resent.
+            changed_q = Q(updated__gte=self.updated_since - UPDATED_OVERLAP) | Q(
+                state=BackgroundTask.STATES.queued
+            )
+            if "children" in self.include:
+                # Children can progress without their parent being updated
+                changed_q |= Q(Exists(BackgroundTask.objects.filter(parent=OuterRef("pk"))))
+            tasks = tasks.filter(changed_q)
+
+        changed = {}
+        for status in tasks.status_dicts(include=self.include):
+            task_json = json.dumps(status, cls=DjangoJSONEncoder)
+            if self.sent.get(status["id"]) != task_json:
+                self.sent[status["id"]] = task_json
+                changed[status["id"]] = task_json
+            updated = parse_datetime(status["updated"])
+            if self.updated_since is None or updated > self.updated_since:
+                self.updated_since = updated
+            if status["state"] in BackgroundTask.FINISHED_STATES:
+                self.task_ids.discard(status["id"])
+
+        now = time.monotonic()
+        if changed:
+            data = ", ".join(f'"{task_id}": {task_json}' for task_id, task_json in changed.items())
+            self.last_sent = now
+            return f"data: {{{data}}}\n\n"
+        if now - self.last_sent >= self.keepalive_s:
+            self.last_sent = now
+            return ": keepalive\n\n"
+        return None
+
+
+def _stream_task_events(task_ids, include=()):
+    stream = _TaskEventStream(task_ids, include)
+    yield stream.retry_event
+
+    while stream.task_ids:
+        event = stream.poll()
+        if event is not None:
+            yield event
+        if stream.expired:
+            return
+        time.sleep(stream.poll_interval_s)
+
+    yield STREAM_END_EVENT
+
+
+async def _astream_task_events(task_ids, include=()):
+    stream = _TaskEventStream(task_ids, include)
+    poll = sync_to_async(stream.poll)
+    yield stream.retry_event
+
+    while stream.task_ids:
+        event = await poll()
+        if event is not None:
+            yield event
+        if stream.expired:
+            return
+        await asyncio.sleep(stream.poll_interval_s)
+
+    yield STREAM_END_EVENT
+
+
+def background_task_profile_view(request, task_id):
+    """Download the stats of a profiled task as a .pstats file."""
+    try:
+        profile = BackgroundTaskProfile.objects.get(task_id=task_id)
+    except BackgroundTaskProfile.DoesNotExist:
+        raise Http404(f"Task {task_id} has not been profiled")
 
-    tasks.add_position_in_queue()
+    response = HttpResponse(profile.pstats_data, content_type="application/octet-stream")
+    response["Content-Disposition"] = f'attachment; filename="{task_id}.pstats"'
+    return response
 
-    if "application/json" in accepts:
-        return background_tasks_view_json(tasks)
 
-    return background_tasks_view_html(request, tasks)
+def metrics_view(request):
+    """The metrics in bgtask.metrics, in the Prometheus text format."""
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -3,6 +3,7 @@ import time
 
 from django.contrib import admin
 
+from bgtask.admin import BGTaskChangeListMixin, background_task_status
 from bgtask.decorators import bgtask_admin_action
 from bgtask.model_admin import BGTaskModelAdmin
 
@@ -57,36 +58,40 @@ def do_something_in_the_background(bg_task, request, queryset):
     time.sleep(1)
 
 
+@bgtask_admin_action(chunk_size=10, parallelism=4)
+def append_to_text_in_chunks(bg_task, request, queryset):
+    for obj in queryset:
+        obj.text += "."
+        obj.save()
+
+
 @admin.register(ModelWithBackgroundActions)
-class ModelWithBackgroundActionsAdmin(BGTaskModelAdmin):
+class ModelWithBackgroundActionsAdmin(BGTaskChangeListMixin, BGTaskModelAdmin):
     change_list_template = "bgtask/admin/change_list.html"
 
-    list_display = ["name", "text"]
+    list_display = ["name", "text", background_task_status]
 
     actions = [
         do_something_in_the_background,
+        append_to_text_in_chunks,
         "queueing_action",
     ]
 
     bgtask_names = ["Queued task"]
+    bgtask_max_concurrent = {"Queued task": 1}
 
     def queueing_action(self, request, queryset):
-        from bgtask.backends import default_backend
-
-        for obj in queryset:
-            bgtask = self.queue_bgtask("Queued task")
-            default_backend.dispatch(self.execute_queued_task, obj, bgtask)
+        self.queue_bgtasks("Queued task", queryset, self.execute_queued_task)
 
     def execute_queued_task(self, obj, task):
+        # bgtask_max_concurrent only holds calls back in the thread pool, so wait for the tasks
+        # ahead in the queue in case another backend or process is running them.
         while pos_in_queue := (
-            type(task).objects.filter(id=task.id).add_position_in_queue().get().position_in_queue
+            type(task).objects.filter(id=task.id).with_position_in_queue().get().position_in_queue
         ):
             log.info("Not first in queue, sleeping %s", pos_in_queue)
             time.sleep(3)
 
-        log.info("First in queue, go! %s", pos_in_queue)
-        time.sleep(2)
-
         task.start()
         with task.finishes():
             log.info("Running task for obj %s", obj)
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-16 21:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_app", "0002_alter_modelwithbackgroundactions_options"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="modelwithbackgroundactions",
+            name="name",
+            field=models.CharField(max_length=1000),
+        ),
+    ]
@@ -5,7 +5,7 @@ from django.db.models import CharField, Model, TextField, UUIDField
 
 class ModelWithBackgroundActions(Model):
     id = UUIDField(default=uuid4, primary_key=True, editable=False)
-    name = CharField()
+    name = CharField(max_length=1000)
     text = TextField(blank=True, default='')
 
     class Meta: